@@ -0,0 +1,110 @@
+"""Compare gathering and aggregating the prices of the trading publishers of a
+price account in a loop over its components and sorted lists, and vectorized
+(`PythReplicator._manual_agg_prices` and `manual_aggregate`).
+
+Run with `python -m benchmarks.bench_manual_aggregate`.
+"""
+
+import random
+import timeit
+from typing import List
+
+from pythclient.pythaccounts import PythPriceStatus
+from pythclient.solana import SolanaClient, SolanaPublicKey
+
+from pyth_publisher.config import PythReplicatorConfig
+from pyth_publisher.providers.pyth_price_decoder import LazyPythPriceAccount
+from pyth_publisher.providers.pyth_replicator import PythReplicator, manual_aggregate
+from pyth_publisher.tests.pyth_accounts import encode_price_account
+
+NUM_COMPONENTS = 32
+MAX_SLOT_DIFF = 25
+NUMBER = 2000
+
+
+def _price_account() -> LazyPythPriceAccount:
+    rng = random.Random(0)
+    statuses = [
+        PythPriceStatus.TRADING,
+        PythPriceStatus.TRADING,
+        PythPriceStatus.UNKNOWN,
+    ]
+    account = LazyPythPriceAccount(
+        SolanaPublicKey("FsJ3A3u2vn5cTVofAjvy6y5kwABJAqYWpe4975bi2epH"),
+        SolanaClient(endpoint="http://localhost", ws_endpoint="ws://localhost"),
+    )
+    account.update_with_rpc_response(
+        1000,
+        encode_price_account(
+            exponent=-5,
+            aggregate=(0, 0, PythPriceStatus.UNKNOWN, 0),
+            components=[
+                (
+                    rng.randint(6000000000, 7000000000),
+                    rng.randint(0, 10000000),
+                    rng.choice(statuses),
+                    rng.randint(950, 1000),
+                )
+                for _ in range(NUM_COMPONENTS)
+            ],
+        ),
+    )
+    return account
+
+
+def _list_manual_aggregate(account: LazyPythPriceAccount):
+    # The per component loop and sorting the vectorized aggregation replaced
+    prices: List[float] = []
+    for price_component in account.price_components:
+        price = price_component.latest_price_info
+        if (
+            price.price_status == PythPriceStatus.TRADING
+            and account.slot - price.pub_slot <= MAX_SLOT_DIFF
+        ):
+            prices.extend(
+                [
+                    price.price - price.confidence_interval,
+                    price.price,
+                    price.price + price.confidence_interval,
+                ]
+            )
+    prices.sort()
+    agg_price = prices[len(prices) // 2]
+    return agg_price, max(
+        agg_price - prices[len(prices) // 4],
+        prices[len(prices) * 3 // 4] - agg_price,
+    )
+
+
+def main() -> None:
+    replicator = PythReplicator(
+        PythReplicatorConfig(
+            http_endpoint="http://localhost",
+            ws_endpoint="ws://localhost",
+            first_mapping="AHtgzX45WTKfkPG53L6WYhGEXwQkN1BVknET3sVsLL8J",
+            program_key="FsJ3A3u2vn5cTVofAjvy6y5kwABJAqYWpe4975bi2epH",
+            manual_agg_max_slot_diff=MAX_SLOT_DIFF,
+        )
+    )
+    account = _price_account()
+    data = account._data
+
+    def list_based():
+        # The components are decoded again on every update
+        account._price_components = None
+        _list_manual_aggregate(account)
+
+    def vectorized():
+        account._data = data
+        manual_aggregate(replicator._manual_agg_prices(account))
+
+    for name, aggregate in [("list based", list_based), ("vectorized", vectorized)]:
+        secs = min(timeit.repeat(aggregate, number=NUMBER, repeat=5))
+        print(
+            f"{name:>10}: {secs / NUMBER * 1e6:7.2f} us/update "
+            f"({NUM_COMPONENTS} components)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Compare re-pricing a few thousand Propeller tokens one by one with Decimals
+(`Propeller._compute_spread`) and at once with `compute_prices_and_spreads`.
+
+Run with `python -m benchmarks.bench_propeller_repricing`.
+"""
+
+import timeit
+from decimal import Decimal
+
+import numpy as np
+
+from pyth_publisher.providers.propeller import Propeller, compute_prices_and_spreads
+
+NUM_TOKENS = 5000
+NUMBER = 20
+
+
+def main() -> None:
+    rng = np.random.default_rng(0)
+    base_prices = rng.uniform(1e-6, 50, NUM_TOKENS)
+    base_spreads = rng.uniform(0, 0.1, NUM_TOKENS) / base_prices
+    quote_price, quote_spread = 1 / 3400, 10.0
+
+    decimal_prices = [Decimal(price) for price in base_prices]
+    decimal_spreads = [Decimal(spread) for spread in base_spreads]
+    decimal_quote_price, decimal_quote_spread = Decimal(quote_price), Decimal(
+        quote_spread
+    )
+
+    def reprice_decimal():
+        return [
+            (
+                float(price / decimal_quote_price),
+                float(
+                    Propeller._compute_spread(
+                        base_token_price_in_eth=price,
+                        quote_token_price_in_eth=decimal_quote_price,
+                        base_token_spread_relative_to_eth=spread,
+                        quote_token_spread_relative_to_eth=decimal_quote_spread,
+                    )
+                ),
+            )
+            for price, spread in zip(decimal_prices, decimal_spreads)
+        ]
+
+    def reprice_vectorized():
+        return compute_prices_and_spreads(
+            np.fromiter(decimal_prices, float, NUM_TOKENS),
+            np.fromiter(decimal_spreads, float, NUM_TOKENS),
+            float(decimal_quote_price),
+            float(decimal_quote_spread),
+        )
+
+    for name, reprice in (
+        ("Decimal", reprice_decimal),
+        ("vectorized", reprice_vectorized),
+    ):
+        seconds = min(timeit.repeat(reprice, number=NUMBER, repeat=5)) / NUMBER
+        print(f"{name:>10}: {seconds * 1e3:8.2f} ms for {NUM_TOKENS} tokens")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Compare decoding a Pyth price account update with pythclient and with
+LazyPythPriceAccount, on the TRADING path that only reads the aggregate.
+
+Run with `python -m benchmarks.bench_pyth_price_decoder`.
+"""
+
+import timeit
+
+from pythclient.pythaccounts import PythPriceAccount, PythPriceStatus
+from pythclient.solana import SolanaClient, SolanaPublicKey
+
+from pyth_publisher.providers.pyth_price_decoder import LazyPythPriceAccount
+from pyth_publisher.tests.pyth_accounts import encode_price_account
+
+NUM_COMPONENTS = 32
+NUMBER = 20000
+
+
+def _read_aggregate(account: PythPriceAccount):
+    return (
+        account.aggregate_price_status,
+        account.aggregate_price,
+        account.aggregate_price_confidence_interval,
+        account.timestamp,
+    )
+
+
+def main() -> None:
+    value = encode_price_account(
+        exponent=-8,
+        aggregate=(6543210987654, 123456789, PythPriceStatus.TRADING, 1000),
+        components=[
+            (6543210000000 + i, 100000000, PythPriceStatus.TRADING, 1000)
+            for i in range(NUM_COMPONENTS)
+        ],
+    )
+    solana = SolanaClient(endpoint="http://localhost", ws_endpoint="ws://localhost")
+    key = SolanaPublicKey("FsJ3A3u2vn5cTVofAjvy6y5kwABJAqYWpe4975bi2epH")
+
+    for account in (PythPriceAccount(key, solana), LazyPythPriceAccount(key, solana)):
+
+        def decode():
+            account.update_with_rpc_response(1001, value)
+            _read_aggregate(account)
+
+        secs = min(timeit.repeat(decode, number=NUMBER, repeat=5))
+        print(
+            f"{type(account).__name__:>24}: {secs / NUMBER * 1e6:7.2f} us/update "
+            f"({NUM_COMPONENTS} components)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Measure the import time of the publisher with each provider engine, using
+`python -X importtime`, and show the slowest imports of each.
+
+Run with `python -m benchmarks.bench_startup_importtime`.
+"""
+
+import re
+import subprocess
+import sys
+from typing import List, Tuple
+
+from pyth_publisher.provider import PROVIDER_ENGINES
+
+NUM_SLOWEST = 8
+# Only modules imported at most this deep in the import tree are listed
+MAX_DEPTH = 3
+
+# e.g. "import time:       315 |       4106 |   pyth_publisher.publisher"
+_IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+_IMPORT_ENGINE = (
+    "import pyth_publisher.publisher\n"
+    "from pyth_publisher.provider import load_provider_class\n"
+    "load_provider_class({engine!r})\n"
+)
+
+
+def import_times(code: str) -> List[Tuple[int, int, str]]:
+    """The depth in the import tree and the cumulative import time in
+    microseconds of every module imported by running `code`."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    times = []
+    for line in stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        if match:
+            depth = (len(match.group(3)) + 1) // 2
+            times.append((depth, int(match.group(2)), match.group(4)))
+    return times
+
+
+def main() -> None:
+    for engine in [None, *PROVIDER_ENGINES]:
+        name = engine or "publisher only"
+        code = (
+            _IMPORT_ENGINE.format(engine=engine)
+            if engine
+            else "import pyth_publisher.publisher"
+        )
+        try:
+            times = import_times(code)
+        except subprocess.CalledProcessError as e:
+            print(f"{name}: failed to import\n{e.stderr.strip().splitlines()[-1]}\n")
+            continue
+
+        # Nested imports are already counted in their importer
+        total = sum(cumulative for depth, cumulative, _ in times if depth == 1)
+        print(f"{name}: {total / 1000:.1f} ms")
+        slowest = sorted(
+            (t for t in times if t[0] <= MAX_DEPTH), key=lambda t: t[1], reverse=True
+        )
+        for depth, cumulative, module in slowest[:NUM_SLOWEST]:
+            print(f"  {cumulative / 1000:8.1f} ms  {'  ' * (depth - 1)}{module}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,10 @@
 import asyncio
 import os
 import sys
-import threading
 import uvicorn
 
-from pyth_publisher.config import config
+from pyth_publisher.config import DEFAULT_CONFIG_PATH, Config, load_config
+from pyth_publisher.logs import configure_logging
 from pyth_publisher.publisher import Publisher
 import click
 import logging
@@ -13,32 +13,53 @@ from pyth_publisher.api.health_check import app, API
 
 
 log_level = logging._nameToLevel[os.environ.get("LOG_LEVEL", "DEBUG").upper()]
-structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(log_level))
+configure_logging(log_level)
 
 log = structlog.get_logger()
 
 
 @click.command()
-def main():
-    publisher = Publisher(config=config)
-    API.publisher = publisher
+@click.option(
+    "--config",
+    "config_path",
+    default=DEFAULT_CONFIG_PATH,
+    show_default=True,
+    help="The publisher configuration file",
+)
+@click.option(
+    "--uvloop/--no-uvloop",
+    "use_uvloop",
+    default=False,
+    show_default=True,
+    help="Run the event loop on uvloop",
+)
+def main(config_path: str, use_uvloop: bool):
+    config = load_config(config_path)
+    if use_uvloop:
+        import uvloop
+
+        uvloop.install()
+    asyncio.run(run(config))
 
-    def run_server():
-        uvicorn.run(app, host="0.0.0.0", port=config.health_check_port)
 
-    server_thread = threading.Thread(target=run_server)
-    server_thread.start()
+async def run(config: Config) -> None:
+    # The API is served on the same event loop as the publisher, so its handlers
+    # see the publisher state between two of its steps, never in the middle of one
+    publisher = Publisher(config=config)
+    API.publisher = publisher
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="0.0.0.0", port=config.health_check_port)
+    )
+    server_task = asyncio.create_task(server.serve())
 
-    async def run():
-        try:
-            await publisher.start()
-        except Exception:
-            log.exception("Failed to start publisher")
-            sys.exit(1)
+    try:
+        await publisher.start()
+    except Exception:
+        log.exception("Failed to start publisher")
+        sys.exit(1)
 
-    loop = asyncio.get_event_loop()
-    asyncio.ensure_future(run())
-    loop.run_forever()
+    # Runs until the server is shut down by a signal
+    await server_task
 
 
 if __name__ == "__main__":  # pragma: no cover
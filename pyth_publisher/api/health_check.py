@@ -1,5 +1,6 @@
-from fastapi import FastAPI, status
+from fastapi import FastAPI, Response, status
 from fastapi.responses import JSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from pyth_publisher.publisher import Publisher
 
 
@@ -11,7 +12,7 @@ app = API()
 
 
 @app.get("/health")
-def health_check():
+async def health_check():
     healthy = API.publisher.is_healthy()
     last_successful_update = API.publisher.last_successful_update
     if not healthy:
@@ -26,3 +27,8 @@ def health_check():
         content={"status": "ok", "last_successful_update": last_successful_update},
         status_code=status.HTTP_200_OK,
     )
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
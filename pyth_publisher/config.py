@@ -16,6 +16,30 @@ class CoinGeckoProduct:
 class Pythd:
     # The websocket endpoint
     endpoint: str
+    # How long to gather update_price calls before sending them to pythd as
+    # a single JSON-RPC batch
+    batch_window_ms: int = ts.option(default=5)
+    # The maximum number of update_price calls in a single batch. A batch is
+    # sent as soon as it reaches this size, even if the window has not elapsed.
+    batch_max_size: int = ts.option(default=256)
+    # When the connection is lost, reconnection is retried after a random delay
+    # of up to this initial backoff, doubling after every failed attempt up to
+    # the max backoff
+    reconnect_initial_backoff_ms: int = ts.option(default=100)
+    reconnect_max_backoff_ms: int = ts.option(default=10000)
+    # How long to wait for the response of a call, or of every call of a batch,
+    # before failing it
+    request_timeout_ms: int = ts.option(default=10000)
+
+
+@ts.settings
+class DeadbandConfig:
+    # A price update is skipped when its price and confidence interval both
+    # moved by less than this many basis points since the last update sent for
+    # the product...
+    threshold_bps: float = ts.option(default=1)
+    # ...unless that update was sent at least this long ago
+    heartbeat_secs: float = ts.option(default=5)
 
 
 @ts.settings
@@ -25,6 +49,8 @@ class CoinGeckoConfig:
     # The confidence interval rate (to the price) in basis points to use for CoinGecko updates
     confidence_ratio_bps: int
     products: List[CoinGeckoProduct]
+    # The CoinGecko API, e.g. https://pro-api.coingecko.com/api/v3 for the Pro API
+    api_url: str = ts.option(default="https://api.coingecko.com/api/v3")
 
 
 @ts.settings
@@ -43,11 +69,61 @@ class PythReplicatorConfig:
     # when the aggregate price status is not TRADING.
     manual_agg_max_slot_diff: int = ts.option(default=25)
     account_update_interval_secs: int = ts.option(default=300)
+    # Subscribe only to the price accounts of the products published to pythd,
+    # instead of to every account of the Pyth program. This cuts down the
+    # websocket traffic and decoding work to the feeds that are actually used.
+    filtered_subscription: bool = ts.option(default=False)
+    # When the websocket fails for good, it is connected again after a random
+    # delay of up to 1 second, doubling after every failure up to this
+    ws_reconnect_max_backoff_secs: int = ts.option(default=30)
+    # More websocket endpoints (of other RPC providers) receiving the same
+    # updates as `ws_endpoint`. The first arrival of each account update is used,
+    # so the latency is the fastest endpoint's and an endpoint can fail without
+    # a gap in the updates.
+    hedge_ws_endpoints: List[str] = ts.option(factory=list)
+    # Where to keep a snapshot of the Pyth accounts and latest prices, saved
+    # every `snapshot_interval_secs`. On startup the replicator subscribes to
+    # the accounts of the snapshot right away and reconciles them with Pythnet
+    # in the background, instead of fetching them all first.
+    snapshot_path: Optional[str] = ts.option(default=None)
+    snapshot_interval_secs: int = ts.option(default=60)
 
 
 @ts.settings
 class PropellerConfig:
     update_interval_secs: int = ts.option(default=60)
+    # The Redis holding the token prices and spreads. Without it, the storage
+    # library defaults are used.
+    redis_url: Optional[str] = ts.option(default=None)
+    # The maximum number of connections of the Redis client pool
+    redis_max_connections: int = ts.option(default=10)
+    # The amount (e.g. 10**18 for 1 ETH in wei) the prices and spreads read from
+    # Redis are quoted for
+    quote_amount: Optional[int] = ts.option(default=None)
+    # The Redis pub/sub channel announcing the addresses of the tokens whose
+    # price changed. When set, those tokens are re-priced as soon as they change,
+    # and the full update every `update_interval_secs` is only a fallback.
+    updates_channel: Optional[str] = ts.option(default=None)
+    # The Redis keys of the price and the spread of a token in ETH, as the storage
+    # gateway returns them, formatted with the lowercase `address` of the token and
+    # the `quote_amount`. When both are set, the tokens announced on
+    # `updates_channel` are re-priced from their keys (and the quote token's) read
+    # in one pipelined round trip, instead of from the whole price tables.
+    token_price_key: Optional[str] = ts.option(default=None)
+    token_spread_key: Optional[str] = ts.option(default=None)
+    # The updates channel is subscribed to again after a failure, after a random
+    # delay of up to 1, 2, 4... seconds, and at most this
+    updates_reconnect_max_backoff_secs: int = ts.option(default=30)
+    # The CSV of the supported token symbols and addresses, and where to cache it
+    # locally. The cached copy is used on startup and revalidated in the background
+    # every `token_info_refresh_interval_secs`.
+    token_info_path: str = ts.option(
+        default="s3://defibot-data/price-oracle-evaluation/symbols_to_address.csv"
+    )
+    token_info_cache_path: str = ts.option(
+        default="~/.cache/pyth_publisher/symbols_to_address.csv"
+    )
+    token_info_refresh_interval_secs: int = ts.option(default=3600)
 
 
 @ts.settings
@@ -57,8 +133,11 @@ class Config:
     health_check_port: int
     health_check_threshold_secs: int
     product_update_interval_secs: int = ts.option(default=60)
+    # Without it, every notify_price_sched leads to a price update
+    deadband: Optional[DeadbandConfig] = ts.option(default=None)
     coin_gecko: Optional[CoinGeckoConfig] = ts.option(default=None)
     pyth_replicator: Optional[PythReplicatorConfig] = ts.option(default=None)
+    propeller: Optional[PropellerConfig] = ts.option(default=None)
 
 
 def load_config(config_path: str) -> Config:
@@ -77,14 +156,33 @@ def load_config(config_path: str) -> Config:
         product_update_interval_secs=config_dict["publisher"][
             "product_update_interval_secs"
         ],
-        pyth_replicator=PythReplicatorConfig(
-            **config_dict["publisher"]["pyth_replicator"]
+        deadband=_load_section(config_dict["publisher"], "deadband", DeadbandConfig),
+        coin_gecko=_load_section(
+            config_dict["publisher"],
+            "coin_gecko",
+            CoinGeckoConfig,
+            products=CoinGeckoProduct,
+        ),
+        pyth_replicator=_load_section(
+            config_dict["publisher"], "pyth_replicator", PythReplicatorConfig
         ),
+        propeller=_load_section(config_dict["publisher"], "propeller", PropellerConfig),
     )
 
 
-_DEFAULT_CONFIG_PATH = os.path.join(
+def _load_section(publisher_config: dict, name: str, cls: type, **item_classes: type):
+    """Load a section of the publisher config as `cls`, and each of its lists
+    named in `item_classes` as a list of the given class."""
+    section = publisher_config.get(name)
+    if section is None:
+        return None
+    section = dict(section)
+    for key, item_cls in item_classes.items():
+        if key in section:
+            section[key] = [item_cls(**item) for item in section[key]]
+    return cls(**section)
+
+
+DEFAULT_CONFIG_PATH = os.path.join(
     os.path.dirname(__file__), "..", "config", "config.yaml"
 )
-config_path = _DEFAULT_CONFIG_PATH
-config = load_config(config_path)
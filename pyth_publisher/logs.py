@@ -0,0 +1,250 @@
+"""The logging pipeline of the publisher.
+
+On the logging thread (the event loop), an event is only filtered by level,
+sampled and rate limited, and put in a queue as a dict. The events (and the
+records of the stdlib loggers) are rendered and written to the output by a
+background thread, so that logging does not hold up the hot paths.
+"""
+
+import atexit
+import logging
+import queue
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Mapping, TextIO, Union
+
+import structlog
+
+# The events logged on every price update or notification: at most this many
+# of each are logged per second, and the others are summarized
+DEFAULT_RATE_LIMITS: Dict[str, int] = {
+    "Received a WS update": 10,
+    "Received a price update": 10,
+    "received notify_price_sched": 10,
+    "queueing update_price": 10,
+    "latest price not available": 10,
+}
+DEFAULT_QUEUE_SIZE = 10000
+
+EventDict = Dict[str, Any]
+LogEntry = Union[EventDict, logging.LogRecord]
+
+_STOP = object()
+
+# The level set by `configure_logging`. Until then, every event is logged.
+_level = logging.NOTSET
+
+
+class EventLimiter:
+    """A structlog processor sampling and rate limiting events by their name.
+
+    Only one in `sample_every[event]` of an event is kept, and at most
+    `rate_limits[event]` of it per `interval_secs`. The first event of an
+    interval following one in which events were dropped is preceded by a
+    summary of the events of that interval, passed to `summarize`.
+    """
+
+    def __init__(
+        self,
+        summarize: Callable[[EventDict], None],
+        rate_limits: Mapping[str, int] = DEFAULT_RATE_LIMITS,
+        sample_every: Mapping[str, int] = {},
+        interval_secs: float = 1.0,
+    ) -> None:
+        self._summarize = summarize
+        self._rate_limits = dict(rate_limits)
+        self._sample_every = dict(sample_every)
+        self._interval_secs = interval_secs
+        self._sampled: Dict[str, int] = {}
+        # The start of the current interval and the number of events in it
+        self._windows: Dict[str, List[Any]] = {}
+
+    def __call__(self, logger: Any, method_name: str, event_dict: EventDict):
+        event = event_dict.get("event")
+        sample_every = self._sample_every.get(event)
+        if sample_every is not None:
+            sampled = self._sampled[event] = self._sampled.get(event, 0) + 1
+            if sampled % sample_every:
+                raise structlog.DropEvent
+
+        limit = self._rate_limits.get(event)
+        if limit is None:
+            return event_dict
+        now = time.monotonic()
+        window = self._windows.get(event)
+        if window is None or now - window[0] >= self._interval_secs:
+            if window is not None and window[1] > limit:
+                self._summarize_window(event, method_name, window, now, limit)
+            window = self._windows[event] = [now, 0]
+        window[1] += 1
+        if window[1] > limit:
+            raise structlog.DropEvent
+        return event_dict
+
+    def _summarize_window(
+        self, event: str, method_name: str, window: List[Any], now: float, limit: int
+    ) -> None:
+        count = window[1]
+        self._summarize(
+            {
+                "event": f"{count} {event!r} events in the last "
+                f"{now - window[0]:.1f}s, {count - limit} of them not logged",
+                "level": method_name,
+                "timestamp": time.time(),
+            }
+        )
+
+
+class LogWriter:
+    """Renders the queued log entries and writes them to `stream` on a daemon
+    thread. When the queue is full, entries are dropped and counted rather than
+    blocking the logging thread."""
+
+    def __init__(
+        self,
+        stream: TextIO = sys.stdout,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+    ) -> None:
+        self.dropped = 0
+        self._stream = stream
+        self._queue: "queue.Queue[Any]" = queue.Queue(queue_size)
+        self._renderer = structlog.dev.ConsoleRenderer()
+        self._formatter = logging.Formatter(
+            "%(asctime)s [%(levelname)-9s] %(message)s [%(name)s]",
+            "%Y-%m-%d %H:%M:%S",
+        )
+        self._thread = threading.Thread(
+            target=self._run, name="log-writer", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def close(self) -> None:
+        """Write the entries queued so far and stop the thread."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout=5)
+
+    def put(self, entry: LogEntry) -> None:
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            entry = self._queue.get()
+            if entry is _STOP:
+                break
+            self._write(entry)
+            if self._queue.empty():
+                self._flush()
+        self._flush()
+
+    def _write(self, entry: LogEntry) -> None:
+        try:
+            self._stream.write(self.render(entry) + "\n")
+        except Exception:
+            # Like logging.Handler.handleError, never let a bad entry stop logging
+            logging.lastResort.handle(
+                logging.makeLogRecord({"msg": "Failed to write a log entry"})
+            )
+
+    def _flush(self) -> None:
+        dropped, self.dropped = self.dropped, 0
+        if dropped:
+            self._stream.write(f"{dropped} log entries dropped, the queue was full\n")
+        self._stream.flush()
+
+    def render(self, entry: LogEntry) -> str:
+        if isinstance(entry, logging.LogRecord):
+            return self._formatter.format(entry)
+        entry["timestamp"] = time.strftime(
+            "%Y-%m-%d %H:%M:%S", time.localtime(entry["timestamp"])
+        )
+        return self._renderer(None, entry.get("level", "info"), entry)
+
+
+class QueueLogger:
+    """The structlog logger of the pipeline: the processed event dicts are put
+    in the queue of the writer as they are."""
+
+    def __init__(self, writer: LogWriter) -> None:
+        self._writer = writer
+
+    def msg(self, **event_dict: Any) -> None:
+        self._writer.put(event_dict)
+
+    debug = info = warning = warn = error = critical = exception = msg
+    fatal = failure = err = log = msg
+
+
+class QueueHandler(logging.Handler):
+    """Puts the records of the stdlib loggers in the queue of the writer, which
+    formats them (unlike logging.handlers.QueueHandler, which formats them on
+    the logging thread)."""
+
+    def __init__(self, writer: LogWriter) -> None:
+        super().__init__()
+        self._writer = writer
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self._writer.put(record)
+
+
+def capture_exc_info(logger: Any, method_name: str, event_dict: EventDict):
+    # The exception is rendered on the writer thread, where it is not the one
+    # being handled anymore
+    if event_dict.get("exc_info") is True:
+        event_dict["exc_info"] = sys.exc_info()
+    return event_dict
+
+
+def add_timestamp(logger: Any, method_name: str, event_dict: EventDict):
+    # Formatted on the writer thread
+    event_dict["timestamp"] = time.time()
+    return event_dict
+
+
+def enabled_for(level: int) -> bool:
+    """Whether the events of `level` are logged, for the hot paths to skip
+    building the fields of events that would be filtered out anyway."""
+    return level >= _level
+
+
+def configure_logging(
+    level: int,
+    rate_limits: Mapping[str, int] = DEFAULT_RATE_LIMITS,
+    sample_every: Mapping[str, int] = {},
+    stream: TextIO = sys.stdout,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+) -> LogWriter:
+    """Log the structlog events and the stdlib records from `level` through a
+    queue to a writer thread, which is stopped at exit."""
+    global _level
+    _level = level
+    writer = LogWriter(stream, queue_size)
+    writer.start()
+    atexit.register(writer.close)
+
+    structlog.configure(
+        processors=[
+            EventLimiter(writer.put, rate_limits, sample_every),
+            structlog.contextvars.merge_contextvars,
+            structlog.processors.add_log_level,
+            structlog.processors.StackInfoRenderer(),
+            structlog.dev.set_exc_info,
+            capture_exc_info,
+            add_timestamp,
+        ],
+        wrapper_class=structlog.make_filtering_bound_logger(level),
+        logger_factory=lambda *args: QueueLogger(writer),
+        cache_logger_on_first_use=True,
+    )
+
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(writer)]
+    root.setLevel(level)
+    return writer
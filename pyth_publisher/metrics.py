@@ -0,0 +1,106 @@
+"""Prometheus metrics of the publisher, served on /metrics by the API.
+
+The metrics are recorded on the hot paths, so labelled children are resolved
+once (e.g. per product in its publish plan) instead of on every record.
+"""
+
+import asyncio
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+from structlog import get_logger
+
+log = get_logger()
+
+_LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+
+NOTIFY_TO_SEND_SECONDS = Histogram(
+    "pyth_publisher_notify_to_send_seconds",
+    "Time from handling a notify_price_sched to sending its update_price to pythd",
+    buckets=_LATENCY_BUCKETS,
+)
+PRICE_AGE_SECONDS = Gauge(
+    "pyth_publisher_price_age_seconds",
+    "Age of the provider price of the last update_price of a product",
+    ["symbol"],
+)
+NOTIFICATIONS_DROPPED = Counter(
+    "pyth_publisher_notifications_dropped",
+    "notify_price_sched notifications that did not lead to an update_price",
+    ["reason"],
+)
+# The provider had no price, or only a stale one
+NOTIFICATIONS_DROPPED_NO_PRICE = NOTIFICATIONS_DROPPED.labels("no_price")
+# The price barely moved since the last update sent
+NOTIFICATIONS_DROPPED_DEADBAND = NOTIFICATIONS_DROPPED.labels("deadband")
+
+PROVIDER_STALE_PRICES = Counter(
+    "pyth_publisher_provider_stale_prices",
+    "Prices a provider did not return because they were stale",
+    ["provider"],
+)
+
+REPLICATOR_WS_UPDATES = Counter(
+    "pyth_publisher_replicator_ws_updates",
+    "Price account updates received on the Pyth replicator websocket",
+)
+REPLICATOR_UPDATES_DROPPED = Counter(
+    "pyth_publisher_replicator_updates_dropped",
+    "Price account updates of the Pyth replicator dropped before being handled",
+    ["reason"],
+)
+# The account was updated again before the update was handled
+REPLICATOR_UPDATES_DROPPED_SUPERSEDED = REPLICATOR_UPDATES_DROPPED.labels("superseded")
+# The update did not advance the slot of the account
+REPLICATOR_UPDATES_DROPPED_STALE = REPLICATOR_UPDATES_DROPPED.labels("stale")
+REPLICATOR_DECODE_SECONDS = Histogram(
+    "pyth_publisher_replicator_decode_seconds",
+    "Time to decode a price account update of the Pyth replicator",
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005),
+)
+REPLICATOR_ENDPOINT_UPDATES = Counter(
+    "pyth_publisher_replicator_endpoint_updates",
+    "Price account updates received on each websocket endpoint of the Pyth "
+    "replicator, by whether the endpoint delivered the slot first, again after "
+    "another endpoint, or after a newer slot",
+    ["endpoint", "arrival"],
+)
+REPLICATOR_ENDPOINT_LAG_SECONDS = Histogram(
+    "pyth_publisher_replicator_endpoint_lag_seconds",
+    "How much later than the first endpoint a websocket endpoint of the Pyth "
+    "replicator delivers a price account update",
+    ["endpoint"],
+    buckets=_LATENCY_BUCKETS,
+)
+
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "pyth_publisher_event_loop_lag_seconds",
+    "How late the event loop runs a callback scheduled with call_later",
+    buckets=_LATENCY_BUCKETS,
+)
+
+
+async def monitor_event_loop_lag(
+    interval_secs: float = 0.5, warn_lag_secs: float = 0.1
+) -> None:
+    """Record how much later than scheduled the event loop wakes up a sleep, and
+    warn when it is more than `warn_lag_secs` late."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval_secs)
+        lag = max(time.perf_counter() - start - interval_secs, 0)
+        EVENT_LOOP_LAG_SECONDS.observe(lag)
+        if lag > warn_lag_secs:
+            log.warning("event loop lagging", lag_secs=round(lag, 3))
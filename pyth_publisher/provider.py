@@ -1,23 +1,118 @@
 from abc import ABC, abstractmethod
 import asyncio
-from dataclasses import dataclass
-from typing import List, Optional
+from importlib import import_module
+from typing import Dict, Iterable, List, Optional, Type, Union
+from attr import define
 
 
+# The provider class of every provider engine. Each one is only imported when
+# selected, as they pull in heavy and partly private dependencies.
+PROVIDER_ENGINES: Dict[str, str] = {
+    "coin_gecko": "pyth_publisher.providers.coin_gecko:CoinGecko",
+    "pyth_replicator": "pyth_publisher.providers.pyth_replicator:PythReplicator",
+    "propeller": "pyth_publisher.providers.propeller:Propeller",
+}
+
 PythSymbol = str  # e.g., Crypto.FDUSD/USD
 Symbol = str  # e.g., BTC
 UnixTimestamp = int
 
 
-@dataclass
+@define
 class Price:
-    price: float
-    conf: float
+    # Integer mantissas when `exponent` is set, i.e. the price is
+    # `price * 10 ** exponent`, so prices of on-chain feeds are kept exact
+    price: Union[float, int]
+    conf: Union[float, int]
     timestamp: UnixTimestamp
+    # The Solana slot of the price, for providers replicating an on-chain feed
+    slot: int = 0
+    exponent: Optional[int] = None
+
+
+class PriceTable:
+    """The latest prices of a provider, keyed by whatever the provider identifies
+    its prices with (Pyth symbol, CoinGecko id, token address...).
+
+    Every key gets a fixed integer index the first time it is seen, and its price
+    record is updated in place afterwards, so updating or looking up a price does
+    not allocate. Indexes of removed keys are reused by the keys added next, so
+    the table does not grow as keys come and go.
+    """
+
+    def __init__(self) -> None:
+        self._indexes: Dict[str, int] = {}
+        self._records: List[Optional[Price]] = []
+        self._free_indexes: List[int] = []
+
+    def index(self, key: str) -> int:
+        index = self._indexes.get(key)
+        if index is None:
+            if self._free_indexes:
+                index = self._free_indexes.pop()
+            else:
+                index = len(self._records)
+                self._records.append(None)
+            self._indexes[key] = index
+        return index
+
+    def set(
+        self,
+        index: int,
+        price: Union[float, int],
+        conf: Union[float, int],
+        timestamp: UnixTimestamp,
+        slot: int = 0,
+        exponent: Optional[int] = None,
+    ) -> Price:
+        record = self._records[index]
+        if record is None:
+            record = self._records[index] = Price(
+                price, conf, timestamp, slot, exponent
+            )
+        else:
+            record.price = price
+            record.conf = conf
+            record.timestamp = timestamp
+            record.slot = slot
+            record.exponent = exponent
+        return record
+
+    def at(self, index: int) -> Optional[Price]:
+        return self._records[index]
+
+    def get(self, key: str) -> Optional[Price]:
+        index = self._indexes.get(key)
+        if index is None:
+            return None
+        return self._records[index]
+
+    def retain(self, keys: Iterable[str]) -> bool:
+        """Remove the prices of all the keys not in `keys`, and return whether
+        any was removed, i.e. whether their indexes may now be another key's."""
+        keys = set(keys)
+        removed_keys = [key for key in self._indexes if key not in keys]
+        for key in removed_keys:
+            index = self._indexes.pop(key)
+            self._records[index] = None
+            self._free_indexes.append(index)
+        return bool(removed_keys)
+
+    def keys(self) -> List[str]:
+        return list(self._indexes)
+
+    def __len__(self) -> int:
+        return len(self._indexes)
+
+    def __repr__(self) -> str:
+        return repr({key: self._records[index] for key, index in self._indexes.items()})
 
 
 class Provider(ABC):
     _update_loop_task = None
+    # Incremented whenever an index returned by `price_index` may have become the
+    # index of another symbol, so that it is looked up again
+    price_indexes_version = 0
 
     @abstractmethod
     def upd_products(self, product_symbols: List[PythSymbol]): ...
@@ -30,3 +125,23 @@ class Provider(ABC):
 
     @abstractmethod
     def latest_price(self, symbol: PythSymbol) -> Optional[Price]: ...
+
+    def price_index(self, symbol: PythSymbol) -> Optional[int]:
+        """The index of the symbol's price, to look it up with `latest_price_at`
+        without resolving the symbol again. None if the symbol is not supported
+        or the provider does not index its prices."""
+        return None
+
+    def latest_price_at(self, index: int) -> Optional[Price]:
+        """The latest price at an index from `price_index`. Providers that do not
+        index their prices never return one, so they have none at any index."""
+        return None
+
+
+def load_provider_class(engine: str) -> Type[Provider]:
+    """Import the provider class of the provider engine."""
+    try:
+        module_name, class_name = PROVIDER_ENGINES[engine].split(":")
+    except KeyError:
+        raise ValueError(f"Unknown provider engine {engine}")
+    return getattr(import_module(module_name), class_name)
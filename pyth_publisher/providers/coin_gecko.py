@@ -1,11 +1,12 @@
 import asyncio
+from email.utils import parsedate_to_datetime
 from math import floor
 import time
-from typing import Dict, List, Optional
-from pycoingecko import CoinGeckoAPI
+from typing import Any, Dict, List, Optional
+import aiohttp
 from structlog import get_logger
 
-from pyth_publisher.provider import Price, Provider, PythSymbol
+from pyth_publisher.provider import Price, PriceTable, Provider, PythSymbol
 from ..config import CoinGeckoConfig
 
 log = get_logger()
@@ -14,52 +15,176 @@ Id = str  # The "API id" of the CoinGecko price, listed on CoinGecko page for ea
 
 USD = "usd"
 
+# Keep the comma separated ids of a request well below the URL length limits
+MAX_IDS_LENGTH = 1500
+
+
+class CoinGeckoRateLimited(Exception):
+    pass
+
+
+class CoinGeckoClient:
+    """An asyncio CoinGecko API client.
+
+    Requests go through one pooled keep-alive session. Id lists that would make a
+    too long URL are split into batches fetched concurrently, and rate limited
+    requests (HTTP 429) are retried after the `Retry-After` delay, or with an
+    exponential backoff if the response has none.
+    """
+
+    def __init__(
+        self,
+        api_url: str,
+        max_retries: int = 5,
+        max_ids_length: int = MAX_IDS_LENGTH,
+    ) -> None:
+        self._api_url = api_url.rstrip("/")
+        self._max_retries = max_retries
+        self._max_ids_length = max_ids_length
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=30),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+    async def get_price(
+        self, ids: List[Id], vs_currencies: str, precision: int
+    ) -> Dict[Id, Dict[str, float]]:
+        results = await asyncio.gather(
+            *(
+                self._get(
+                    "/simple/price",
+                    {
+                        "ids": ",".join(batch),
+                        "vs_currencies": vs_currencies,
+                        "precision": str(precision),
+                    },
+                )
+                for batch in self._batch_ids(ids)
+            )
+        )
+        prices = {}
+        for result in results:
+            prices.update(result)
+        return prices
+
+    def _batch_ids(self, ids: List[Id]) -> List[List[Id]]:
+        batches: List[List[Id]] = []
+        batch: List[Id] = []
+        length = 0
+        for id in ids:
+            if batch and length + 1 + len(id) > self._max_ids_length:
+                batches.append(batch)
+                batch, length = [], 0
+            batch.append(id)
+            length += len(id) + 1
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def _get(self, path: str, params: Dict[str, str]) -> Any:
+        url = self._api_url + path
+        for attempt in range(self._max_retries):
+            async with self._get_session().get(url, params=params) as response:
+                if response.status != 429:
+                    response.raise_for_status()
+                    return await response.json()
+
+                retry_after = response.headers.get("Retry-After")
+            delay = retry_after_secs(retry_after, 2**attempt)
+            log.warning("rate limited by CoinGecko", retry_in_secs=delay)
+            await asyncio.sleep(delay)
+
+        raise CoinGeckoRateLimited(
+            f"still rate limited after {self._max_retries} tries"
+        )
+
+
+def retry_after_secs(retry_after: Optional[str], default: float) -> float:
+    """The delay of a `Retry-After` header, given either in seconds or as an
+    HTTP date, or `default` if there is none or it cannot be parsed."""
+    if retry_after is None:
+        return default
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return default
+    return max(0.0, retry_at.timestamp() - time.time())
+
 
 class CoinGecko(Provider):
     def __init__(self, config: CoinGeckoConfig) -> None:
-        self._api: CoinGeckoAPI = CoinGeckoAPI()
-        self._prices: Dict[Id, Price] = {}
+        self._api = CoinGeckoClient(config.api_url)
+        self._prices = PriceTable()
+        self._ids: List[Id] = []
         self._symbol_to_id: Dict[PythSymbol, Id] = {
             product.symbol: product.coin_gecko_id for product in config.products
         }
         self._config = config
 
     def upd_products(self, product_symbols: List[PythSymbol]) -> None:
-        new_prices = {}
+        ids = []
         for coin_gecko_product in self._config.products:
             if coin_gecko_product.symbol in product_symbols:
-                id = coin_gecko_product.coin_gecko_id
-                new_prices[id] = self._prices.get(id, None)
+                ids.append(coin_gecko_product.coin_gecko_id)
             else:
                 raise ValueError(
                     f"{coin_gecko_product.symbol} not found in available products"  # noqa: E713
                 )
 
-        self._prices = new_prices
+        if self._prices.retain(ids):
+            self.price_indexes_version += 1
+        self._ids = ids
 
     async def _update_loop(self) -> None:
         while True:
-            self._update_prices()
+            try:
+                await self._update_prices()
+            except Exception:
+                log.exception("failed to update prices from CoinGecko")
             await asyncio.sleep(self._config.update_interval_secs)
 
-    def _update_prices(self) -> None:
-        result = self._api.get_price(
-            ids=list(self._prices.keys()), vs_currencies=USD, precision=18
+    async def _update_prices(self) -> None:
+        result = await self._api.get_price(
+            ids=self._ids, vs_currencies=USD, precision=18
         )
         for id_, prices in result.items():
             price = prices[USD]
-            self._prices[id_] = Price(
+            self._prices.set(
+                self._prices.index(id_),
                 price,
                 price * self._config.confidence_ratio_bps / 10000,
                 floor(time.time()),
             )
-        log.info("updated prices from CoinGecko", prices=self._prices)
+        # Not the table itself, which keeps changing while the event is rendered
+        log.info("updated prices from CoinGecko", prices=len(self._prices))
 
     def _get_price(self, id: Id) -> Optional[Price]:
-        return self._prices.get(id, None)
+        return self._prices.get(id)
 
     def latest_price(self, symbol: PythSymbol) -> Optional[Price]:
         id = self._symbol_to_id.get(symbol)
         if id is None:
             return None
         return self._get_price(id)
+
+    def price_index(self, symbol: PythSymbol) -> Optional[int]:
+        id = self._symbol_to_id.get(symbol)
+        if id is None:
+            return None
+        return self._prices.index(id)
+
+    def latest_price_at(self, index: int) -> Optional[Price]:
+        return self._prices.at(index)
@@ -1,25 +1,32 @@
 import asyncio
+import logging
+import random
 import re
+import time
 from datetime import datetime
 from decimal import Decimal
 from math import floor
-from typing import List, Optional
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
-from drfs import DRPath
-import pandas as pd
+import numpy as np
+from redis.asyncio import Redis
 from core.models.evm.ethereum_token import EthereumToken
+from storage.gateways.redis import RedisTokenPricesGW
 from storage.token_prices import RedisPricesGateway
 
 from pyth_publisher.config import PropellerConfig
-from pyth_publisher.provider import Price, Provider, PythSymbol, Symbol
+from pyth_publisher.provider import Price, PriceTable, Provider, PythSymbol, Symbol
+from pyth_publisher.providers.token_info import TokenInfoCache
 
 from logging import getLogger
 
-log = getLogger()
+log = getLogger(__name__)
 
 USD = "usd"
 
 PYTH_SYMBOL_REGEX = r"Crypto\.(\w+)/USD"
+PYTH_SYMBOL_PATTERN = re.compile(PYTH_SYMBOL_REGEX)
 
 Address = str
 
@@ -31,17 +38,48 @@ class Propeller(Provider):
         token_symbol_to_address: Optional[dict[Symbol, Address]] = None,
         quote_amount: Optional[int] = None,
         redis_gtw: Optional[RedisPricesGateway] = None,
+        redis: Optional[Redis] = None,
     ) -> None:
-        self._prices: dict[Address, Price] = {}
+        self._prices = PriceTable()
         self._config = config
+        # Loads and refreshes the token info when it is not given
+        self._token_info: Optional[TokenInfoCache] = None
         self._token_symbol_to_address: dict[Symbol, Address] = (
             token_symbol_to_address
             if token_symbol_to_address
             else self._get_token_info()
         )
+        self._refresh_token_info_task: Optional[asyncio.Task] = None
         self._supported_products: set[Symbol] = set()
+        # The Pyth products from the last `upd_products`, and the index of the
+        # price of each supported one. Rebuilt only when the products or the
+        # token info change, so a price lookup is a single dict probe.
+        self._product_symbols: List[PythSymbol] = []
+        self._pyth_symbol_index: dict[PythSymbol, int] = {}
+        # The index of the price of each supported (lowercase) token address
+        self._address_index: dict[Address, int] = {}
+        # The failures of the updates stream since it last subscribed
+        self._stream_failures = 0
+        if config.redis_url is not None:
+            # The gateway only takes a URL, so the pool size is passed in it, for
+            # the pool of the gateway and the one of the updates client alike
+            redis_url = redis_url_with_max_connections(
+                config.redis_url, config.redis_max_connections
+            )
+            if redis_gtw is None:
+                # The prices and the spreads are both read through this single
+                # gateway, so they share its connection pool
+                redis_gtw = RedisPricesGateway(
+                    redis_gw=RedisTokenPricesGW(uri=redis_url)
+                )
+            if redis is None and config.updates_channel:
+                redis = Redis.from_url(redis_url)
         self._redis_gtw = redis_gtw or RedisPricesGateway()
-        self._quote_amount = quote_amount
+        # Used to listen to price updates when `updates_channel` is configured
+        self._redis = redis
+        self._quote_amount = (
+            quote_amount if quote_amount is not None else config.quote_amount
+        )
         self._quote_token = EthereumToken(
             symbol="USDC",
             address="0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48",
@@ -50,67 +88,259 @@ class Propeller(Provider):
 
     def upd_products(self, product_symbols: List[PythSymbol]) -> None:
         """Update our provider with new products from Pyth"""
-        for product in product_symbols:
+        if product_symbols == self._product_symbols:
+            return
+        self._product_symbols = list(product_symbols)
+        self._index_products()
+
+    def _set_token_info(self, token_symbol_to_address: dict[Symbol, Address]) -> None:
+        if token_symbol_to_address == self._token_symbol_to_address:
+            return
+        self._token_symbol_to_address = token_symbol_to_address
+        self._index_products()
+
+    def _index_products(self) -> None:
+        supported_products: set[Symbol] = set()
+        pyth_symbol_index: dict[PythSymbol, int] = {}
+        address_index: dict[Address, int] = {}
+        for product in self._product_symbols:
             symbol = self._get_token_symbol_from_pyth_symbol(product)
             if symbol is not None:
-                if symbol not in self._token_symbol_to_address:
+                address = self._token_symbol_to_address.get(symbol)
+                if address is None:
                     log.warning(f"Symbol {symbol} not found in token info")
                 else:
-                    self._supported_products.add(symbol)
+                    supported_products.add(symbol)
+                    index = self._prices.index(address)
+                    pyth_symbol_index[product] = index
+                    address_index[address.lower()] = index
+        if any(
+            pyth_symbol_index.get(product) != index
+            for product, index in self._pyth_symbol_index.items()
+        ):
+            # Products were removed or now have the price of another address
+            self.price_indexes_version += 1
+        self._supported_products = supported_products
+        self._pyth_symbol_index = pyth_symbol_index
+        self._address_index = address_index
 
     @staticmethod
     def _get_token_symbol_from_pyth_symbol(pyth_symbol: PythSymbol) -> Optional[Symbol]:
-        pattern = re.compile(PYTH_SYMBOL_REGEX)
-        symbol = pattern.findall(pyth_symbol)
+        symbol = PYTH_SYMBOL_PATTERN.findall(pyth_symbol)
         if len(symbol) > 0:
             return symbol[0]
         return None
 
     async def _update_loop(self) -> None:
+        if self._token_info is not None:
+            self._refresh_token_info_task = asyncio.create_task(
+                self._refresh_token_info_loop()
+            )
+
+        if self._config.updates_channel and self._redis is not None:
+            await self._stream_updates_loop()
+
         while True:
             await self._update_prices()
             await asyncio.sleep(self._config.update_interval_secs)
 
-    async def _update_prices(self) -> None:
-        prices = await self._redis_gtw.get_token_prices(self._quote_amount)
-        spreads = await self._redis_gtw.get_token_spreads(self._quote_amount)
-        quote_token_price_in_eth = prices[self._quote_token]
-        quote_token_spread_relative_to_eth = spreads[self._quote_token]
-        for token, base_token_price_in_eth in prices.items():
-            if token.symbol in self._supported_products:
-                price = base_token_price_in_eth / quote_token_price_in_eth
-                base_token_spread_relative_to_eth = spreads[token]
-                spread = self._compute_spread(
-                    base_token_price_in_eth,
-                    quote_token_price_in_eth,
-                    base_token_spread_relative_to_eth,
-                    quote_token_spread_relative_to_eth,
+    async def _stream_updates_loop(self) -> None:
+        # The stream is subscribed to again whenever it fails. The prices are
+        # polled in the meantime, so that they do not go stale.
+        while True:
+            try:
+                await self._stream_updates()
+            except Exception:
+                self._stream_failures += 1
+                log.exception(
+                    f"Price updates stream failed ({self._stream_failures} failures)"
                 )
-                self._prices[token.address] = Price(
-                    float(price),
-                    float(spread) / 2,  # the confidence interval is half of the spread
-                    floor(datetime.utcnow().timestamp()),
+            try:
+                await self._update_prices()
+            except Exception:
+                log.exception("Failed to update prices from Redis")
+            await asyncio.sleep(self._stream_backoff_secs())
+
+    def _stream_backoff_secs(self) -> float:
+        backoff = min(
+            self._config.updates_reconnect_max_backoff_secs,
+            2 ** max(0, self._stream_failures - 1),
+        )
+        return random.uniform(0, backoff)
+
+    async def _stream_updates(self) -> None:
+        """Re-price the tokens announced on the updates channel as soon as they
+        change. Every message is the address of a token whose price or spread
+        changed. All the prices are still refreshed every `update_interval_secs`,
+        however busy the channel, in case a message is missed."""
+        interval = self._config.update_interval_secs
+        async with self._redis.pubsub() as pubsub:
+            await pubsub.subscribe(self._config.updates_channel)
+            log.info(f"Listening to price updates on {self._config.updates_channel}")
+
+            await self._update_prices()
+            refreshed_at = time.monotonic()
+            self._stream_failures = 0
+            while True:
+                message = await pubsub.get_message(
+                    timeout=max(0.0, refreshed_at + interval - time.monotonic())
                 )
-        log.info(f"Updated prices from Redis: {self._prices}")
 
-    def latest_price(self, symbol: PythSymbol) -> Optional[Price]:
-        symbol = self._get_token_symbol_from_pyth_symbol(symbol)
-        address = self._token_symbol_to_address.get(symbol)
-        if address is None:
-            return None
-        return self._prices.get(address)
+                # Re-price all the tokens announced since the last update at once
+                updated_addresses = set()
+                while message is not None:
+                    if message["type"] == "message":
+                        updated_addresses.add(self._decode_address(message["data"]))
+                    message = await pubsub.get_message(timeout=0)
+                if updated_addresses:
+                    await self._update_prices(updated_addresses)
+
+                if time.monotonic() - refreshed_at >= interval:
+                    await self._update_prices()
+                    refreshed_at = time.monotonic()
 
     @staticmethod
-    def _get_token_info() -> dict[Symbol, str]:
-        """Get a mapping of supported token symbols to addresses from s3."""
-        supported_tokens_path = DRPath(
-            "s3://defibot-data/price-oracle-evaluation/symbols_to_address.csv"
+    def _decode_address(data) -> Address:
+        if isinstance(data, bytes):
+            data = data.decode()
+        return data.lower()
+
+    async def _update_prices(self, addresses: Optional[set[Address]] = None) -> None:
+        """Update the prices of all the supported tokens, or only of the tokens
+        with the given (lowercase) addresses."""
+        if addresses is not None and self._quote_token.address in addresses:
+            # Every price is quoted in the quote token
+            addresses = None
+        if (
+            addresses is not None
+            and self._config.token_price_key
+            and self._config.token_spread_key
+        ):
+            await self._update_announced_prices(addresses)
+            return
+
+        prices, spreads = await asyncio.gather(
+            self._redis_gtw.get_token_prices(self._quote_amount),
+            self._redis_gtw.get_token_spreads(self._quote_amount),
+        )
+        tokens = [
+            token
+            for token in prices
+            if token.symbol in self._supported_products
+            and (addresses is None or token.address.lower() in addresses)
+        ]
+        self._set_prices(
+            [self._prices.index(token.address) for token in tokens],
+            np.fromiter((prices[token] for token in tokens), float, len(tokens)),
+            np.fromiter((spreads[token] for token in tokens), float, len(tokens)),
+            float(prices[self._quote_token]),
+            float(spreads[self._quote_token]),
+        )
+
+    async def _update_announced_prices(self, addresses: set[Address]) -> None:
+        # Only the keys of the announced tokens and of the quote token are read,
+        # in one round trip, so a message costs the same whatever the catalog size
+        announced = [address for address in addresses if address in self._address_index]
+        if not announced:
+            return
+        async with self._redis.pipeline(transaction=False) as pipeline:
+            for address in [self._quote_token.address, *announced]:
+                pipeline.get(self._token_key(self._config.token_price_key, address))
+                pipeline.get(self._token_key(self._config.token_spread_key, address))
+            values = await pipeline.execute()
+        # A missing key gives a NaN price, which is skipped
+        values = np.array(
+            [np.nan if value is None else float(value) for value in values]
+        )
+        self._set_prices(
+            [self._address_index[address] for address in announced],
+            values[2::2],
+            values[3::2],
+            values[0],
+            values[1],
+        )
+
+    def _token_key(self, template: str, address: Address) -> str:
+        return template.format(address=address, quote_amount=self._quote_amount)
+
+    def _set_prices(
+        self,
+        indexes: List[int],
+        base_token_prices_in_eth: np.ndarray,
+        base_token_spreads_relative_to_eth: np.ndarray,
+        quote_token_price_in_eth: float,
+        quote_token_spread_relative_to_eth: float,
+    ) -> None:
+        token_prices, token_spreads = compute_prices_and_spreads(
+            base_token_prices_in_eth,
+            base_token_spreads_relative_to_eth,
+            quote_token_price_in_eth,
+            quote_token_spread_relative_to_eth,
+        )
+        # e.g. a zero price in Redis leads to an infinite or zero price, which
+        # must not be published
+        valid = (
+            np.isfinite(token_prices)
+            & (token_prices > 0)
+            & np.isfinite(token_spreads)
+            & (token_spreads >= 0)
         )
-        supported_tokens_df = pd.read_csv(supported_tokens_path)
-        supported_tokens_dict = supported_tokens_df.set_index("symbol")[
-            "address"
-        ].to_dict()
-        return supported_tokens_dict
+        if not valid.all():
+            log.warning(
+                f"Skipped {len(indexes) - int(valid.sum())} tokens without a valid "
+                "price or spread"
+            )
+        timestamp = floor(datetime.utcnow().timestamp())
+        for index, price, spread, is_valid in zip(
+            indexes, token_prices.tolist(), token_spreads.tolist(), valid.tolist()
+        ):
+            if not is_valid:
+                continue
+            self._prices.set(
+                index,
+                price,
+                spread / 2,  # the confidence interval is half of the spread
+                timestamp,
+            )
+        # Logged on every message of the updates stream
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Updated %d prices from Redis", int(valid.sum()))
+            log.debug(f"Prices from Redis: {self._prices}")
+
+    def latest_price(self, symbol: PythSymbol) -> Optional[Price]:
+        index = self._pyth_symbol_index.get(symbol)
+        if index is None:
+            return None
+        return self._prices.at(index)
+
+    def price_index(self, symbol: PythSymbol) -> Optional[int]:
+        return self._pyth_symbol_index.get(symbol)
+
+    def latest_price_at(self, index: int) -> Optional[Price]:
+        return self._prices.at(index)
+
+    def _get_token_info(self) -> dict[Symbol, str]:
+        """Get a mapping of supported token symbols to addresses, from the local
+        cache if possible, from s3 otherwise."""
+        if self._token_info is None:
+            self._token_info = TokenInfoCache(
+                self._config.token_info_path, self._config.token_info_cache_path
+            )
+        return self._token_info.load()
+
+    async def _refresh_token_info_loop(self) -> None:
+        # The token info may have been loaded from an outdated cache, so it is
+        # revalidated right away, then periodically. The download and parsing
+        # happen off the event loop, and the new mapping is swapped in at once.
+        while True:
+            try:
+                token_info = await asyncio.to_thread(self._token_info.refresh)
+                if token_info is not None:
+                    log.info(f"Token info changed, {len(token_info)} tokens")
+                    self._set_token_info(token_info)
+            except Exception:
+                log.exception("Failed to refresh the token info")
+            await asyncio.sleep(self._config.token_info_refresh_interval_secs)
 
     @staticmethod
     def _compute_spread(
@@ -174,3 +404,45 @@ class Propeller(Provider):
         # Price to buy the base and sell the quote token
         buy_base_price = sell_quote_buy_eth_price / buy_base_sell_eth_price
         return buy_base_price - sell_base_price
+
+
+def compute_prices_and_spreads(
+    base_token_prices_in_eth: np.ndarray,
+    base_token_spreads_relative_to_eth: np.ndarray,
+    quote_token_price_in_eth: float,
+    quote_token_spread_relative_to_eth: float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the prices and price spreads of all the base tokens in terms of the
+    quote token at once.
+
+    This is `Propeller._compute_spread` over float64 arrays instead of Decimals.
+    The results match it within a relative tolerance of 1e-9 of the price.
+    Zero prices give infinite or NaN results rather than raising.
+    """
+    quote_token_price_in_eth = np.float64(quote_token_price_in_eth)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # How much of the base and quote token 1 ETH will buy
+        eth_price_in_base_token = 1 / base_token_prices_in_eth
+        eth_price_in_quote_token = 1 / quote_token_price_in_eth
+
+        # Price to sell the base and buy the quote token
+        sell_base_price = (
+            eth_price_in_quote_token - quote_token_spread_relative_to_eth
+        ) / (eth_price_in_base_token + base_token_spreads_relative_to_eth)
+        # Price to buy the base and sell the quote token
+        buy_base_price = (
+            eth_price_in_quote_token + quote_token_spread_relative_to_eth
+        ) / (eth_price_in_base_token - base_token_spreads_relative_to_eth)
+        return (
+            base_token_prices_in_eth / quote_token_price_in_eth,
+            buy_base_price - sell_base_price,
+        )
+
+
+def redis_url_with_max_connections(url: str, max_connections: int) -> str:
+    """The Redis URL with its `max_connections` query argument, which redis-py
+    passes to the connection pool created from the URL, set unless it already is."""
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    query.setdefault("max_connections", str(max_connections))
+    return urlunsplit(parts._replace(query=urlencode(query)))
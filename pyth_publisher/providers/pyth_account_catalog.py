@@ -0,0 +1,178 @@
+from typing import Dict, Iterable, List
+
+from attr import define
+from pythclient.exceptions import NotLoadedException
+from pythclient.pythaccounts import (
+    PythAccount,
+    PythMappingAccount,
+    PythPriceAccount,
+    PythProductAccount,
+)
+from pythclient.solana import SolanaClient, SolanaPublicKey, SolanaPublicKeyOrStr
+from structlog import get_logger
+
+log = get_logger()
+
+
+@define
+class CatalogChanges:
+    added_products: int = 0
+    removed_products: int = 0
+    # Products whose price accounts were fetched because their list changed
+    repriced_products: int = 0
+
+    def __bool__(self) -> bool:
+        return bool(
+            self.added_products or self.removed_products or self.repriced_products
+        )
+
+
+class PythAccountCatalog:
+    """The mapping, product and price accounts of the Pyth program, refreshed
+    incrementally.
+
+    A refresh fetches the mapping accounts, a handful of accounts listing all the
+    product accounts. Only the product accounts that are new (or could not be
+    fetched before) or that are asked for are fetched, and the price accounts only
+    of the products whose list of price accounts changed. Everything is fetched in
+    batches of getMultipleAccounts requests, so a refresh where nothing changed
+    costs one request, not a download of every account of the program.
+
+    The accounts of the catalog are updated in place, which lets a program
+    subscription of a watch session keep them up to date between refreshes.
+    """
+
+    def __init__(
+        self, solana: SolanaClient, first_mapping_key: SolanaPublicKeyOrStr
+    ) -> None:
+        self._solana = solana
+        self._first_mapping_key = SolanaPublicKey(first_mapping_key)
+        self._mappings: List[PythMappingAccount] = []
+        self._products: Dict[str, PythProductAccount] = {}
+
+    @property
+    def mappings(self) -> List[PythMappingAccount]:
+        return list(self._mappings)
+
+    @property
+    def products(self) -> List[PythProductAccount]:
+        return list(self._products.values())
+
+    def restore(
+        self, mappings: List[PythMappingAccount], products: List[PythProductAccount]
+    ) -> None:
+        """Use accounts restored from elsewhere (e.g. a snapshot). Products that
+        were not fetched are fetched on the next refresh."""
+        self._mappings = list(mappings)
+        self._products = {str(product.key): product for product in products}
+
+    def accounts(self) -> List[PythAccount]:
+        """All the accounts, in the order of `PythClient.get_all_accounts`."""
+        accounts: List[PythAccount] = list(self._mappings)
+        for product in self._products.values():
+            accounts.append(product)
+            accounts.extend(product.prices.values())
+        return accounts
+
+    async def refresh(
+        self, refetch: Iterable[PythProductAccount] = ()
+    ) -> CatalogChanges:
+        """Bring the catalog up to date with the mapping accounts. The products
+        in `refetch` and their price accounts are fetched again as well, as their
+        changes are only seen by fetching them."""
+        await self._refresh_mappings()
+
+        product_keys = [
+            str(key) for mapping in self._mappings for key in mapping.entries
+        ]
+        removed_keys = self._products.keys() - set(product_keys)
+        added = 0
+        products: Dict[str, PythProductAccount] = {}
+        for key in product_keys:
+            product = self._products.get(key)
+            if product is None:
+                product = PythProductAccount(SolanaPublicKey(key), self._solana)
+                added += 1
+            products[key] = product
+        self._products = products
+
+        fetched: List[PythAccount] = [
+            product for product in products.values() if product.slot is None
+        ]
+        for product in refetch:
+            if products.get(str(product.key)) is product and product.slot is not None:
+                fetched.append(product)
+                if not _prices_outdated(product):
+                    fetched.extend(product.prices.values())
+        await self._solana.update_accounts(fetched)
+
+        repriced = [
+            product for product in self._products.values() if _prices_outdated(product)
+        ]
+        await self._fetch_prices(repriced)
+
+        return CatalogChanges(
+            added_products=added,
+            removed_products=len(removed_keys),
+            repriced_products=len(repriced),
+        )
+
+    async def _refresh_mappings(self) -> None:
+        # The known mapping accounts are fetched at once, and only the new ones
+        # at the end of the list one by one, as each points to the next
+        await self._solana.update_accounts(self._mappings)
+        known_mappings = {str(mapping.key): mapping for mapping in self._mappings}
+
+        mappings: List[PythMappingAccount] = []
+        key = self._first_mapping_key
+        while key is not None:
+            mapping = known_mappings.get(str(key))
+            if mapping is None:
+                mapping = PythMappingAccount(key, self._solana)
+                await self._solana.update_accounts([mapping])
+            mappings.append(mapping)
+            key = mapping.next_account_key
+        self._mappings = mappings
+
+    async def _fetch_prices(self, products: List[PythProductAccount]) -> None:
+        # The price accounts of a product form a linked list, so they are fetched
+        # one level of all the lists at a time
+        chains = [
+            (product, [], product.first_price_account_key) for product in products
+        ]
+        while chains:
+            prices = [
+                PythPriceAccount(key, self._solana, product=product)
+                for product, _, key in chains
+                if key
+            ]
+            await self._solana.update_accounts(prices)
+
+            next_chains = []
+            fetched = iter(prices)
+            for product, chain, key in chains:
+                if key:
+                    price = next(fetched)
+                    chain.append(price)
+                    if price.next_price_account_key:
+                        next_chains.append(
+                            (product, chain, price.next_price_account_key)
+                        )
+                        continue
+                product.use_price_accounts(chain)
+            chains = next_chains
+
+
+def _prices_outdated(product: PythProductAccount) -> bool:
+    """Whether the price accounts of the product are not (all) loaded, or no
+    longer follow the list starting at its first price account."""
+    try:
+        prices = product.prices.values()
+    except NotLoadedException:
+        return True
+    key = product.first_price_account_key
+    for price in prices:
+        if price.key != key or price.slot is None:
+            return True
+        key = price.next_price_account_key
+    return key is not None
@@ -0,0 +1,257 @@
+import base64
+import struct
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from pythclient.pythaccounts import (
+    PythPriceAccount,
+    PythPriceComponent,
+    PythPriceInfo,
+    PythPriceStatus,
+)
+from pythclient.solana import SolanaAccount
+from structlog import get_logger
+
+from pyth_publisher.metrics import REPLICATOR_DECODE_SECONDS
+
+log = get_logger()
+
+_MAGIC = 0xA1B2C3D4
+_VERSION_2 = 2
+_PRICE_ACCOUNT_TYPE = 3
+_DEFAULT_MAX_LATENCY = 25
+
+# magic, version, account type, account data size
+_HEADER = struct.Struct("<IIII")
+# The fixed-offset fields of a v2 price account read on every update, from the
+# exponent (offset 20) up to the end of the aggregate price info (offset 240):
+# exponent, number of components, last slot, valid slot, timestamp, min publishers,
+# max latency, aggregate price, aggregate confidence, aggregate status and
+# aggregate publish slot.
+_V2_AGGREGATE = struct.Struct("<iI4xQQ48xqBxB5x96xqQI4xQ")
+_V2_AGGREGATE_OFFSET = 20
+_V2_COMPONENTS_OFFSET = 240
+
+# The latest price info of each publisher component, as laid out in the account
+# data: publisher key (32 bytes), last aggregate price info (32 bytes) and latest
+# price info (32 bytes).
+LATEST_PRICE_INFO_DTYPE = np.dtype(
+    {
+        "names": ["publisher_key", "price", "conf", "status", "pub_slot"],
+        "formats": [("<u8", 4), "<i8", "<u8", "<u4", "<u8"],
+        "offsets": [0, 64, 72, 80, 88],
+        "itemsize": PythPriceComponent.LENGTH,
+    }
+)
+
+
+class LazyPythPriceAccount(PythPriceAccount):
+    """A price account that decodes only what the replicator reads on every update.
+
+    On a websocket update only the aggregate price, confidence, status, timestamp
+    and the few fields needed to interpret them are unpacked from fixed offsets of
+    the raw account data. The publisher price components are decoded from the same
+    buffer on the first access of `price_components` or `aggregate_price_info`,
+    which only happens on the manual aggregation path.
+
+    Accounts with a layout other than v2 are decoded fully by pythclient.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        self._data: Optional[bytes] = None
+        self._size = 0
+        self._agg_raw_price = 0
+        self._agg_raw_conf = 0
+        self._agg_status = PythPriceStatus.UNKNOWN.value
+        self._agg_pub_slot = 0
+        self._aggregate_price_info: Optional[PythPriceInfo] = None
+        self._price_components: Optional[List[PythPriceComponent]] = None
+        # The slot of the last update received, even if it was ignored
+        self.received_slot: Optional[int] = None
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def from_price_account(cls, account: PythPriceAccount) -> "LazyPythPriceAccount":
+        return cls(account.key, account.solana, product=account.product)
+
+    def update_with_rpc_response(self, slot: int, value: Dict[str, Any]) -> None:
+        start = time.perf_counter()
+        try:
+            self._update_with_rpc_response(slot, value)
+        finally:
+            REPLICATOR_DECODE_SECONDS.observe(time.perf_counter() - start)
+
+    def _update_with_rpc_response(self, slot: int, value: Dict[str, Any]) -> None:
+        # Never go back to an older state if updates arrive out of order. An
+        # update of the same slot (e.g. from another websocket endpoint) carries
+        # the same confirmed data, so it is not decoded again.
+        self.received_slot = slot
+        if self.slot is not None and slot <= self.slot:
+            return
+        SolanaAccount.update_with_rpc_response(self, slot, value)
+        if "data" not in value:
+            raise ValueError(
+                f"invalid account data response from Solana for key {self.key}: {value}"
+            )
+        data_base64, data_format = value["data"]
+        if data_format != "base64":
+            raise ValueError(f"unexpected data type from Solana: {data_format}")
+        data = base64.b64decode(data_base64)
+
+        magic, version, type_, size = _HEADER.unpack_from(data)
+        if magic != _MAGIC or type_ != _PRICE_ACCOUNT_TYPE or len(data) < size:
+            raise ValueError(f"{self.key} is not a valid Pyth price account")
+
+        try:
+            if version == _VERSION_2:
+                self._update_aggregate(data, size)
+            else:
+                self._data = None
+                self.update_from(data[:size], version=version, offset=_HEADER.size)
+        except Exception:
+            log.exception("error while parsing price account", account_key=self.key)
+
+    def _update_aggregate(self, data: bytes, size: int) -> None:
+        (
+            self.exponent,
+            self.num_components,
+            self.last_slot,
+            self.valid_slot,
+            self.timestamp,
+            self.min_publishers,
+            max_latency,
+            self._agg_raw_price,
+            self._agg_raw_conf,
+            self._agg_status,
+            self._agg_pub_slot,
+        ) = _V2_AGGREGATE.unpack_from(data, _V2_AGGREGATE_OFFSET)
+        # a max latency of 0 is the default max latency
+        self.max_latency = max_latency or _DEFAULT_MAX_LATENCY
+        self._data = data
+        self._size = size
+        self._aggregate_price_info = None
+        self._price_components = None
+
+    @property
+    def aggregate_price_info(self) -> Optional[PythPriceInfo]:
+        if self._aggregate_price_info is None and self._data is not None:
+            self._aggregate_price_info = PythPriceInfo(
+                self._agg_raw_price,
+                self._agg_raw_conf,
+                PythPriceStatus(self._agg_status),
+                self._agg_pub_slot,
+                self.exponent,
+            )
+        return self._aggregate_price_info
+
+    @aggregate_price_info.setter
+    def aggregate_price_info(self, value: Optional[PythPriceInfo]) -> None:
+        self._aggregate_price_info = value
+
+    @property
+    def price_components(self) -> List[PythPriceComponent]:
+        if self._price_components is None:
+            self._price_components = self._decode_price_components()
+        return self._price_components
+
+    @price_components.setter
+    def price_components(self, value: List[PythPriceComponent]) -> None:
+        self._price_components = value
+
+    def _decode_price_components(self) -> List[PythPriceComponent]:
+        price_components: List[PythPriceComponent] = []
+        if self._data is None:
+            return price_components
+
+        offset = _V2_COMPONENTS_OFFSET
+        while offset < self._size:
+            component = PythPriceComponent.deserialise(
+                self._data, offset, exponent=self.exponent
+            )
+            if not component:
+                break
+            price_components.append(component)
+            offset += PythPriceComponent.LENGTH
+        return price_components
+
+    def latest_price_infos(self) -> np.ndarray:
+        """The raw latest price info of every publisher component.
+
+        For v2 accounts this is a read-only view on the account data, so reading
+        the components of an update does not create any Python objects.
+        """
+        if self._data is None:
+            return np.array(
+                [
+                    (
+                        (0, 0, 0, 0),
+                        info.raw_price,
+                        info.raw_confidence_interval,
+                        info.price_status.value,
+                        info.pub_slot,
+                    )
+                    for info in (
+                        component.latest_price_info
+                        for component in self.price_components
+                    )
+                ],
+                dtype=LATEST_PRICE_INFO_DTYPE,
+            )
+
+        infos = np.frombuffer(
+            self._data,
+            dtype=LATEST_PRICE_INFO_DTYPE,
+            count=(self._size - _V2_COMPONENTS_OFFSET) // PythPriceComponent.LENGTH,
+            offset=_V2_COMPONENTS_OFFSET,
+        )
+        # Like pythclient, stop at the first component without a publisher
+        empty = ~infos["publisher_key"].any(axis=1)
+        if empty.any():
+            infos = infos[: int(empty.argmax())]
+        return infos
+
+    @property
+    def aggregate_price_status(self) -> Optional[PythPriceStatus]:
+        if self._data is None:
+            return super().aggregate_price_status
+        if (
+            self._agg_status == PythPriceStatus.TRADING.value
+            and self.slot - self._agg_pub_slot > self.max_latency
+        ):
+            return PythPriceStatus.UNKNOWN
+        return PythPriceStatus(self._agg_status)
+
+    @property
+    def aggregate_price(self) -> Optional[float]:
+        if self._data is None:
+            return super().aggregate_price
+        if self.aggregate_price_status == PythPriceStatus.TRADING:
+            return self._agg_raw_price * (10**self.exponent)
+        return None
+
+    @property
+    def aggregate_price_confidence_interval(self) -> Optional[float]:
+        if self._data is None:
+            return super().aggregate_price_confidence_interval
+        if self.aggregate_price_status == PythPriceStatus.TRADING:
+            return self._agg_raw_conf * (10**self.exponent)
+        return None
+
+    @property
+    def aggregate_raw_price(self) -> Optional[int]:
+        """The aggregate price as an integer mantissa of `exponent`, None if it
+        is not currently available."""
+        if self.aggregate_price_status != PythPriceStatus.TRADING:
+            return None
+        if self._data is None:
+            return self.aggregate_price_info.raw_price
+        return self._agg_raw_price
+
+    @property
+    def aggregate_raw_confidence_interval(self) -> Optional[int]:
+        if self.aggregate_price_status != PythPriceStatus.TRADING:
+            return None
+        if self._data is None:
+            return self.aggregate_price_info.raw_confidence_interval
+        return self._agg_raw_conf
@@ -1,13 +1,34 @@
 import asyncio
-from typing import Dict, List, Optional, Tuple
-from pythclient.pythclient import PythClient
-from pythclient.pythaccounts import PythPriceAccount, PythPriceStatus
+import logging
+import random
+from typing import Dict, List, Optional, Set, Tuple, Union
+from urllib.parse import urlsplit
+import numpy as np
+from pythclient.pythclient import PythClient, WatchSession
+from pythclient.pythaccounts import PythAccount, PythPriceAccount, PythPriceStatus
+from pythclient.solana import SolanaClient
 import time
 
 
 from structlog import get_logger
 
-from pyth_publisher.provider import Price, Provider, PythSymbol
+from pyth_publisher import logs
+from pyth_publisher.metrics import (
+    PROVIDER_STALE_PRICES,
+    REPLICATOR_ENDPOINT_LAG_SECONDS,
+    REPLICATOR_ENDPOINT_UPDATES,
+    REPLICATOR_UPDATES_DROPPED_STALE,
+    REPLICATOR_UPDATES_DROPPED_SUPERSEDED,
+    REPLICATOR_WS_UPDATES,
+)
+from pyth_publisher.provider import Price, PriceTable, Provider, PythSymbol
+from pyth_publisher.providers.pyth_account_catalog import PythAccountCatalog
+from pyth_publisher.providers.pyth_price_decoder import LazyPythPriceAccount
+from pyth_publisher.providers.pyth_snapshot import (
+    encode_snapshot,
+    read_snapshot,
+    write_snapshot,
+)
 
 from ..config import PythReplicatorConfig
 
@@ -17,6 +38,15 @@ log = get_logger()
 # Any feed with >= this number of min publishers is considered "coming soon".
 COMING_SOON_MIN_PUB_THRESHOLD = 10
 
+# The maximum number of publisher components of a Pythnet price account
+MAX_PRICE_COMPONENTS = 64
+
+# After a reconnection, how long to wait for the websocket updates to resume
+# before refetching the accounts that did not get any
+GAP_RECOVERY_DELAY_SECS = 1
+
+_STALE_PRICES = PROVIDER_STALE_PRICES.labels("pyth_replicator")
+
 
 class PythReplicator(Provider):
     def __init__(self, config: PythReplicatorConfig) -> None:
@@ -27,133 +57,633 @@ class PythReplicator(Provider):
             first_mapping_account_key=config.first_mapping,
             program_key=config.program_key,
         )
-        self._prices: Dict[str, Optional[Price]] = {}
+        self._catalog = PythAccountCatalog(self._client.solana, config.first_mapping)
+        self._prices = PriceTable()
+        self._ws: Optional[WatchSession] = None
         self._update_accounts_task: Optional[asyncio.Task] = None
+        # The price accounts given to the watch session, decoded lazily on updates
+        self._watched_price_accounts: Dict[str, LazyPythPriceAccount] = {}
+        # Scratch space for the publisher prices of manual aggregation
+        self._manual_agg_buffer = np.empty(3 * MAX_PRICE_COMPONENTS)
+        # Only used when `filtered_subscription` is enabled
+        self._product_symbols: Set[PythSymbol] = set()
+        self._subscribed_accounts: Dict[str, PythPriceAccount] = {}
+        self._price_subscriptions_outdated = asyncio.Event()
+        self._updates = UpdateCoalescer()
+        self._handle_updates_task: Optional[asyncio.Task] = None
+        # All the accounts of the Pyth program, kept to subscribe again after
+        # a reconnection without fetching them again
+        self._accounts: Optional[List[PythAccount]] = None
+        # Whether the accounts were restored from the snapshot, in which case the
+        # first update of the accounts reconciles them with the chain
+        self._accounts_restored = False
+        self._ws_failures = 0
+        self._gap_recovery_task: Optional[asyncio.Task] = None
+        self._snapshot_task: Optional[asyncio.Task] = None
+        # The hedge websockets mirror the subscriptions of the primary one,
+        # which are published here for them
+        self._accounts_fetched = asyncio.Event()
+        self._wanted_price_accounts: Dict[str, PythPriceAccount] = {}
+        self._subscriptions_version = 0
+        self._subscriptions_synced = asyncio.Event()
+        self._hedge_sessions: Dict[str, WatchSession] = {}
+        # The watch sessions that could not be given the latest accounts yet, as
+        # they were not subscribed to the program at the time
+        self._outdated_sessions: Set[WatchSession] = set()
+        self._hedge_tasks: List[asyncio.Task] = []
+        # Only raced when there are hedge endpoints
+        self._race: Optional[EndpointRace] = None
+        self._primary_endpoint: Optional[EndpointStats] = None
+        if config.hedge_ws_endpoints:
+            self._race = EndpointRace()
+            self._primary_endpoint = EndpointStats(config.ws_endpoint)
 
     async def _update_loop(self) -> None:
-        self._ws = self._client.create_watch_session()
+        self._handle_updates_task = asyncio.create_task(self._handle_updates_loop())
+        if self._config.snapshot_path is not None:
+            self._snapshot_task = asyncio.create_task(self._snapshot_loop())
+        self._hedge_tasks = [
+            asyncio.create_task(self._hedge_loop(endpoint))
+            for endpoint in self._config.hedge_ws_endpoints
+        ]
+
+        # Supervises the websocket: whenever it fails, a new one is connected and
+        # subscribed to the same accounts
+        while True:
+            try:
+                await self._watch()
+            except Exception:
+                self._ws_failures += 1
+                log.exception("Pyth replicator WS failed", failures=self._ws_failures)
+            await asyncio.sleep(self._ws_backoff_secs(self._ws_failures))
+
+    def _ws_backoff_secs(self, failures: int) -> float:
+        backoff = min(self._config.ws_reconnect_max_backoff_secs, 2 ** (failures - 1))
+        return random.uniform(0, backoff)
+
+    async def _watch(self) -> None:
+        if self._ws is not None:
+            await self._ws.disconnect()
+        self._ws = ReconnectCountingWatchSession(self._client.solana)
         log.info("Creating Pyth replicator WS")
 
         await self._ws.connect()
-        await self._ws.program_subscribe(
-            self._config.program_key, await self._client.get_all_accounts()
-        )
-
-        self._update_accounts_task = asyncio.create_task(self._update_accounts_loop())
+        reconnecting = self._accounts is not None
+        if not reconnecting:
+            self._accounts_restored = await self._load_accounts()
+        if self._config.filtered_subscription:
+            self._subscribed_accounts = {}
+            await self._sync_price_subscriptions()
+        else:
+            await self._ws.program_subscribe(
+                self._config.program_key, self._watched_accounts(self._accounts)
+            )
+        self._ws_failures = 0
+
+        if reconnecting:
+            self._start_gap_recovery()
+        # Not when the accounts were loaded, as the first subscription may fail
+        if self._update_accounts_task is None:
+            self._update_accounts_task = asyncio.create_task(
+                self._update_accounts_loop(reconcile=self._accounts_restored)
+            )
 
+        reconnects = self._ws.reconnects
         while True:
+            if self._config.filtered_subscription:
+                await self._maybe_sync_price_subscriptions()
             update = await self._ws.next_update()
-            log.debug("Received a WS update", account_key=update.key, slot=update.slot)
-            if isinstance(update, PythPriceAccount) and update.product is not None:
-                symbol = update.product.symbol
-
-                if self._prices.get(symbol) is None:
-                    self._prices[symbol] = None
-
-                if (
-                    update.aggregate_price_status == PythPriceStatus.TRADING
-                    and update.aggregate_price is not None
-                    and update.aggregate_price_confidence_interval is not None
-                ):
-                    self._prices[symbol] = Price(
-                        update.aggregate_price,
-                        update.aggregate_price_confidence_interval,
-                        update.timestamp,
-                    )
-                elif (
-                    self._config.manual_agg_enabled
-                    and update.min_publishers is not None
-                    and update.min_publishers >= COMING_SOON_MIN_PUB_THRESHOLD
-                ):
-                    # Do the manual aggregation based on the recent active publishers
-                    # and their confidence intervals if possible. This will allow us to
-                    # get an aggregate if there are some active publishers but they are
-                    # not enough to reach the min_publishers threshold.
-                    #
-                    # Note that we only manually aggregate for feeds that are coming soon. Some feeds should go
-                    # offline outside of market hours (e.g., Equities, Metals). Manually aggregating for these feeds
-                    # can cause them to come online at unexpected times if a single data provider publishes at that time.
-                    prices: List[float] = []
-
-                    current_slot = update.slot
-                    for price_component in update.price_components:
-                        price = price_component.latest_price_info
-                        if (
-                            price.price_status == PythPriceStatus.TRADING
-                            and current_slot is not None
-                            and current_slot - price.pub_slot
-                            <= self._config.manual_agg_max_slot_diff
-                        ):
-                            prices.extend(
-                                [
-                                    price.price - price.confidence_interval,
-                                    price.price,
-                                    price.price + price.confidence_interval,
-                                ]
-                            )
-                            break
-
-                    if prices:
-                        agg_price, agg_confidence_interval = manual_aggregate(prices)
-
-                        self._prices[symbol] = Price(
-                            agg_price, agg_confidence_interval, update.timestamp
-                        )
-
-                log.info(
-                    "Received a price update", symbol=symbol, price=self._prices[symbol]
+            if self._ws.reconnects != reconnects:
+                # The watch session reconnected on its own in the meantime
+                reconnects = self._ws.reconnects
+                self._on_reconnected()
+            if logs.enabled_for(logging.DEBUG):
+                log.debug(
+                    "Received a WS update", account_key=update.key, slot=update.slot
+                )
+            self._on_ws_update(update, self._primary_endpoint)
+
+    def _on_reconnected(self) -> None:
+        self._start_gap_recovery()
+        if not self._config.filtered_subscription:
+            # It subscribed again with the accounts it had before
+            self._update_watched_accounts()
+
+    def _on_ws_update(
+        self, update: PythAccount, endpoint: Optional["EndpointStats"]
+    ) -> None:
+        REPLICATOR_WS_UPDATES.inc()
+        if not isinstance(update, LazyPythPriceAccount) or update.product is None:
+            return
+        if self._race is not None and not self._race.record(
+            endpoint, str(update.key), update.received_slot
+        ):
+            return
+        self._updates.put(update)
+
+    async def _hedge_loop(self, endpoint: str) -> None:
+        # Receives the updates of the accounts subscribed on the primary websocket
+        # from another endpoint too. Both update the same account objects.
+        solana = SolanaClient(endpoint=self._config.http_endpoint, ws_endpoint=endpoint)
+        stats = EndpointStats(endpoint)
+        failures = 0
+        while True:
+            ws = ReconnectCountingWatchSession(solana)
+            try:
+                await ws.connect()
+                self._hedge_sessions[endpoint] = ws
+                log.info("Created Pyth replicator hedge WS", endpoint=stats.label)
+                await self._watch_hedge(ws, stats)
+            except Exception:
+                failures += 1
+                log.exception(
+                    "Pyth replicator hedge WS failed",
+                    endpoint=stats.label,
+                    failures=failures,
                 )
+            finally:
+                self._hedge_sessions.pop(endpoint, None)
+                await ws.disconnect()
+            await asyncio.sleep(self._ws_backoff_secs(failures))
+
+    async def _watch_hedge(
+        self, ws: "ReconnectCountingWatchSession", stats: "EndpointStats"
+    ) -> None:
+        if not self._config.filtered_subscription:
+            await self._accounts_fetched.wait()
+            await ws.program_subscribe(
+                self._config.program_key, self._watched_accounts(self._accounts)
+            )
 
-    async def _update_accounts_loop(self) -> None:
+        version = None
+        subscribed: Dict[str, PythPriceAccount] = {}
         while True:
-            log.info("Update Pyth accounts")
-            await self._client.refresh_products()
-            await self._client.refresh_all_prices()
-            self._ws.update_program_accounts(
-                self._config.program_key, await self._client.get_all_accounts()
+            if self._config.filtered_subscription:
+                # Without any subscription no update would ever arrive
+                while version == self._subscriptions_version and not subscribed:
+                    await self._subscriptions_synced.wait()
+                if version != self._subscriptions_version:
+                    version = self._subscriptions_version
+                    await self._mirror_price_subscriptions(ws, subscribed)
+            update = await ws.next_update()
+            self._on_ws_update(update, stats)
+
+    async def _mirror_price_subscriptions(
+        self, ws: WatchSession, subscribed: Dict[str, PythPriceAccount]
+    ) -> None:
+        wanted_accounts = self._wanted_price_accounts
+        for key in subscribed.keys() - wanted_accounts.keys():
+            await ws.unsubscribe(subscribed.pop(key))
+        for key in wanted_accounts.keys() - subscribed.keys():
+            await ws.subscribe(wanted_accounts[key])
+            subscribed[key] = wanted_accounts[key]
+
+    async def _load_accounts(self) -> bool:
+        """Load the accounts from the snapshot if there is one, and fetch them
+        otherwise. Returns whether they were restored from the snapshot."""
+        restored = self._restore_snapshot()
+        if not restored:
+            await self._catalog.refresh()
+        self._accounts = self._catalog.accounts()
+        self._accounts_fetched.set()
+        return restored
+
+    def _restore_snapshot(self) -> bool:
+        path = self._config.snapshot_path
+        if path is None:
+            return False
+        try:
+            snapshot = read_snapshot(path, self._client.solana)
+        except Exception:
+            log.exception("Failed to read the Pyth replicator snapshot", path=path)
+            return False
+        if snapshot is None:
+            return False
+
+        self._catalog.restore(snapshot.mappings, snapshot.products)
+        for symbol, price in snapshot.prices.items():
+            self._prices.set(
+                self._prices.index(symbol),
+                price.price,
+                price.conf,
+                price.timestamp,
+                price.slot,
+                price.exponent,
+            )
+        log.info(
+            "Restored the Pyth replicator snapshot",
+            path=path,
+            products=len(snapshot.products),
+            prices=len(snapshot.prices),
+        )
+        return True
+
+    async def _snapshot_loop(self) -> None:
+        await self._accounts_fetched.wait()
+        while True:
+            await asyncio.sleep(self._config.snapshot_interval_secs)
+            try:
+                content = encode_snapshot(
+                    self._catalog.mappings,
+                    self._catalog.products,
+                    {
+                        symbol: price
+                        for symbol in self._prices.keys()
+                        if (price := self._prices.get(symbol)) is not None
+                    },
+                )
+                await asyncio.to_thread(
+                    write_snapshot, self._config.snapshot_path, content
+                )
+                log.debug("Saved the Pyth replicator snapshot", size=len(content))
+            except Exception:
+                log.exception("Failed to save the Pyth replicator snapshot")
+
+    def _start_gap_recovery(self) -> None:
+        if self._gap_recovery_task is None or self._gap_recovery_task.done():
+            self._gap_recovery_task = asyncio.create_task(self._recover_gap())
+
+    async def _recover_gap(self) -> None:
+        # The updates sent while the websocket was disconnected are lost. Instead
+        # of fetching all the accounts again, only the price accounts that did
+        # not get any update since the reconnection are fetched.
+        try:
+            reconnect_slot = await self._client.solana.get_slot()
+            await asyncio.sleep(GAP_RECOVERY_DELAY_SECS)
+            accounts = [
+                account
+                for account in (
+                    self._subscribed_accounts.values()
+                    if self._config.filtered_subscription
+                    else self._watched_price_accounts.values()
+                )
+                if account.slot is None or account.slot < reconnect_slot
+            ]
+            log.info(
+                "Recovering missed Pyth price updates",
+                accounts=len(accounts),
+                reconnect_slot=reconnect_slot,
+            )
+            await self._client.solana.update_accounts(accounts)
+            for account in accounts:
+                if account.slot is not None and account.product is not None:
+                    self._updates.put(account)
+        except Exception:
+            log.exception("Failed to recover missed Pyth price updates")
+
+    async def _handle_updates_loop(self) -> None:
+        # Handles the updates received by `_update_loop`. If handling falls behind
+        # the websocket, only the newest update of each account is handled.
+        while True:
+            for update in await self._updates.drain():
+                try:
+                    self._handle_price_update(update)
+                except Exception:
+                    log.exception(
+                        "Failed to handle a price update", account_key=update.key
+                    )
+
+    def _handle_price_update(self, update: LazyPythPriceAccount) -> None:
+        symbol = update.product.symbol
+        index = self._prices.index(symbol)
+
+        raw_price = update.aggregate_raw_price
+        raw_conf = update.aggregate_raw_confidence_interval
+        if raw_price is not None and raw_conf is not None:
+            # The integer mantissas are kept, so a price is published exactly
+            self._prices.set(
+                index,
+                raw_price,
+                raw_conf,
+                update.timestamp,
+                update.slot,
+                update.exponent,
+            )
+        elif (
+            self._config.manual_agg_enabled
+            and update.min_publishers is not None
+            and update.min_publishers >= COMING_SOON_MIN_PUB_THRESHOLD
+        ):
+            # Do the manual aggregation based on the recent active publishers
+            # and their confidence intervals if possible. This will allow us to
+            # get an aggregate if there are some active publishers but they are
+            # not enough to reach the min_publishers threshold.
+            #
+            # Note that we only manually aggregate for feeds that are coming soon. Some feeds should go
+            # offline outside of market hours (e.g., Equities, Metals). Manually aggregating for these feeds
+            # can cause them to come online at unexpected times if a single data provider publishes at that time.
+            prices = self._manual_agg_prices(update)
+
+            if len(prices):
+                agg_price, agg_confidence_interval = manual_aggregate(prices)
+
+                self._prices.set(
+                    index,
+                    agg_price,
+                    agg_confidence_interval,
+                    update.timestamp,
+                    update.slot,
+                )
+
+        record = self._prices.at(index)
+        if record is not None and logs.enabled_for(logging.INFO):
+            # The record is updated in place, and rendered on the log writer thread
+            log.info(
+                "Received a price update",
+                symbol=symbol,
+                price=record.price,
+                conf=record.conf,
+                exponent=record.exponent,
+                slot=record.slot,
+            )
+
+    def _manual_agg_prices(self, update: LazyPythPriceAccount) -> np.ndarray:
+        """The price, price - conf and price + conf of every publisher that is
+        trading and has published within `manual_agg_max_slot_diff` slots."""
+        if update.slot is None:
+            return self._manual_agg_buffer[:0]
+
+        infos = update.latest_price_infos()
+        eligible = infos[
+            (infos["status"] == PythPriceStatus.TRADING.value)
+            & (infos["pub_slot"] + self._config.manual_agg_max_slot_diff >= update.slot)
+        ]
+        num_prices = len(eligible)
+        if 3 * num_prices > len(self._manual_agg_buffer):
+            self._manual_agg_buffer = np.empty(3 * num_prices)
+        lower, price, upper = self._manual_agg_buffer[: 3 * num_prices].reshape(
+            3, num_prices
+        )
+
+        scale = 10**update.exponent
+        np.multiply(eligible["price"], scale, out=price)
+        conf = eligible["conf"] * scale
+        np.subtract(price, conf, out=lower)
+        np.add(price, conf, out=upper)
+        return self._manual_agg_buffer[: 3 * num_prices]
+
+    def _watched_price_account(
+        self, price_account: PythPriceAccount
+    ) -> LazyPythPriceAccount:
+        key = str(price_account.key)
+        watched = self._watched_price_accounts.get(key)
+        if watched is None:
+            watched = LazyPythPriceAccount.from_price_account(price_account)
+            self._watched_price_accounts[key] = watched
+        watched.product = price_account.product
+        return watched
+
+    def _watched_accounts(self, accounts: List[PythAccount]) -> List[PythAccount]:
+        return [
+            (
+                self._watched_price_account(account)
+                if isinstance(account, PythPriceAccount)
+                else account
             )
-            log.info("Finished updating Pyth accounts")
+            for account in accounts
+        ]
+
+    async def _maybe_sync_price_subscriptions(self) -> None:
+        # Subscribing and receiving updates share the same websocket, so the
+        # subscriptions are only changed from the update loop, between updates.
+        # Without any subscription no update would ever arrive, so wait for the
+        # product list to change instead.
+        if not self._subscribed_accounts:
+            await self._price_subscriptions_outdated.wait()
+        if self._price_subscriptions_outdated.is_set():
+            await self._sync_price_subscriptions()
+
+    async def _sync_price_subscriptions(self) -> None:
+        self._price_subscriptions_outdated.clear()
+
+        wanted_accounts: Dict[str, PythPriceAccount] = {}
+        for product in self._catalog.products:
+            if product.symbol in self._product_symbols:
+                for price_account in (await product.get_prices()).values():
+                    wanted_accounts[str(price_account.key)] = (
+                        self._watched_price_account(price_account)
+                    )
 
+        removed_keys = self._subscribed_accounts.keys() - wanted_accounts.keys()
+        for key in removed_keys:
+            await self._ws.unsubscribe(self._subscribed_accounts.pop(key))
+        added_keys = wanted_accounts.keys() - self._subscribed_accounts.keys()
+        for key in added_keys:
+            await self._ws.subscribe(wanted_accounts[key])
+            self._subscribed_accounts[key] = wanted_accounts[key]
+
+        if self._prices.retain(self._product_symbols):
+            self.price_indexes_version += 1
+
+        # Replaced rather than updated, so the hedge websockets never see a
+        # partial set of subscriptions
+        self._wanted_price_accounts = wanted_accounts
+        self._subscriptions_version += 1
+        self._subscriptions_synced.set()
+        self._subscriptions_synced = asyncio.Event()
+
+        log.info(
+            "Synced Pyth price account subscriptions",
+            subscribed=len(self._subscribed_accounts),
+            added=len(added_keys),
+            removed=len(removed_keys),
+        )
+
+    async def _update_accounts_loop(self, reconcile: bool = False) -> None:
+        # The accounts were just fetched to subscribe to them, unless they were
+        # restored from the snapshot and need to be reconciled with Pythnet
+        if reconcile:
+            await self._try_update_accounts()
+        while True:
             await asyncio.sleep(self._config.account_update_interval_secs)
+            await self._try_update_accounts()
+
+    async def _try_update_accounts(self) -> None:
+        log.info("Update Pyth accounts")
+        try:
+            await self._update_accounts()
+        except Exception:
+            # e.g. while the websocket is reconnecting
+            log.exception("Failed to update Pyth accounts")
+
+    async def _update_accounts(self) -> None:
+        if self._config.filtered_subscription:
+            # Nothing keeps the subscribed products up to date in between, so
+            # they are fetched again
+            changes = await self._catalog.refresh(
+                product
+                for product in self._catalog.products
+                if product.symbol in self._product_symbols
+            )
+            self._accounts = self._catalog.accounts()
+            self._price_subscriptions_outdated.set()
+        else:
+            # The program subscription keeps the known accounts up to date, so
+            # the watch sessions only need to learn about new ones
+            changes = await self._catalog.refresh()
+            if changes:
+                self._accounts = self._catalog.accounts()
+                self._outdated_sessions.update(
+                    [self._ws, *self._hedge_sessions.values()]
+                )
+            self._update_watched_accounts()
+        log.info(
+            "Finished updating Pyth accounts",
+            added_products=changes.added_products,
+            removed_products=changes.removed_products,
+            repriced_products=changes.repriced_products,
+        )
 
-    def upd_products(self, *args) -> None:
-        # This provider stores all the possible feeds and
-        # does not care about the desired products as knowing
-        # them does not improve the performance of the replicator
-        # websocket. Although the websocket filters the given accounts
-        # but this filtering happens in the client-side and not on the server-side.
-        pass
+    def _update_watched_accounts(self) -> None:
+        """Give the latest accounts to the outdated watch sessions. The ones that
+        are not subscribed to the program, e.g. while reconnecting, stay outdated
+        until the next attempt."""
+        self._outdated_sessions &= {self._ws, *self._hedge_sessions.values()}
+        if not self._outdated_sessions:
+            return
+        watched_accounts = self._watched_accounts(self._accounts)
+        for ws in list(self._outdated_sessions):
+            try:
+                ws.update_program_accounts(self._config.program_key, watched_accounts)
+            except ValueError:
+                log.info("Pyth replicator WS not subscribed, accounts not updated")
+                continue
+            self._outdated_sessions.discard(ws)
+
+    def upd_products(self, product_symbols: List[PythSymbol]) -> None:
+        # Without `filtered_subscription` this provider stores all the possible
+        # feeds from the program subscription and does not care about the desired
+        # products, as the websocket only filters the accounts client-side.
+        # With it, only the price accounts of these products are subscribed to.
+        symbols = set(product_symbols)
+        if symbols != self._product_symbols:
+            self._product_symbols = symbols
+            self._price_subscriptions_outdated.set()
 
     def latest_price(self, symbol: PythSymbol) -> Optional[Price]:
-        price = self._prices.get(symbol, None)
+        return self._fresh(self._prices.get(symbol))
+
+    def price_index(self, symbol: PythSymbol) -> Optional[int]:
+        return self._prices.index(symbol)
 
+    def latest_price_at(self, index: int) -> Optional[Price]:
+        return self._fresh(self._prices.at(index))
+
+    def _fresh(self, price: Optional[Price]) -> Optional[Price]:
         if not price:
             return None
 
         if time.time() - price.timestamp > self._config.staleness_time_in_secs:
+            _STALE_PRICES.inc()
             return None
 
         return price
 
 
-def manual_aggregate(prices: List[float]) -> Tuple[float, float]:
+class ReconnectCountingWatchSession(WatchSession):
+    """A watch session counting the reconnections it does on its own, as updates
+    may have been missed during each of them."""
+
+    reconnects = 0
+
+    async def reconnect(self):
+        await super().reconnect()
+        self.reconnects += 1
+
+
+class EndpointStats:
+    """The metrics of a websocket endpoint, resolved once. The endpoint is
+    labelled by its host only, as its URL may contain an API key."""
+
+    def __init__(self, endpoint: str) -> None:
+        self.label = urlsplit(endpoint).hostname or endpoint
+        self.first = REPLICATOR_ENDPOINT_UPDATES.labels(self.label, "first")
+        self.duplicate = REPLICATOR_ENDPOINT_UPDATES.labels(self.label, "duplicate")
+        self.older = REPLICATOR_ENDPOINT_UPDATES.labels(self.label, "older")
+        self.lag = REPLICATOR_ENDPOINT_LAG_SECONDS.labels(self.label)
+
+
+class EndpointRace:
+    """Decides which websocket endpoint delivered each (account, slot) first.
+
+    Later arrivals of the same slot are duplicates, and their lag behind the
+    first arrival is recorded. Arrivals of a slot older than the newest one of
+    the account are dropped as well.
+    """
+
+    def __init__(self) -> None:
+        # The newest slot of each account and when it first arrived
+        self._first_arrivals: Dict[str, Tuple[int, float]] = {}
+
+    def record(self, endpoint: EndpointStats, key: str, slot: int) -> bool:
+        """Record an arrival, returning whether it was the first of its slot."""
+        now = time.perf_counter()
+        first_arrival = self._first_arrivals.get(key)
+        if first_arrival is None or slot > first_arrival[0]:
+            self._first_arrivals[key] = (slot, now)
+            endpoint.first.inc()
+            return True
+        first_slot, first_time = first_arrival
+        if slot == first_slot:
+            endpoint.duplicate.inc()
+            endpoint.lag.observe(now - first_time)
+        else:
+            endpoint.older.inc()
+        return False
+
+
+class UpdateCoalescer:
+    """Buffers the price accounts updated on the websocket until they are handled.
+
+    The watch session updates the same account object on every websocket update,
+    so an account updated again before it was handled simply stays pending with
+    its newest data: superseded updates are dropped instead of queued. Updates
+    that do not advance the slot of the account are dropped as well, and both are
+    counted in the replicator metrics. Memory is bounded by the number of watched
+    accounts.
+    """
+
+    def __init__(self) -> None:
+        self._pending: Dict[str, LazyPythPriceAccount] = {}
+        self._last_slots: Dict[str, int] = {}
+        self._has_pending = asyncio.Event()
+
+    def put(self, account: LazyPythPriceAccount) -> None:
+        key = str(account.key)
+        last_slot = self._last_slots.get(key)
+        if last_slot is not None and account.slot <= last_slot:
+            REPLICATOR_UPDATES_DROPPED_STALE.inc()
+            return
+        self._last_slots[key] = account.slot
+
+        if key in self._pending:
+            REPLICATOR_UPDATES_DROPPED_SUPERSEDED.inc()
+            return
+        self._pending[key] = account
+        self._has_pending.set()
+
+    async def drain(self) -> List[LazyPythPriceAccount]:
+        """Wait for pending updates and return all of them, oldest first."""
+        await self._has_pending.wait()
+        self._has_pending.clear()
+        pending, self._pending = self._pending, {}
+        return list(pending.values())
+
+
+def manual_aggregate(prices: Union[List[float], np.ndarray]) -> Tuple[float, float]:
     """
     This function is used to manually aggregate the prices of the active publishers. This is a very simple
     implementation that does not get the aggregate and confidence accurately but it is good enough for our use case.
     On this implementation, if the aggregate or confidence are not an element of the list, then we consider the
     rightmost element lower than them in the list. For example, if the list is [1, 2, 3, 4] instead of using
     median 2.5 as aggregate we use 2.
+
+    Only the three quantiles are selected (with `np.partition`) instead of sorting all the prices.
     """
-    prices.sort()
     num_prices = len(prices)
+    quantiles = [num_prices // 4, num_prices // 2, num_prices * 3 // 4]
+    low, agg_price, high = np.partition(prices, quantiles)[quantiles]
 
-    agg_price = prices[num_prices // 2]
-
-    agg_confidence_interval_left = agg_price - prices[num_prices // 4]
-    agg_confidence_interval_right = prices[num_prices * 3 // 4] - agg_price
-
-    agg_confidence_interval = max(
-        agg_confidence_interval_left, agg_confidence_interval_right
-    )
+    agg_confidence_interval = max(agg_price - low, high - agg_price)
 
-    return agg_price, agg_confidence_interval
+    return float(agg_price), float(agg_confidence_interval)
@@ -0,0 +1,269 @@
+"""A snapshot of the Pyth accounts and latest prices of the replicator, so that it
+can start publishing again right away instead of fetching every account first.
+
+The snapshot is a single file of fixed-size records, read through mmap: a header
+with the number of records of each kind, followed by the mapping account, product
+account, price account and latest price records.
+"""
+
+import mmap
+import os
+import struct
+from typing import Dict, List, Optional
+
+import numpy as np
+from attr import define
+from pythclient.exceptions import NotLoadedException
+from pythclient.pythaccounts import (
+    PythMappingAccount,
+    PythPriceAccount,
+    PythPriceType,
+    PythProductAccount,
+)
+from pythclient.solana import SolanaClient, SolanaPublicKey
+from structlog import get_logger
+
+from pyth_publisher.provider import Price, PythSymbol
+
+log = get_logger()
+
+_MAGIC = b"PYTHSNP2"
+# magic, number of mapping, product, price account and latest price records
+_HEADER = struct.Struct("<8sIIII")
+
+# Public keys are stored base58 encoded, which is at most 44 characters
+_KEY = "S44"
+# Longer symbols are left out of the snapshot, as numpy would truncate them
+SYMBOL_MAX_BYTES = 128
+_SYMBOL = f"S{SYMBOL_MAX_BYTES}"
+MAPPING_DTYPE = np.dtype([("key", _KEY), ("slot", "<u8")])
+PRODUCT_DTYPE = np.dtype(
+    [("key", _KEY), ("mapping", "<u4"), ("first_price", _KEY), ("symbol", _SYMBOL)]
+)
+PRICE_DTYPE = np.dtype(
+    [
+        ("key", _KEY),
+        ("product", "<u4"),
+        ("next_price", _KEY),
+        ("price_type", "<u4"),
+        ("slot", "<u8"),
+    ]
+)
+# Prices with an exponent are stored as their exact integer mantissas
+LATEST_PRICE_DTYPE = np.dtype(
+    [
+        ("symbol", _SYMBOL),
+        ("price", "<f8"),
+        ("conf", "<f8"),
+        ("price_mantissa", "<i8"),
+        ("conf_mantissa", "<i8"),
+        ("exponent", "<i4"),
+        ("has_exponent", "?"),
+        ("timestamp", "<i8"),
+        ("slot", "<u8"),
+    ]
+)
+
+
+@define
+class Snapshot:
+    mappings: List[PythMappingAccount]
+    # Only the symbol attribute of the product accounts is kept, and they are
+    # restored as never fetched, to be fetched again in the background
+    products: List[PythProductAccount]
+    prices: Dict[PythSymbol, Price]
+
+
+def encode_snapshot(
+    mappings: List[PythMappingAccount],
+    products: List[PythProductAccount],
+    prices: Dict[PythSymbol, Price],
+) -> bytes:
+    product_mappings = {
+        str(key): index
+        for index, mapping in enumerate(mappings)
+        for key in mapping.entries
+    }
+    # The products left out are fetched again when the snapshot is reconciled
+    products = [
+        product
+        for product in products
+        if str(product.key) in product_mappings
+        and _prices_loaded(product)
+        and _fits_in_snapshot(product.symbol)
+    ]
+    prices = {
+        symbol: price for symbol, price in prices.items() if _fits_in_snapshot(symbol)
+    }
+    price_accounts = [
+        (index, price)
+        for index, product in enumerate(products)
+        for price in product.prices.values()
+    ]
+
+    mapping_records = np.array(
+        [(str(mapping.key), mapping.slot or 0) for mapping in mappings],
+        dtype=MAPPING_DTYPE,
+    )
+    product_records = np.array(
+        [
+            (
+                str(product.key),
+                product_mappings[str(product.key)],
+                _key_or_empty(product.first_price_account_key),
+                product.symbol.encode(),
+            )
+            for product in products
+        ],
+        dtype=PRODUCT_DTYPE,
+    )
+    price_records = np.array(
+        [
+            (
+                str(price.key),
+                index,
+                _key_or_empty(price.next_price_account_key),
+                price.price_type.value,
+                price.slot or 0,
+            )
+            for index, price in price_accounts
+        ],
+        dtype=PRICE_DTYPE,
+    )
+    latest_price_records = np.array(
+        [
+            (symbol.encode(), *_price_fields(price), price.timestamp, price.slot)
+            for symbol, price in prices.items()
+        ],
+        dtype=LATEST_PRICE_DTYPE,
+    )
+    header = _HEADER.pack(
+        _MAGIC, len(mappings), len(products), len(price_accounts), len(prices)
+    )
+    return b"".join(
+        [
+            header,
+            mapping_records.tobytes(),
+            product_records.tobytes(),
+            price_records.tobytes(),
+            latest_price_records.tobytes(),
+        ]
+    )
+
+
+def _prices_loaded(product: PythProductAccount) -> bool:
+    try:
+        product.prices
+    except NotLoadedException:
+        return False
+    return True
+
+
+def _fits_in_snapshot(symbol: PythSymbol) -> bool:
+    if len(symbol.encode()) <= SYMBOL_MAX_BYTES:
+        return True
+    log.warning("Symbol too long for the Pyth snapshot, left out", symbol=symbol)
+    return False
+
+
+def write_snapshot(path: str, content: bytes) -> None:
+    # Readers never see a partially written snapshot
+    path = os.path.expanduser(path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path: str, solana: SolanaClient) -> Optional[Snapshot]:
+    """Read the snapshot at `path`, or None if there is none. Raises ValueError if
+    the file is not a valid snapshot."""
+    try:
+        file = open(os.path.expanduser(path), "rb")
+    except FileNotFoundError:
+        return None
+    with file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        records = _read_records(buffer)
+    if records is None:
+        return None
+    return _decode_snapshot(records, solana)
+
+
+def _read_records(buffer: mmap.mmap) -> Optional[List[list]]:
+    # The records are copied out, as the buffer is closed afterwards
+    if len(buffer) < _HEADER.size:
+        raise ValueError("Pyth snapshot too short")
+    magic, *counts = _HEADER.unpack_from(buffer)
+    if magic != _MAGIC:
+        raise ValueError(f"Not a Pyth snapshot: {magic!r}")
+    dtypes = [MAPPING_DTYPE, PRODUCT_DTYPE, PRICE_DTYPE, LATEST_PRICE_DTYPE]
+    if len(buffer) != _HEADER.size + sum(
+        dtype.itemsize * count for dtype, count in zip(dtypes, counts)
+    ):
+        raise ValueError("Pyth snapshot size does not match its header")
+    if not counts[0]:
+        return None
+
+    offset = _HEADER.size
+    records = []
+    for dtype, count in zip(dtypes, counts):
+        records.append(np.frombuffer(buffer, dtype, count, offset).tolist())
+        offset += dtype.itemsize * count
+    return records
+
+
+def _decode_snapshot(records: List[list], solana: SolanaClient) -> Snapshot:
+    mapping_records, product_records, price_records, latest_price_records = records
+
+    mappings = []
+    for key, slot in mapping_records:
+        mapping = PythMappingAccount(key.decode(), solana)
+        mapping.slot = slot
+        mappings.append(mapping)
+    for mapping, next_mapping in zip(mappings, mappings[1:]):
+        mapping.next_account_key = next_mapping.key
+
+    products = []
+    for key, mapping_index, first_price, symbol in product_records:
+        product = PythProductAccount(SolanaPublicKey(key.decode()), solana)
+        product.first_price_account_key = _key_or_none(first_price)
+        product.attrs = {"symbol": symbol.decode()}
+        mappings[mapping_index].entries.append(product.key)
+        products.append(product)
+
+    product_prices: List[List[PythPriceAccount]] = [[] for _ in products]
+    for key, product_index, next_price, price_type, slot in price_records:
+        product = products[product_index]
+        price = PythPriceAccount(SolanaPublicKey(key.decode()), solana, product=product)
+        price.next_price_account_key = _key_or_none(next_price)
+        price.price_type = PythPriceType(price_type)
+        price.slot = slot or None
+        product_prices[product_index].append(price)
+    for product, prices in zip(products, product_prices):
+        product.use_price_accounts(prices)
+
+    latest_prices = {}
+    for symbol, *fields, timestamp, slot in latest_price_records:
+        price, conf, price_mantissa, conf_mantissa, exponent, has_exponent = fields
+        if has_exponent:
+            latest_prices[symbol.decode()] = Price(
+                price_mantissa, conf_mantissa, timestamp, slot, exponent
+            )
+        else:
+            latest_prices[symbol.decode()] = Price(price, conf, timestamp, slot)
+    return Snapshot(mappings, products, latest_prices)
+
+
+def _price_fields(price: Price) -> tuple:
+    if price.exponent is None:
+        return price.price, price.conf, 0, 0, 0, False
+    return 0.0, 0.0, price.price, price.conf, price.exponent, True
+
+
+def _key_or_empty(key: Optional[SolanaPublicKey]) -> str:
+    return "" if key is None else str(key)
+
+
+def _key_or_none(key: bytes) -> Optional[SolanaPublicKey]:
+    return SolanaPublicKey(key.decode()) if key else None
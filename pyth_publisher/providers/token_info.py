@@ -0,0 +1,113 @@
+import csv
+import os
+from logging import getLogger
+from typing import Dict, Iterable, Optional
+
+from pyth_publisher.provider import Symbol
+
+log = getLogger(__name__)
+
+
+def parse_token_info(lines: Iterable[str]) -> Dict[Symbol, str]:
+    """Parse a token info CSV with `symbol` and `address` columns (and possibly
+    others) into a mapping of token symbols to addresses. If a symbol appears
+    more than once, its last address is kept."""
+    return {row["symbol"]: row["address"] for row in csv.DictReader(lines)}
+
+
+class TokenInfoCache:
+    """Keeps a local copy of the token info CSV at `source` (e.g. on S3) in
+    `cache_path`, together with the validator of the source it was downloaded
+    from: its ETag when the filesystem provides one, its modification time
+    otherwise.
+
+    `load` only reads the local copy when there is one, so starting up does not
+    need the source to be reachable. `refresh` downloads the source again only
+    if its validator changed.
+    """
+
+    def __init__(self, source: str, cache_path: str) -> None:
+        self._source = source
+        self._cache_path = os.path.expanduser(cache_path)
+        self._validator_path = f"{self._cache_path}.validator"
+        self._validator: Optional[str] = None
+
+    def load(self) -> Dict[Symbol, str]:
+        """The cached token info, downloaded first if nothing is cached yet."""
+        try:
+            with open(self._cache_path) as file:
+                token_info = parse_token_info(file)
+            with open(self._validator_path) as file:
+                self._validator = file.read()
+            return token_info
+        except FileNotFoundError:
+            log.info("No cached token info in %s", self._cache_path)
+
+        # Downloaded even if the validator did not change, e.g. when the cached
+        # copy was deleted since it was last loaded
+        fs = _get_fs(self._source)
+        return self._download(fs, self._get_validator(fs.info(self._source)))
+
+    def refresh(self) -> Optional[Dict[Symbol, str]]:
+        """Download the token info if the source changed since it was cached.
+        Returns the new token info, or None if it did not change."""
+        fs = _get_fs(self._source)
+        validator = self._get_validator(fs.info(self._source))
+        if validator is not None and validator == self._validator:
+            return None
+        return self._download(fs, validator)
+
+    def _download(self, fs, validator: Optional[str]) -> Dict[Symbol, str]:
+        with fs.open(self._source, "r") as file:
+            content = file.read()
+        token_info = parse_token_info(content.splitlines())
+        if not token_info:
+            raise ValueError(f"No token info found in {self._source}")
+
+        self._write(self._cache_path, content)
+        self._write(self._validator_path, validator or "")
+        self._validator = validator
+        log.info(
+            "Downloaded %d tokens of token info from %s (validator %s)",
+            len(token_info),
+            self._source,
+            validator,
+        )
+        return token_info
+
+    @staticmethod
+    def _get_validator(info: dict) -> Optional[str]:
+        validator = info.get("ETag") or info.get("LastModified") or info.get("mtime")
+        if validator is None:
+            return None
+        return str(validator)
+
+    @staticmethod
+    def _write(path: str, content: str) -> None:
+        # Readers never see a partially written file
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(content)
+        os.replace(tmp_path, path)
+
+
+class _LocalFileSystem:
+    """The part of the drfs filesystem interface used for a local source."""
+
+    @staticmethod
+    def info(path: str) -> dict:
+        return {"mtime": os.stat(path).st_mtime}
+
+    @staticmethod
+    def open(path: str, mode: str = "r"):
+        return open(path, mode)
+
+
+def _get_fs(source: str):
+    # drfs is only needed (and imported) for remote sources, e.g. on S3
+    if "://" not in source:
+        return _LocalFileSystem()
+    from drfs.filesystems import get_fs
+
+    return get_fs(source)
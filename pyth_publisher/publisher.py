@@ -1,13 +1,25 @@
 import asyncio
+import logging
 import time
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple, Union
 from attr import define
+from prometheus_client import Gauge
 from structlog import get_logger
-from pyth_publisher.provider import Provider
-from pyth_publisher.providers.coin_gecko import CoinGecko
-from pyth_publisher.config import Config
-from pyth_publisher.providers.pyth_replicator import PythReplicator
-from pyth_publisher.pythd import Pythd, SubscriptionId
+from pyth_publisher import logs
+from pyth_publisher.provider import Price, Provider, load_provider_class
+from pyth_publisher.config import Config, DeadbandConfig
+from pyth_publisher.metrics import (
+    NOTIFICATIONS_DROPPED_DEADBAND,
+    NOTIFICATIONS_DROPPED_NO_PRICE,
+    PRICE_AGE_SECONDS,
+    monitor_event_loop_lag,
+)
+from pyth_publisher.pythd import (
+    PriceUpdate,
+    PriceUpdateBatcher,
+    Pythd,
+    SubscriptionId,
+)
 
 
 log = get_logger()
@@ -24,34 +36,105 @@ class Product:
     subscription_id: Optional[SubscriptionId]
 
 
+@define
+class PublishPlan:
+    """Everything needed to publish a product on notify_price_sched, computed once
+    per product update instead of on every notification."""
+
+    product: Product
+    # Index of the product price in the provider, if the provider supports it
+    price_index: Optional[int]
+    # Multiplier scaling a price to the Pyth exponent of the product
+    scale: Union[int, float]
+    # The age of the published prices of the product
+    price_age: Gauge
+    # The `price_indexes_version` of the provider when `price_index` was looked up
+    indexes_version: int = 0
+    # The last update sent, kept across the plans of a subscription
+    sent_price: Optional[int] = None
+    sent_conf: int = 0
+    sent_at: float = 0
+
+    def within_deadband(
+        self, price: int, conf: int, now: float, deadband: DeadbandConfig
+    ) -> bool:
+        """Whether the update barely moved since the last update sent, which was
+        sent less than a heartbeat ago."""
+        if self.sent_price is None or now - self.sent_at >= deadband.heartbeat_secs:
+            return False
+        return _moved_less_than(
+            price, self.sent_price, deadband.threshold_bps
+        ) and _moved_less_than(conf, self.sent_conf, deadband.threshold_bps)
+
+    def mark_sent(self, price: int, conf: int, now: float) -> None:
+        self.sent_price = price
+        self.sent_conf = conf
+        self.sent_at = now
+
+    def mark_update_sent(self, update: PriceUpdate) -> None:
+        self.mark_sent(update.price, update.conf, update.notified_at)
+
+    def scale_price(self, price: Price) -> Tuple[int, int]:
+        """The price and confidence interval in the Pyth exponent of the product.
+        Integer mantissas are rescaled exactly, and not at all when their exponent
+        already is the product's."""
+        exponent = self.product.exponent
+        if price.exponent is None:
+            return int(price.price * self.scale), int(price.conf * self.scale)
+        if price.exponent == exponent:
+            return price.price, price.conf
+        return (
+            rescale(price.price, price.exponent, exponent),
+            rescale(price.conf, price.exponent, exponent),
+        )
+
+
+def _moved_less_than(value: int, last: int, threshold_bps: float) -> bool:
+    return value == last or abs(value - last) * 10_000 < threshold_bps * abs(last)
+
+
+def rescale(mantissa: int, exponent: int, target_exponent: int) -> int:
+    """Rescale an integer mantissa of `exponent` to `target_exponent` with integer
+    arithmetic only, truncating toward zero like `int()` of a float."""
+    if exponent >= target_exponent:
+        return mantissa * 10 ** (exponent - target_exponent)
+    divisor = 10 ** (target_exponent - exponent)
+    if mantissa < 0:
+        return -(-mantissa // divisor)
+    return mantissa // divisor
+
+
 class Publisher:
     def __init__(self, config: Config) -> None:
         self.config: Config = config
         self._product_update_task: Optional[asyncio.Task] = None
+        self._event_loop_lag_task: Optional[asyncio.Task] = None
 
-        if not getattr(self.config, self.config.provider_engine):
+        # Only the selected provider engine is imported
+        provider_class = load_provider_class(self.config.provider_engine)
+        provider_config = getattr(self.config, self.config.provider_engine)
+        if not provider_config:
             raise ValueError(f"Missing {self.config.provider_engine} config")
-
-        if (
-            self.config.provider_engine == "coin_gecko"
-            and config.coin_gecko is not None
-        ):
-            self.provider = CoinGecko(config.coin_gecko)
-        elif (
-            self.config.provider_engine == "pyth_replicator"
-            and config.pyth_replicator is not None
-        ):
-            self.provider: Provider = PythReplicator(config.pyth_replicator)
-        else:
-            raise ValueError(
-                f"Unknown provider {self.config.provider_engine}, possibly the env variables are not set."
-            )
+        self.provider: Provider = provider_class(provider_config)
 
         self.pythd: Pythd = Pythd(
             address=config.pythd.endpoint,
             on_notify_price_sched=self.on_notify_price_sched,
+            on_reconnect=self._on_pythd_reconnect,
+            reconnect_initial_backoff_secs=config.pythd.reconnect_initial_backoff_ms
+            / 1000,
+            reconnect_max_backoff_secs=config.pythd.reconnect_max_backoff_ms / 1000,
+            request_timeout_secs=config.pythd.request_timeout_ms / 1000,
+            batch_max_size=config.pythd.batch_max_size,
+        )
+        self._price_update_batcher = PriceUpdateBatcher(
+            self.pythd,
+            window_secs=config.pythd.batch_window_ms / 1000,
+            max_size=config.pythd.batch_max_size,
         )
-        self.subscriptions: Dict[SubscriptionId, Product] = {}
+        self.subscriptions: Dict[SubscriptionId, PublishPlan] = {}
+        # Serializes the changes to the subscriptions
+        self._subscriptions_lock = asyncio.Lock()
         self.products: List[Product] = []
         self.last_successful_update: Optional[float] = None
 
@@ -63,6 +146,7 @@ class Publisher:
         )
 
     async def start(self):
+        self._event_loop_lag_task = asyncio.create_task(monitor_event_loop_lag())
         await self.pythd.connect()
 
         self._product_update_task = asyncio.create_task(
@@ -74,10 +158,24 @@ class Publisher:
         self.provider.start()
 
         while True:
-            await self._upd_products()
-            await self._subscribe_notify_price_sched()
+            try:
+                await self._upd_products()
+                await self._subscribe_notify_price_sched()
+            except Exception:
+                # e.g. while pythd is reconnecting
+                log.exception("failed to update the products")
             await asyncio.sleep(self.config.product_update_interval_secs)
 
+    async def _on_pythd_reconnect(self):
+        # The subscriptions were lost with the previous connection. The products
+        # and the provider state are kept, so all the products are subscribed to
+        # again at once and the plans remapped to the new subscription ids.
+        async with self._subscriptions_lock:
+            for product in self.products:
+                product.subscription_id = None
+            self.subscriptions = {}
+        await self._subscribe_notify_price_sched()
+
     async def _upd_products(self):
         log.debug("fetching product accounts from Pythd")
         pythd_products = {
@@ -111,58 +209,106 @@ class Publisher:
         self.provider.upd_products([product.symbol for product in self.products])
 
     async def _subscribe_notify_price_sched(self):
+        async with self._subscriptions_lock:
+            await self._subscribe_new_products()
+
+    async def _subscribe_new_products(self):
         # Subscribe to Pythd's notify_price_sched for each product that
         # is not subscribed yet. Unfortunately there is no way to unsubscribe
         # to the prices that are no longer available.
         log.debug("subscribing to notify_price_sched")
 
+        new_subscriptions = await self.pythd.subscribe_price_scheds(
+            [
+                product.price_account
+                for product in self.products
+                if not product.subscription_id
+            ]
+        )
+
         subscriptions = {}
         for product in self.products:
             if not product.subscription_id:
-                subscription_id = await self.pythd.subscribe_price_sched(
-                    product.price_account
-                )
-                product.subscription_id = subscription_id
-
-            subscriptions[product.subscription_id] = product
+                product.subscription_id = new_subscriptions.get(product.price_account)
+                if not product.subscription_id:
+                    continue
+
+            plan = PublishPlan(
+                product,
+                self.provider.price_index(product.symbol),
+                10 ** (-product.exponent),
+                PRICE_AGE_SECONDS.labels(product.symbol),
+                self.provider.price_indexes_version,
+            )
+            if old_plan := self.subscriptions.get(product.subscription_id):
+                plan.sent_price = old_plan.sent_price
+                plan.sent_conf = old_plan.sent_conf
+                plan.sent_at = old_plan.sent_at
+            subscriptions[product.subscription_id] = plan
 
         self.subscriptions = subscriptions
 
     async def on_notify_price_sched(self, subscription: int) -> None:
-
-        log.debug("received notify_price_sched", subscription=subscription)
-        if subscription not in self.subscriptions:
+        notified_at = time.perf_counter()
+        if logs.enabled_for(logging.DEBUG):
+            log.debug("received notify_price_sched", subscription=subscription)
+        plan = self.subscriptions.get(subscription)
+        if plan is None:
             return
 
         # Look up the current price and confidence interval of the product
-        product = self.subscriptions[subscription]
-        price = self.provider.latest_price(product.symbol)
+        product = plan.product
+        price = self._latest_price(plan)
         if not price:
-            log.info("latest price not available", symbol=product.symbol)
+            if logs.enabled_for(logging.INFO):
+                log.info("latest price not available", symbol=product.symbol)
+            NOTIFICATIONS_DROPPED_NO_PRICE.inc()
             return
-
-        # Scale the price and confidence interval using the Pyth exponent
-        scaled_price = self.apply_exponent(price.price, product.exponent)
-        scaled_conf = self.apply_exponent(price.conf, product.exponent)
-
-        # Send the price update
-        log.info(
-            "sending update_price",
-            product_account=product.product_account,
-            price_account=product.price_account,
-            price=scaled_price,
-            conf=scaled_conf,
-            symbol=product.symbol,
+        plan.price_age.set(time.time() - price.timestamp)
+
+        scaled_price, scaled_conf = plan.scale_price(price)
+        on_sent = None
+        if self.config.deadband is not None:
+            if plan.within_deadband(
+                scaled_price, scaled_conf, notified_at, self.config.deadband
+            ):
+                NOTIFICATIONS_DROPPED_DEADBAND.inc()
+                return
+            # Only once pythd accepted it, so that a failed update is not skipped
+            on_sent = plan.mark_update_sent
+
+        # Queue the price update, it is sent to pythd with the rest of the batch
+        if logs.enabled_for(logging.INFO):
+            log.info(
+                "queueing update_price",
+                product_account=product.product_account,
+                price_account=product.price_account,
+                price=scaled_price,
+                conf=scaled_conf,
+                symbol=product.symbol,
+            )
+        self._price_update_batcher.submit(
+            PriceUpdate(
+                product.price_account,
+                scaled_price,
+                scaled_conf,
+                TRADING,
+                notified_at,
+                on_sent,
+            )
         )
-        # await self.pythd.update_price(
-        #     product.price_account, scaled_price, scaled_conf, TRADING
-        # )
         self.last_successful_update = (
             price.timestamp
             if self.last_successful_update is None
             else max(self.last_successful_update, price.timestamp)
         )
 
-    @staticmethod
-    def apply_exponent(x: float, exp: int) -> int:
-        return int(x * (10 ** (-exp)))
+    def _latest_price(self, plan: PublishPlan) -> Optional[Price]:
+        provider = self.provider
+        if plan.indexes_version != provider.price_indexes_version:
+            # The provider remapped its prices since the plan was made
+            plan.price_index = provider.price_index(plan.product.symbol)
+            plan.indexes_version = provider.price_indexes_version
+        if plan.price_index is None:
+            return provider.latest_price(plan.product.symbol)
+        return provider.latest_price_at(plan.price_index)
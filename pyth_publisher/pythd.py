@@ -1,11 +1,18 @@
 import asyncio
 from dataclasses import dataclass, field
-import sys
-import traceback
+import json
+import random
+import time
+import uuid
+from aiohttp import WSMsgType
 from dataclasses_json import config, DataClassJsonMixin
-from typing import Callable, Coroutine, List
+from typing import Any, Callable, Coroutine, Dict, List, Optional
 from structlog import get_logger
+from jsonrpc_base import Request, TransportError
 from jsonrpc_websocket import Server
+from jsonrpc_websocket.jsonrpc import PendingMessage
+
+from pyth_publisher.metrics import NOTIFY_TO_SEND_SECONDS
 
 log = get_logger()
 
@@ -33,31 +40,253 @@ class Product(DataClassJsonMixin):
     prices: List[Price] = field(metadata=config(field_name="price"))
 
 
+@dataclass
+class PriceUpdate:
+    account: str
+    price: int
+    conf: int
+    status: Status = TRADING
+    # time.perf_counter() when the notify_price_sched of this update was handled
+    notified_at: Optional[float] = None
+    # Called with the update once pythd accepted it
+    on_sent: Optional[Callable[["PriceUpdate"], None]] = None
+
+
+class _BatchMessage:
+    """A single websocket frame produced by splitting a JSON-RPC batch response."""
+
+    type = WSMsgType.TEXT
+
+    def __init__(self, data: Any) -> None:
+        self._data = data
+
+    def json(self) -> Any:
+        return self._data
+
+
+class _BatchSplittingWebSocket:
+    # jsonrpc_websocket only understands single JSON-RPC objects, so batch
+    # responses (JSON arrays) are split here into one message per response
+    # before they reach its read loop.
+    #
+    # notify_price_sched notifications are handed to `on_notify_price_sched`
+    # here and never reach the read loop, which would create a task to handle
+    # each of them.
+    def __init__(
+        self, ws, on_notify_price_sched: Callable[[SubscriptionId], None]
+    ) -> None:
+        self._ws = ws
+        self._on_notify_price_sched = on_notify_price_sched
+
+    def __getattr__(self, name):
+        return getattr(self._ws, name)
+
+    def __aiter__(self):
+        return self._split_batches()
+
+    async def _split_batches(self):
+        async for msg in self._ws:
+            if msg.type != WSMsgType.TEXT:
+                yield msg
+                continue
+            try:
+                data = json.loads(msg.data)
+            except ValueError:
+                # Left for the read loop to fail on
+                yield msg
+                continue
+            for item in data if isinstance(data, list) else [data]:
+                subscription = _notify_price_sched_subscription(item)
+                if subscription is not None:
+                    self._on_notify_price_sched(subscription)
+                else:
+                    yield _BatchMessage(item)
+
+
+def _notify_price_sched_subscription(data: Any) -> Optional[SubscriptionId]:
+    if not isinstance(data, dict) or data.get("method") != "notify_price_sched":
+        return None
+    params = data.get("params")
+    if not isinstance(params, dict):
+        return None
+    return params.get("subscription")
+
+
+class BatchServer(Server):
+    """A jsonrpc_websocket Server that can also send JSON-RPC batch requests, and
+    passes the notify_price_sched notifications straight to a callback."""
+
+    def __init__(
+        self,
+        url: str,
+        on_notify_price_sched: Callable[[SubscriptionId], None],
+        request_timeout_secs: Optional[float] = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(url, **kwargs)
+        self._on_notify_price_sched = on_notify_price_sched
+        # Also applies to the single calls. Not passed as the `timeout` of the
+        # connection, which would apply to the websocket handshake as well.
+        self._timeout = request_timeout_secs
+
+    async def ws_connect(self):
+        task = await super().ws_connect()
+        self._client = _BatchSplittingWebSocket(
+            self._client, self._on_notify_price_sched
+        )
+        return task
+
+    async def send_batch(self, requests: List[Request]) -> List[Any]:
+        """Send the requests as one JSON-RPC batch array.
+
+        Returns one entry per request, in order: either the result of the call or
+        the exception raised while parsing its response, so that a single failing
+        item does not fail the whole batch. The items still without a response
+        after the request timeout fail with a TransportError.
+        """
+        if self._client is None:
+            raise TransportError("Client is not connected.")
+
+        pending_messages = [PendingMessage() for _ in requests]
+        for request, pending_message in zip(requests, pending_messages):
+            self._pending_messages[request.msg_id] = pending_message
+
+        try:
+            await self._client.send_str(
+                "[" + ",".join(request.serialize() for request in requests) + "]"
+            )
+            responses = await asyncio.wait_for(
+                asyncio.gather(
+                    *(pending.wait() for pending in pending_messages),
+                    return_exceptions=True,
+                ),
+                self._timeout,
+            )
+        except asyncio.TimeoutError:
+            timeout_error = TransportError(
+                f"No response from pythd within {self._timeout}s"
+            )
+            responses = [
+                timeout_error if pending.response is None else pending.response
+                for pending in pending_messages
+            ]
+        finally:
+            for request in requests:
+                self._pending_messages.pop(request.msg_id, None)
+
+        results = []
+        for request, response in zip(requests, responses):
+            if isinstance(response, BaseException):
+                results.append(response)
+                continue
+            try:
+                results.append(request.parse_response(response))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def fail_pending_messages(self) -> None:
+        """Fail the calls still waiting for a response, which will never arrive
+        once the connection is closed."""
+        for msg_id, pending_message in list(self._pending_messages.items()):
+            pending_message.response = {
+                "jsonrpc": "2.0",
+                "id": msg_id,
+                "error": {"code": -32000, "message": "pythd connection closed"},
+            }
+
+
 class Pythd:
     def __init__(
         self,
         address: str,
         on_notify_price_sched: Callable[[SubscriptionId], Coroutine[None, None, None]],
+        on_reconnect: Optional[Callable[[], Coroutine[None, None, None]]] = None,
+        reconnect_initial_backoff_secs: float = 0.1,
+        reconnect_max_backoff_secs: float = 10,
+        request_timeout_secs: Optional[float] = 10,
+        batch_max_size: int = 256,
     ) -> None:
         self.address = address
-        self.server: Server
+        self.server: BatchServer
         self.on_notify_price_sched = on_notify_price_sched
-        self._tasks = set()
+        # Called once connected again after the connection was lost. The
+        # subscriptions of the previous connection do not exist anymore.
+        self.on_reconnect = on_reconnect
+        self._reconnect_initial_backoff_secs = reconnect_initial_backoff_secs
+        self._reconnect_max_backoff_secs = reconnect_max_backoff_secs
+        self._request_timeout_secs = request_timeout_secs
+        self._batch_max_size = batch_max_size
+        self._connection_task: Optional[asyncio.Task] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._notifications: Optional[asyncio.Queue] = None
+        self._dispatcher_task: Optional[asyncio.Task] = None
 
     async def connect(self):
-        self.server = Server(self.address)
-        self.server.notify_price_sched = self._notify_price_sched
-        task = await self.server.ws_connect()
-        task.add_done_callback(Pythd._on_connection_done)
-        self._tasks.add(task)
+        if self._dispatcher_task is None:
+            self._notifications = asyncio.Queue()
+            self._dispatcher_task = asyncio.create_task(self._dispatch_notifications())
+
+        await self._connect_server()
+
+    async def _connect_server(self) -> None:
+        server = BatchServer(
+            self.address, self._notify_price_sched, self._request_timeout_secs
+        )
+        try:
+            task = await server.ws_connect()
+        except Exception:
+            await server.close()
+            raise
+        self.server = server
+        task.add_done_callback(self._on_connection_done)
+        self._connection_task = task
 
-    @staticmethod
-    def _on_connection_done(task):
-        log.error("pythd connection closed")
+    async def close(self):
+        if self._connection_task is not None:
+            self._connection_task.remove_done_callback(self._on_connection_done)
+            self._connection_task = None
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        if self._dispatcher_task is not None:
+            self._dispatcher_task.cancel()
+            self._dispatcher_task = None
+        await self.server.close()
+
+    def _on_connection_done(self, task: asyncio.Task) -> None:
         if not task.cancelled() and task.exception() is not None:
-            e = task.exception()
-            traceback.print_exception(None, e, e.__traceback__)
-        sys.exit(1)
+            log.error("pythd connection closed", exc_info=task.exception())
+        else:
+            log.error("pythd connection closed")
+        self._connection_task = None
+        self.server.fail_pending_messages()
+        self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        # Exponential backoff with full jitter, so that publishers sharing an
+        # agent do not all reconnect at the same time
+        attempt = 0
+        while True:
+            backoff = min(
+                self._reconnect_max_backoff_secs,
+                self._reconnect_initial_backoff_secs * 2**attempt,
+            )
+            await asyncio.sleep(random.uniform(0, backoff))
+            attempt += 1
+            try:
+                await self._connect_server()
+                break
+            except Exception as e:
+                log.warning("failed to reconnect to pythd", attempt=attempt, error=e)
+
+        log.info("reconnected to pythd", attempts=attempt)
+        self._reconnect_task = None
+        if self.on_reconnect is not None:
+            try:
+                await self.on_reconnect()
+            except Exception:
+                log.exception("failed to handle the pythd reconnection")
 
     async def subscribe_price_sched(self, account: str) -> int:
         subscription = (await self.server.subscribe_price_sched(account=account))[
@@ -68,13 +297,60 @@ class Pythd:
         )
         return subscription
 
+    async def subscribe_price_scheds(
+        self, accounts: List[str]
+    ) -> Dict[str, SubscriptionId]:
+        """Subscribe to price_sched for all the accounts in JSON-RPC batches of up
+        to `batch_max_size` calls.
+
+        Returns the subscription id of each account. Accounts whose subscription
+        failed are logged and left out, so that they are retried on the next call.
+        """
+        subscriptions = {}
+        for start in range(0, len(accounts), self._batch_max_size):
+            end = start + self._batch_max_size
+            subscriptions.update(
+                await self._subscribe_price_sched_batch(accounts[start:end])
+            )
+        log.debug("subscribed to price_sched", subscriptions=len(subscriptions))
+        return subscriptions
+
+    async def _subscribe_price_sched_batch(
+        self, accounts: List[str]
+    ) -> Dict[str, SubscriptionId]:
+        requests = [
+            Request("subscribe_price_sched", {"account": account}, str(uuid.uuid4()))
+            for account in accounts
+        ]
+        results = await self.server.send_batch(requests)
+
+        subscriptions = {}
+        for account, result in zip(accounts, results):
+            if isinstance(result, Exception):
+                log.error(
+                    "failed to subscribe to price_sched",
+                    account=account,
+                    error=str(result),
+                )
+                continue
+            subscriptions[account] = result["subscription"]
+        return subscriptions
+
     def _notify_price_sched(self, subscription: int) -> None:
         log.debug("notify_price_sched RPC call received", subscription=subscription)
-        task = asyncio.get_event_loop().create_task(
-            self.on_notify_price_sched(subscription)
-        )
-        self._tasks.add(task)
-        task.add_done_callback(self._tasks.discard)
+        self._notifications.put_nowait(subscription)
+
+    async def _dispatch_notifications(self) -> None:
+        # A single worker handles the notifications in arrival order, instead of
+        # a new task per notification.
+        while True:
+            subscription = await self._notifications.get()
+            try:
+                await self.on_notify_price_sched(subscription)
+            except Exception:
+                log.exception(
+                    "failed to handle notify_price_sched", subscription=subscription
+                )
 
     async def all_products(self) -> List[Product]:
         result = await self.server.get_product_list()
@@ -86,3 +362,86 @@ class Pythd:
         await self.server.update_price(
             account=account, price=price, conf=conf, status=status
         )
+
+    async def update_prices(
+        self, updates: List[PriceUpdate]
+    ) -> List[Optional[Exception]]:
+        """Send all the updates to pythd in a single JSON-RPC batch.
+
+        Returns, for each update, the exception it failed with or None on success.
+        """
+        requests = [
+            Request(
+                "update_price",
+                {
+                    "account": update.account,
+                    "price": update.price,
+                    "conf": update.conf,
+                    "status": update.status,
+                },
+                str(uuid.uuid4()),
+            )
+            for update in updates
+        ]
+        results = await self.server.send_batch(requests)
+        return [result if isinstance(result, Exception) else None for result in results]
+
+
+class PriceUpdateBatcher:
+    """Collects price updates and sends them to pythd in JSON-RPC batches.
+
+    A batch is sent once `window_secs` have passed since its first update was
+    submitted, or as soon as it holds `max_size` updates, whichever comes first.
+    """
+
+    def __init__(self, pythd: Pythd, window_secs: float, max_size: int) -> None:
+        self._pythd = pythd
+        self._window_secs = window_secs
+        self._max_size = max_size
+        self._pending: List[PriceUpdate] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+
+    def submit(self, update: PriceUpdate) -> None:
+        self._pending.append(update)
+        if len(self._pending) >= self._max_size:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                self._window_secs, self.flush
+            )
+
+    def flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: List[PriceUpdate]) -> None:
+        log.debug("sending update_price batch", size=len(batch))
+        sent_at = time.perf_counter()
+        for update in batch:
+            if update.notified_at is not None:
+                NOTIFY_TO_SEND_SECONDS.observe(sent_at - update.notified_at)
+        try:
+            errors = await self._pythd.update_prices(batch)
+        except Exception:
+            log.exception("failed to send update_price batch", size=len(batch))
+            return
+
+        for update, error in zip(batch, errors):
+            if error is not None:
+                log.error(
+                    "update_price failed",
+                    price_account=update.account,
+                    error=str(error),
+                )
+            elif update.on_sent is not None:
+                update.on_sent(update)
@@ -0,0 +1,29 @@
+from pyth_publisher.config import CoinGeckoConfig, Config, Pythd, PythReplicatorConfig
+from pyth_publisher.providers.pyth_replicator import PythReplicator
+
+
+def make_replicator(**kwargs) -> PythReplicator:
+    """A replicator of local endpoints, with the config options in `kwargs`."""
+    options = {
+        "http_endpoint": "http://localhost",
+        "ws_endpoint": "ws://localhost",
+        "first_mapping": "AHtgzX45WTKfkPG53L6WYhGEXwQkN1BVknET3sVsLL8J",
+        "program_key": "FsJ3A3u2vn5cTVofAjvy6y5kwABJAqYWpe4975bi2epH",
+        **kwargs,
+    }
+    return PythReplicator(PythReplicatorConfig(**options))
+
+
+def publisher_config(pythd: Pythd, **kwargs) -> Config:
+    """The config of a publisher of CoinGecko prices (which tests usually replace
+    with their own provider), with the config options in `kwargs`."""
+    return Config(
+        provider_engine="coin_gecko",
+        pythd=pythd,
+        health_check_port=0,
+        health_check_threshold_secs=60,
+        coin_gecko=CoinGeckoConfig(
+            update_interval_secs=60, confidence_ratio_bps=10, products=[]
+        ),
+        **kwargs,
+    )
@@ -0,0 +1,122 @@
+import time
+from contextlib import asynccontextmanager
+from email.utils import formatdate
+from typing import Dict, List
+
+import pytest
+from aiohttp import web
+
+from pyth_publisher.config import CoinGeckoConfig, CoinGeckoProduct
+from pyth_publisher.providers.coin_gecko import (
+    CoinGecko,
+    CoinGeckoClient,
+    retry_after_secs,
+)
+
+PRICES: Dict[str, float] = {
+    "bitcoin": 60000.5,
+    "ethereum": 3000.25,
+    "solana": 150.125,
+    "usd-coin": 1.0,
+}
+
+
+class StubCoinGecko:
+    """Serves /simple/price, rate limiting the first `rate_limited` requests."""
+
+    def __init__(self, rate_limited: int = 0) -> None:
+        self.rate_limited = rate_limited
+        self.requested_ids: List[List[str]] = []
+        self.peers = set()
+
+    async def simple_price(self, request: web.Request) -> web.Response:
+        self.peers.add(request.transport.get_extra_info("peername"))
+        if self.rate_limited > 0:
+            self.rate_limited -= 1
+            return web.Response(status=429, headers={"Retry-After": "0"})
+
+        assert request.query["vs_currencies"] == "usd"
+        ids = request.query["ids"].split(",")
+        self.requested_ids.append(ids)
+        return web.json_response(
+            {id: {"usd": PRICES[id]} for id in ids if id in PRICES}
+        )
+
+
+@asynccontextmanager
+async def run_stub_coin_gecko(stub: StubCoinGecko):
+    app = web.Application()
+    app.router.add_get("/api/v3/simple/price", stub.simple_price)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        yield f"http://127.0.0.1:{port}/api/v3"
+    finally:
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_get_price_splits_ids_into_batches():
+    stub = StubCoinGecko()
+    async with run_stub_coin_gecko(stub) as url:
+        client = CoinGeckoClient(url, max_ids_length=20)
+        prices = await client.get_price(list(PRICES), vs_currencies="usd", precision=18)
+        await client.close()
+
+    assert prices == {id: {"usd": price} for id, price in PRICES.items()}
+    assert len(stub.requested_ids) > 1
+    assert all(len(",".join(ids)) <= 20 for ids in stub.requested_ids)
+    assert sorted(id for ids in stub.requested_ids for id in ids) == sorted(PRICES)
+
+
+@pytest.mark.asyncio
+async def test_get_price_retries_when_rate_limited():
+    stub = StubCoinGecko(rate_limited=2)
+    async with run_stub_coin_gecko(stub) as url:
+        client = CoinGeckoClient(url)
+        prices = await client.get_price(["bitcoin"], vs_currencies="usd", precision=18)
+        prices_again = await client.get_price(
+            ["ethereum"], vs_currencies="usd", precision=18
+        )
+        await client.close()
+
+    assert prices == {"bitcoin": {"usd": 60000.5}}
+    assert prices_again == {"ethereum": {"usd": 3000.25}}
+    # All the requests reused the same keep-alive connection
+    assert len(stub.peers) == 1
+
+
+def test_retry_after_in_seconds_or_as_an_http_date():
+    assert retry_after_secs("3", 1) == 3
+    assert retry_after_secs(None, 4) == 4
+    assert retry_after_secs("soon", 4) == 4
+    assert 8 < retry_after_secs(formatdate(time.time() + 10, usegmt=True), 1) <= 10
+    # Already passed
+    assert retry_after_secs("Wed, 21 Oct 2015 07:28:00 GMT", 1) == 0
+
+
+@pytest.mark.asyncio
+async def test_update_prices():
+    stub = StubCoinGecko()
+    async with run_stub_coin_gecko(stub) as url:
+        provider = CoinGecko(
+            CoinGeckoConfig(
+                update_interval_secs=60,
+                confidence_ratio_bps=10,
+                products=[
+                    CoinGeckoProduct("Crypto.BTC/USD", "bitcoin"),
+                    CoinGeckoProduct("Crypto.ETH/USD", "ethereum"),
+                ],
+                api_url=url,
+            )
+        )
+        provider.upd_products(["Crypto.BTC/USD", "Crypto.ETH/USD"])
+        await provider._update_prices()
+        await provider._api.close()
+
+    btc = provider.latest_price("Crypto.BTC/USD")
+    assert (btc.price, btc.conf) == (60000.5, 60.0005)
+    assert provider.latest_price("Crypto.ETH/USD").price == 3000.25
@@ -1,9 +1,11 @@
 import asyncio
 import math
+import os
 from datetime import datetime
 from decimal import Decimal
 from unittest.mock import MagicMock, AsyncMock
 
+import numpy as np
 import pytest
 import fakeredis.aioredis
 from storage.gateways.redis import RedisTokenPricesGW
@@ -11,7 +13,12 @@ from storage.key_manager import RedisKeyManager
 from storage.token_prices import RedisPricesGateway
 from core.models.evm.ethereum_token import EthereumToken
 from pyth_publisher.config import PropellerConfig
-from pyth_publisher.providers.propeller import Propeller
+from pyth_publisher.providers import propeller
+from pyth_publisher.providers.propeller import (
+    Propeller,
+    compute_prices_and_spreads,
+    redis_url_with_max_connections,
+)
 
 
 @pytest.fixture()
@@ -46,6 +53,91 @@ def test_upd_products(pyth_products):
     assert provider._supported_products == {"USDC", "DAI", "USDT"}
 
 
+def test_latest_price_uses_the_product_index(pyth_products):
+    provider = Propeller(
+        PropellerConfig(),
+        token_symbol_to_address={
+            "USDC": "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48",
+            "DAI": "0x6B175474E89094C44Da98b954EedeAC495271d0F",
+        },
+    )
+    provider.upd_products(pyth_products)
+    provider._prices.set(
+        provider._prices.index("0x6B175474E89094C44Da98b954EedeAC495271d0F"), 1, 0, 0
+    )
+    assert provider.latest_price("Crypto.DAI/USD").price == 1
+    assert provider.latest_price("Crypto.USDC/USD") is None
+    assert provider.latest_price("Crypto.USDT/USD") is None
+
+    # The index is rebuilt when the token info changes, and the indexes handed
+    # out before are invalidated
+    version = provider.price_indexes_version
+    provider._set_token_info(
+        {
+            "USDC": "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48",
+            "USDT": "0x6B175474E89094C44Da98b954EedeAC495271d0F",
+        }
+    )
+    assert provider._supported_products == {"USDC", "USDT"}
+    assert provider.latest_price("Crypto.DAI/USD") is None
+    assert provider.latest_price("Crypto.USDT/USD").price == 1
+    assert provider.price_indexes_version == version + 1
+
+
+@pytest.mark.asyncio
+async def test_token_info_is_refreshed_in_the_background(tmp_path, pyth_products):
+    token_info_path = tmp_path / "symbols_to_address.csv"
+    token_info_path.write_text(
+        "symbol,address\nUSDC,0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48\n"
+    )
+    config = PropellerConfig(
+        token_info_path=str(token_info_path),
+        token_info_cache_path=str(tmp_path / "cache.csv"),
+    )
+    provider = Propeller(config, redis_gtw=MagicMock())
+    provider.upd_products(pyth_products)
+    assert provider._supported_products == {"USDC"}
+
+    token_info_path.write_text(
+        "symbol,address\nUSDC,0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48\n"
+        "DAI,0x6B175474E89094C44Da98b954EedeAC495271d0F\n"
+    )
+    os.utime(token_info_path, (1_900_000_000, 1_900_000_000))
+    task = asyncio.create_task(provider._refresh_token_info_loop())
+    await asyncio.sleep(0.1)
+    task.cancel()
+
+    assert provider._supported_products == {"USDC", "DAI"}
+
+
+def test_redis_clients_from_config(monkeypatch):
+    gateway_uris = []
+    monkeypatch.setattr(
+        propeller,
+        "RedisTokenPricesGW",
+        lambda uri: gateway_uris.append(uri),
+    )
+    provider = Propeller(
+        PropellerConfig(
+            redis_url="redis://127.0.0.1:6379",
+            redis_max_connections=4,
+            quote_amount=10**18,
+            updates_channel="token-prices",
+        ),
+        token_symbol_to_address={"USDC": "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48"},
+    )
+    assert isinstance(provider._redis_gtw, RedisPricesGateway)
+    # Both clients get the pool size
+    assert gateway_uris == ["redis://127.0.0.1:6379?max_connections=4"]
+    assert provider._redis.connection_pool.max_connections == 4
+    assert provider._quote_amount == 10**18
+    # Unless the URL sets it
+    assert (
+        redis_url_with_max_connections("redis://127.0.0.1:6379/0?max_connections=8", 4)
+        == "redis://127.0.0.1:6379/0?max_connections=8"
+    )
+
+
 def test_get_token_info():
     provider = Propeller(PropellerConfig(), token_symbol_to_address={})
     token_info = provider._get_token_info()
@@ -155,7 +247,7 @@ async def test_integration():
             redis_gw=RedisTokenPricesGW(uri="redis://:PASSWORD@localhost:6379")
         ),
     )
-    provider._supported_products = {"DAI"}
+    provider.upd_products(["Crypto.DAI/USD"])
     provider.start()
     await asyncio.sleep(10)
     latest_price = provider.latest_price(symbol="Crypto.DAI/USD")
@@ -202,15 +294,223 @@ async def test_update_prices():
     await provider._update_prices()
 
     updated_usdc_price = provider._prices.get(USDC.address)
-    assert (updated_usdc_price.price, updated_usdc_price.conf) == (
-        1.0,
-        # This spread is because we are going through ETH and back to USDC
-        0.05887445887445887,
-    )
+    assert updated_usdc_price.price == 1.0
+    # This spread is because we are going through ETH and back to USDC
+    assert math.isclose(updated_usdc_price.conf, 0.05887445887445887, rel_tol=1e-9)
 
     # WBTC price in USDC
     updated_wbtc_price = provider._prices.get(WBTC.address)
-    assert (updated_wbtc_price.price, updated_wbtc_price.conf) == (
-        68000.0,
-        3361.3445378151264,
+    assert updated_wbtc_price.price == 68000.0
+    assert math.isclose(updated_wbtc_price.conf, 3361.3445378151264, rel_tol=1e-9)
+
+
+@pytest.mark.asyncio
+async def test_update_prices_skips_invalid_prices():
+    USDC = EthereumToken(
+        symbol="USDC",
+        address="0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48",
+        decimals=6,
+    )
+    WBTC = EthereumToken(
+        symbol="WBTC", address="0x2260fac5e5542a773aa44fbcfedf7c193bc2c599", decimals=8
+    )
+    DAI = EthereumToken(
+        symbol="DAI", address="0x6B175474E89094C44Da98b954EedeAC495271d0F", decimals=18
+    )
+    prices = {USDC: Decimal(0), WBTC: Decimal(20), DAI: Decimal(0)}
+    spreads = {USDC: Decimal(100), WBTC: Decimal(0.001), DAI: Decimal(100)}
+    mock_redis_gtw = MagicMock()
+    mock_redis_gtw.get_token_prices = AsyncMock(side_effect=lambda _: dict(prices))
+    mock_redis_gtw.get_token_spreads = AsyncMock(side_effect=lambda _: dict(spreads))
+    provider = Propeller(
+        PropellerConfig(),
+        token_symbol_to_address={
+            token.symbol: token.address for token in [USDC, WBTC, DAI]
+        },
+        quote_amount=int(1e18),
+        redis_gtw=mock_redis_gtw,
+    )
+    provider._supported_products = {"USDC", "WBTC", "DAI"}
+
+    # With a zero quote price, every price would be infinite
+    await provider._update_prices()
+    assert [provider._prices.get(token.address) for token in prices] == [None] * 3
+
+    prices[USDC] = Decimal(1 / 3400)
+    await provider._update_prices()
+    assert provider._prices.get(WBTC.address).price == 68000.0
+    # A zero token price is not published either
+    assert provider._prices.get(DAI.address) is None
+
+
+def test_compute_prices_and_spreads_matches_compute_spread():
+    rng = np.random.default_rng(0)
+    base_prices = rng.uniform(1e-6, 50, 1000)
+    base_spreads = rng.uniform(0, 0.1, 1000) / base_prices
+    quote_price, quote_spread = 1 / 3400, 10.0
+
+    prices, spreads = compute_prices_and_spreads(
+        base_prices, base_spreads, quote_price, quote_spread
     )
+
+    for i in range(len(base_prices)):
+        expected_spread = Propeller._compute_spread(
+            base_token_price_in_eth=Decimal(base_prices[i]),
+            quote_token_price_in_eth=Decimal(quote_price),
+            base_token_spread_relative_to_eth=Decimal(base_spreads[i]),
+            quote_token_spread_relative_to_eth=Decimal(quote_spread),
+        )
+        price = base_prices[i] / quote_price
+        assert math.isclose(prices[i], price, rel_tol=1e-9)
+        assert math.isclose(
+            spreads[i], expected_spread, rel_tol=1e-9, abs_tol=price * 1e-9
+        )
+
+
+@pytest.mark.asyncio
+async def test_stream_updates_reprices_only_updated_tokens():
+    USDC = EthereumToken(
+        symbol="USDC",
+        address="0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48",
+        decimals=6,
+    )
+    WBTC = EthereumToken(
+        symbol="WBTC", address="0x2260fac5e5542a773aa44fbcfedf7c193bc2c599", decimals=8
+    )
+    DAI = EthereumToken(
+        symbol="DAI", address="0x6B175474E89094C44Da98b954EedeAC495271d0F", decimals=18
+    )
+    prices = {USDC: Decimal(1 / 3400), WBTC: Decimal(20), DAI: Decimal(1 / 3400)}
+    spreads = {USDC: Decimal(100), WBTC: Decimal(0.001), DAI: Decimal(100)}
+    mock_redis_gtw = MagicMock()
+    mock_redis_gtw.get_token_prices = AsyncMock(side_effect=lambda _: dict(prices))
+    mock_redis_gtw.get_token_spreads = AsyncMock(side_effect=lambda _: dict(spreads))
+
+    redis = fakeredis.aioredis.FakeRedis()
+    provider = Propeller(
+        PropellerConfig(update_interval_secs=60, updates_channel="token-prices"),
+        token_symbol_to_address={
+            token.symbol: token.address for token in [USDC, WBTC, DAI]
+        },
+        quote_amount=int(1e18),
+        redis_gtw=mock_redis_gtw,
+        redis=redis,
+    )
+    provider._supported_products = {"USDC", "WBTC", "DAI"}
+    provider.start()
+    await asyncio.sleep(0.1)
+    assert provider._prices.get(WBTC.address).price == 68000.0
+    assert provider._prices.get(DAI.address).price == 1.0
+
+    prices[WBTC] = Decimal(21)
+    prices[DAI] = Decimal(1 / 3000)
+    await redis.publish("token-prices", WBTC.address)
+    await asyncio.sleep(0.1)
+    provider._update_loop_task.cancel()
+
+    assert provider._prices.get(WBTC.address).price == 71400.0
+    # DAI was not announced, so it was not re-priced
+    assert provider._prices.get(DAI.address).price == 1.0
+    assert mock_redis_gtw.get_token_prices.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_stream_updates_read_only_the_announced_token_keys():
+    USDC = EthereumToken(
+        symbol="USDC",
+        address="0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48",
+        decimals=6,
+    )
+    WBTC = EthereumToken(
+        symbol="WBTC", address="0x2260fac5e5542a773aa44fbcfedf7c193bc2c599", decimals=8
+    )
+    mock_redis_gtw = MagicMock()
+    mock_redis_gtw.get_token_prices = AsyncMock(
+        return_value={USDC: Decimal(1 / 3400), WBTC: Decimal(20)}
+    )
+    mock_redis_gtw.get_token_spreads = AsyncMock(
+        return_value={USDC: Decimal(100), WBTC: Decimal(0.001)}
+    )
+
+    redis = fakeredis.aioredis.FakeRedis()
+    provider = Propeller(
+        PropellerConfig(
+            update_interval_secs=60,
+            updates_channel="token-prices",
+            token_price_key="price:{quote_amount}:{address}",
+            token_spread_key="spread:{quote_amount}:{address}",
+        ),
+        token_symbol_to_address={token.symbol: token.address for token in [USDC, WBTC]},
+        quote_amount=10**18,
+        redis_gtw=mock_redis_gtw,
+        redis=redis,
+    )
+    provider.upd_products(["Crypto.USDC/USD", "Crypto.WBTC/USD"])
+    # The stream fails once, and is subscribed to again right away
+    subscribe = redis.pubsub
+    redis.pubsub = MagicMock(side_effect=[ConnectionError(), subscribe()])
+    provider._stream_backoff_secs = lambda: 0
+    provider.start()
+    await asyncio.sleep(0.1)
+    assert provider._prices.get(WBTC.address).price == 68000.0
+
+    for key, value in {
+        f"price:{10**18}:{USDC.address.lower()}": 1 / 3400,
+        f"spread:{10**18}:{USDC.address.lower()}": 100,
+        f"price:{10**18}:{WBTC.address}": 21,
+        f"spread:{10**18}:{WBTC.address}": 0.001,
+    }.items():
+        await redis.set(key, value)
+    await redis.publish("token-prices", WBTC.address)
+    await asyncio.sleep(0.1)
+    provider._update_loop_task.cancel()
+
+    assert provider._prices.get(WBTC.address).price == 71400.0
+    assert redis.pubsub.call_count == 2
+    # Only the poll after the failure and the new subscription read the whole
+    # tables, the message did not
+    assert mock_redis_gtw.get_token_prices.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_stream_updates_refresh_all_prices_under_steady_traffic():
+    USDC = EthereumToken(
+        symbol="USDC",
+        address="0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48",
+        decimals=6,
+    )
+    WBTC = EthereumToken(
+        symbol="WBTC", address="0x2260fac5e5542a773aa44fbcfedf7c193bc2c599", decimals=8
+    )
+    DAI = EthereumToken(
+        symbol="DAI", address="0x6B175474E89094C44Da98b954EedeAC495271d0F", decimals=18
+    )
+    prices = {USDC: Decimal(1 / 3400), WBTC: Decimal(20), DAI: Decimal(1 / 3400)}
+    spreads = {USDC: Decimal(100), WBTC: Decimal(0.001), DAI: Decimal(100)}
+    mock_redis_gtw = MagicMock()
+    mock_redis_gtw.get_token_prices = AsyncMock(side_effect=lambda _: dict(prices))
+    mock_redis_gtw.get_token_spreads = AsyncMock(side_effect=lambda _: dict(spreads))
+
+    redis = fakeredis.aioredis.FakeRedis()
+    provider = Propeller(
+        PropellerConfig(update_interval_secs=0.3, updates_channel="token-prices"),
+        token_symbol_to_address={
+            token.symbol: token.address for token in [USDC, WBTC, DAI]
+        },
+        quote_amount=int(1e18),
+        redis_gtw=mock_redis_gtw,
+        redis=redis,
+    )
+    provider._supported_products = {"USDC", "WBTC", "DAI"}
+    provider.start()
+    await asyncio.sleep(0.05)
+    assert provider._prices.get(DAI.address).price == 1.0
+
+    # DAI changes without being announced, while WBTC is announced all along
+    prices[DAI] = Decimal(1 / 3000)
+    for _ in range(20):
+        await redis.publish("token-prices", WBTC.address)
+        await asyncio.sleep(0.025)
+    provider._update_loop_task.cancel()
+
+    assert math.isclose(provider._prices.get(DAI.address).price, 3400 / 3000)
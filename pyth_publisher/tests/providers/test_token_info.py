@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+from pyth_publisher.providers.token_info import TokenInfoCache, parse_token_info
+
+TOKEN_INFO = """symbol,address,decimals
+USDC,0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48,6
+DAI,0x6B175474E89094C44Da98b954EedeAC495271d0F,18
+"""
+
+
+def _write_source(path, content: str, mtime: int) -> None:
+    path.write_text(content)
+    os.utime(path, (mtime, mtime))
+
+
+def test_parse_token_info():
+    assert parse_token_info(TOKEN_INFO.splitlines()) == {
+        "USDC": "0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48",
+        "DAI": "0x6B175474E89094C44Da98b954EedeAC495271d0F",
+    }
+
+
+def test_token_info_is_cached_and_revalidated(tmp_path):
+    source = tmp_path / "symbols_to_address.csv"
+    cache_path = str(tmp_path / "cache" / "symbols_to_address.csv")
+    _write_source(source, TOKEN_INFO, 1_700_000_000)
+
+    token_info = TokenInfoCache(str(source), cache_path)
+    assert set(token_info.load()) == {"USDC", "DAI"}
+    # The source did not change
+    assert token_info.refresh() is None
+
+    _write_source(
+        source,
+        TOKEN_INFO + "WBTC,0x2260fac5e5542a773aa44fbcfedf7c193bc2c599,8\n",
+        1_700_000_060,
+    )
+    assert set(token_info.refresh()) == {"USDC", "DAI", "WBTC"}
+    assert token_info.refresh() is None
+
+    # Starting up again only needs the cached copy
+    os.remove(source)
+    restarted_token_info = TokenInfoCache(str(source), cache_path)
+    assert set(restarted_token_info.load()) == {"USDC", "DAI", "WBTC"}
+    with pytest.raises(FileNotFoundError):
+        restarted_token_info.refresh()
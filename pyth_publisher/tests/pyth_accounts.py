@@ -0,0 +1,79 @@
+import base64
+import struct
+from typing import Any, Dict, List, Sequence, Tuple
+
+from pythclient.pythaccounts import PythPriceStatus
+from pythclient.solana import SolanaAccount, SolanaPublicKey
+
+# (price, confidence interval, status, publish slot) of a price info, in raw units
+RawPriceInfo = Tuple[int, int, PythPriceStatus, int]
+
+
+def _price_info(info: RawPriceInfo) -> bytes:
+    price, conf, status, pub_slot = info
+    return struct.pack("<qQIIQ", price, conf, status.value, 0, pub_slot)
+
+
+def encode_price_account(
+    *,
+    exponent: int,
+    aggregate: RawPriceInfo,
+    components: List[RawPriceInfo],
+    timestamp: int = 1700000000,
+    min_publishers: int = 3,
+    max_latency: int = 0,
+    valid_slot: int = 0,
+) -> Dict[str, Any]:
+    """Encode a v2 Pyth price account as the `value` of a Solana RPC response."""
+    size = 240 + 96 * len(components)
+    data = struct.pack("<IIII", 0xA1B2C3D4, 2, 3, size)
+    data += struct.pack("<IiII", 1, exponent, len(components), len(components))
+    data += struct.pack("<QQ", valid_slot, valid_slot)
+    data += struct.pack("<6q", 0, 0, 0, 0, 0, 0)
+    data += struct.pack("<qBbBbi", timestamp, min_publishers, 0, max_latency, 0, 0)
+    data += bytes(range(1, 33)) + bytes(32)
+    data += struct.pack("<QqQq", 0, 0, 0, 0)
+    data += _price_info(aggregate)
+    for i, component in enumerate(components):
+        data += bytes([i + 1] * 32) + _price_info(component) + _price_info(component)
+    return {"data": [base64.b64encode(data).decode(), "base64"], "lamports": 1}
+
+
+def _account(type_: int, body: bytes) -> Dict[str, Any]:
+    data = struct.pack("<IIII", 0xA1B2C3D4, 2, type_, 16 + len(body)) + body
+    return {"data": [base64.b64encode(data).decode(), "base64"], "lamports": 1}
+
+
+def encode_mapping_account(
+    entries: List[bytes], next_mapping: bytes = bytes(32)
+) -> Dict[str, Any]:
+    """Encode a Pyth mapping account listing the given product account keys."""
+    body = struct.pack("<II", len(entries), 0) + next_mapping + b"".join(entries)
+    return _account(1, body)
+
+
+def encode_product_account(
+    symbol: str, first_price: bytes = bytes(32)
+) -> Dict[str, Any]:
+    """Encode a Pyth product account with a symbol attribute."""
+    body = first_price
+    for attr in ("symbol", symbol):
+        body += bytes([len(attr)]) + attr.encode()
+    return _account(2, body)
+
+
+class FakeSolana:
+    """Serves the accounts of `data` like getMultipleAccounts, recording the keys
+    of each request."""
+
+    def __init__(self, data: Dict[bytes, Dict[str, Any]]) -> None:
+        self.data = data
+        self.requests: List[List[str]] = []
+
+    async def update_accounts(self, accounts: Sequence[SolanaAccount]) -> None:
+        if not accounts:
+            return
+        self.requests.append([str(account.key) for account in accounts])
+        keys = {str(SolanaPublicKey(key)): value for key, value in self.data.items()}
+        for account in accounts:
+            account.update_with_rpc_response(1, keys[str(account.key)])
@@ -0,0 +1,63 @@
+from pyth_publisher.config import (
+    CoinGeckoConfig,
+    CoinGeckoProduct,
+    PropellerConfig,
+    load_config,
+)
+
+CONFIG = """
+publisher:
+  provider_engine: 'propeller'
+  product_update_interval_secs: 10
+  health_check_port: 8000
+  health_check_threshold_secs: 60
+  pythd:
+    endpoint: 'ws://127.0.0.1:8910'
+  propeller:
+    redis_url: 'redis://127.0.0.1:6379'
+    quote_amount: 1000000000000000000
+"""
+
+
+def test_load_propeller_config(tmp_path):
+    config_path = tmp_path / "config.yaml"
+    config_path.write_text(CONFIG)
+
+    config = load_config(str(config_path))
+
+    assert config.provider_engine == "propeller"
+    assert config.pyth_replicator is None
+    assert config.deadband is None
+    assert config.propeller == PropellerConfig(
+        redis_url="redis://127.0.0.1:6379", quote_amount=10**18
+    )
+
+
+COIN_GECKO_CONFIG = """
+publisher:
+  provider_engine: 'coin_gecko'
+  product_update_interval_secs: 10
+  health_check_port: 8000
+  health_check_threshold_secs: 60
+  pythd:
+    endpoint: 'ws://127.0.0.1:8910'
+  coin_gecko:
+    update_interval_secs: 15
+    confidence_ratio_bps: 10
+    products:
+      - symbol: 'Crypto.BTC/USD'
+        coin_gecko_id: 'bitcoin'
+"""
+
+
+def test_load_coin_gecko_config(tmp_path):
+    config_path = tmp_path / "config.yaml"
+    config_path.write_text(COIN_GECKO_CONFIG)
+
+    config = load_config(str(config_path))
+
+    assert config.coin_gecko == CoinGeckoConfig(
+        update_interval_secs=15,
+        confidence_ratio_bps=10,
+        products=[CoinGeckoProduct(symbol="Crypto.BTC/USD", coin_gecko_id="bitcoin")],
+    )
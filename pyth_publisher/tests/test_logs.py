@@ -0,0 +1,83 @@
+import io
+import logging
+
+import pytest
+import structlog
+
+from pyth_publisher import logs
+from pyth_publisher.logs import EventLimiter, LogWriter
+
+
+def _log(limiter: EventLimiter, event: str) -> bool:
+    try:
+        limiter(None, "info", {"event": event})
+    except structlog.DropEvent:
+        return False
+    return True
+
+
+def test_rate_limited_events_are_summarized(monkeypatch):
+    now = 100.0
+    monkeypatch.setattr(logs.time, "monotonic", lambda: now)
+    summaries = []
+    limiter = EventLimiter(
+        summaries.append,
+        rate_limits={"Received a price update": 2},
+        sample_every={"Received a WS update": 3},
+    )
+
+    assert [_log(limiter, "Received a price update") for _ in range(5)] == [
+        True,
+        True,
+        False,
+        False,
+        False,
+    ]
+    assert [_log(limiter, "Received a WS update") for _ in range(6)] == [
+        False,
+        False,
+        True,
+    ] * 2
+    assert _log(limiter, "Updated Pyth accounts")
+    assert summaries == []
+
+    now = 101.5
+    assert _log(limiter, "Received a price update")
+    assert [summary["event"] for summary in summaries] == [
+        "5 'Received a price update' events in the last 1.5s, 3 of them not logged"
+    ]
+
+
+@pytest.mark.parametrize("queue_size", [10, 1])
+def test_writer_renders_events_and_records(queue_size):
+    stream = io.StringIO()
+    writer = LogWriter(stream, queue_size)
+    # Queued before the thread starts, so that the queue can be full
+    writer.put({"event": "queueing update_price", "level": "info", "timestamp": 0})
+    writer.put(logging.makeLogRecord({"msg": "Updated %d prices", "args": (3,)}))
+    writer.start()
+    writer.close()
+
+    lines = stream.getvalue().splitlines()
+    assert "queueing update_price" in lines[0]
+    if queue_size == 1:
+        assert lines[1:] == ["1 log entries dropped, the queue was full"]
+    else:
+        assert lines[1].endswith("Updated 3 prices [None]")
+
+
+def test_hot_paths_are_gated_on_the_configured_level(monkeypatch):
+    monkeypatch.setattr(logs, "_level", logging.NOTSET)
+    assert logs.enabled_for(logging.DEBUG)
+
+    root = logging.getLogger()
+    monkeypatch.setattr(root, "handlers", root.handlers)
+    monkeypatch.setattr(root, "level", root.level)
+    writer = logs.configure_logging(logging.INFO, stream=io.StringIO())
+    try:
+        assert not logs.enabled_for(logging.DEBUG)
+        assert logs.enabled_for(logging.INFO)
+        assert logs.enabled_for(logging.ERROR)
+    finally:
+        writer.close()
+        structlog.reset_defaults()
@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from pyth_publisher.api.health_check import app
+from pyth_publisher.pythd import PriceUpdate, PriceUpdateBatcher
+
+
+class _RecordingPythd:
+    def __init__(self) -> None:
+        self.batches = []
+
+    async def update_prices(self, updates):
+        self.batches.append(updates)
+        return [None] * len(updates)
+
+
+def _notify_to_send_count() -> float:
+    return REGISTRY.get_sample_value("pyth_publisher_notify_to_send_seconds_count")
+
+
+@pytest.mark.asyncio
+async def test_notify_to_send_latency_is_recorded():
+    count = _notify_to_send_count()
+    batcher = PriceUpdateBatcher(_RecordingPythd(), window_secs=0.01, max_size=10)
+    batcher.submit(PriceUpdate("account-0", 1, 1, notified_at=0.0))
+    # Updates that were not triggered by a notification are not recorded
+    batcher.submit(PriceUpdate("account-1", 1, 1))
+    await asyncio.sleep(0.05)
+
+    assert _notify_to_send_count() == count + 1
+
+
+def test_metrics_endpoint():
+    response = TestClient(app).get("/metrics")
+
+    assert response.status_code == 200
+    assert "pyth_publisher_notify_to_send_seconds_bucket" in response.text
+    assert "pyth_publisher_event_loop_lag_seconds_count" in response.text
@@ -0,0 +1,61 @@
+import subprocess
+import sys
+
+import pytest
+
+from pyth_publisher.provider import Price, PriceTable, load_provider_class
+
+
+def test_price_table_updates_records_in_place():
+    table = PriceTable()
+    btc = table.index("Crypto.BTC/USD")
+    eth = table.index("Crypto.ETH/USD")
+    assert table.index("Crypto.BTC/USD") == btc
+    assert table.get("Crypto.BTC/USD") is None
+
+    record = table.set(btc, 60000.0, 10.0, 1700000000, 100)
+    assert table.get("Crypto.BTC/USD") == Price(60000.0, 10.0, 1700000000, 100)
+
+    assert table.set(btc, 61000.0, 12.0, 1700000001) is record
+    assert table.at(btc) == Price(61000.0, 12.0, 1700000001)
+    assert table.at(eth) is None
+
+
+def test_price_table_retain():
+    table = PriceTable()
+    btc = table.index("Crypto.BTC/USD")
+    table.set(btc, 60000.0, 10.0, 1700000000)
+    table.set(table.index("Crypto.ETH/USD"), 3000.0, 1.0, 1700000000)
+
+    assert table.retain(["Crypto.ETH/USD", "Crypto.SOL/USD"])
+    assert not table.retain(["Crypto.ETH/USD"])
+    assert table.keys() == ["Crypto.ETH/USD"]
+    assert table.get("Crypto.BTC/USD") is None
+    # The index of a removed key is reused, without its price
+    assert table.index("Crypto.SOL/USD") == btc
+    assert table.at(btc) is None
+    assert len(table._records) == 2
+
+
+def test_load_provider_class():
+    from pyth_publisher.providers.coin_gecko import CoinGecko
+
+    assert load_provider_class("coin_gecko") is CoinGecko
+    with pytest.raises(ValueError):
+        load_provider_class("unknown")
+
+
+def test_publisher_imports_no_provider_engine():
+    modules = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, pyth_publisher.publisher; print(' '.join(sys.modules))",
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.split()
+    assert "pyth_publisher.publisher" in modules
+    assert not [module for module in modules if module.startswith("pythclient")]
+    assert "pyth_publisher.providers.coin_gecko" not in modules
@@ -0,0 +1,191 @@
+import asyncio
+from typing import List, Optional
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from pyth_publisher.config import DeadbandConfig, Pythd
+from pyth_publisher.provider import Price, Provider, PythSymbol
+from pyth_publisher.publisher import Product, Publisher, PublishPlan
+from pyth_publisher.tests.configs import publisher_config
+from pyth_publisher.tests.test_pythd import FakePythAgent, run_fake_pyth_agent
+
+
+class FixedPriceProvider(Provider):
+    def upd_products(self, product_symbols: List[PythSymbol]) -> None:
+        pass
+
+    async def _update_loop(self) -> None:
+        pass
+
+    def latest_price(self, symbol: PythSymbol) -> Optional[Price]:
+        return Price(100.0, 1.0, 1700000000)
+
+
+def _product(symbol: str, account: str):
+    return {
+        "account": f"product-{account}",
+        "attr_dict": {"symbol": symbol},
+        "price": [{"account": account, "price_exponent": -2}],
+    }
+
+
+@pytest.mark.asyncio
+async def test_resubscribes_in_one_batch_after_pythd_restart():
+    agent = FakePythAgent()
+    agent.products = [
+        _product("Crypto.BTC/USD", "price-btc"),
+        _product("Crypto.ETH/USD", "price-eth"),
+    ]
+    async with run_fake_pyth_agent(agent) as url:
+        publisher = Publisher(
+            publisher_config(
+                Pythd(url, batch_window_ms=1, reconnect_initial_backoff_ms=10)
+            )
+        )
+        publisher.provider = FixedPriceProvider()
+        await publisher.start()
+        await asyncio.sleep(0.1)
+        assert set(agent.subscriptions.values()) == {"price-btc", "price-eth"}
+
+        agent.next_subscription = 100
+        await agent.restart()
+        await asyncio.sleep(0.5)
+
+        # Both products were subscribed to again, with a single batch
+        assert isinstance(agent.frames[-1], list) and len(agent.frames[-1]) == 2
+        assert agent.subscriptions == {100: "price-btc", 101: "price-eth"}
+        assert set(publisher.subscriptions) == {100, 101}
+
+        # Notifications of the new subscriptions are published
+        await agent.notify_price_sched(101)
+        await asyncio.sleep(0.1)
+        assert agent.updates["price-eth"]["price"] == 10000
+
+        publisher._product_update_task.cancel()
+        publisher._event_loop_lag_task.cancel()
+        await publisher.pythd.close()
+
+
+def test_scale_price_rescales_integer_mantissas_exactly():
+    plan = PublishPlan(
+        Product("Crypto.BTC/USD", "product", "price", -8, 1), None, 10**8, MagicMock()
+    )
+
+    assert plan.scale_price(Price(65000.5, 12.25, 0)) == (6500050000000, 1225000000)
+    # Same exponent: passed through as is
+    assert plan.scale_price(Price(9007199254740993, 7, 0, exponent=-8)) == (
+        9007199254740993,
+        7,
+    )
+    assert plan.scale_price(Price(650005, 1225, 0, exponent=-1)) == (
+        6500050000000,
+        12250000000,
+    )
+    # Truncated toward zero, like the float path
+    assert plan.scale_price(
+        Price(-6500050000000999, 1225000000999, 0, exponent=-11)
+    ) == (
+        -6500050000000,
+        1225000000,
+    )
+
+
+@pytest.mark.asyncio
+async def test_deadband_skips_updates_until_the_price_moves_or_heartbeat():
+    publisher = Publisher(
+        publisher_config(
+            Pythd("ws://127.0.0.1:0"),
+            deadband=DeadbandConfig(threshold_bps=10, heartbeat_secs=5),
+        )
+    )
+    provider = publisher.provider = FixedPriceProvider()
+    # Every update is accepted by pythd right away
+    publisher._price_update_batcher = MagicMock()
+    publisher._price_update_batcher.submit.side_effect = lambda update: (
+        update.on_sent(update)
+    )
+    product = Product("Crypto.BTC/USD", "product", "price", -2, 1)
+    publisher.subscriptions = {1: PublishPlan(product, None, 100, MagicMock())}
+
+    for now, price in [
+        (0, 100.0),
+        # Within 10 bps of the last update sent
+        (1, 100.05),
+        (2, 99.95),
+        (3, 100.2),
+        # Unchanged, but the last update was sent 5 seconds ago
+        (8, 100.2),
+    ]:
+        provider.latest_price = lambda symbol: Price(price, 1.0, 1700000000)
+        with patch("pyth_publisher.publisher.time.perf_counter", return_value=now):
+            await publisher.on_notify_price_sched(1)
+
+    sent = publisher._price_update_batcher.submit.call_args_list
+    assert [call.args[0].price for call in sent] == [10000, 10020, 10020]
+
+    # The last update sent survives the plans being rebuilt
+    publisher.products = [product]
+    publisher.pythd.subscribe_price_scheds = AsyncMock(return_value={})
+    await publisher._subscribe_new_products()
+    assert publisher.subscriptions[1].sent_price == 10020
+
+
+@pytest.mark.asyncio
+async def test_deadband_does_not_skip_updates_after_a_failed_send():
+    agent = FakePythAgent()
+    agent.failing_accounts = {"price-btc"}
+    async with run_fake_pyth_agent(agent) as url:
+        publisher = Publisher(
+            publisher_config(
+                Pythd(url, batch_window_ms=1),
+                deadband=DeadbandConfig(threshold_bps=10, heartbeat_secs=5),
+            )
+        )
+        publisher.provider = FixedPriceProvider()
+        await publisher.pythd.connect()
+        product = Product("Crypto.BTC/USD", "product", "price-btc", -2, 1)
+        plan = publisher.subscriptions[1] = PublishPlan(product, None, 100, MagicMock())
+
+        await publisher.on_notify_price_sched(1)
+        await asyncio.sleep(0.1)
+        assert plan.sent_price is None
+
+        # The same price is sent again, and is recorded once accepted
+        agent.failing_accounts = set()
+        await publisher.on_notify_price_sched(1)
+        await asyncio.sleep(0.1)
+        await publisher.pythd.close()
+
+    assert [frame[0]["params"]["price"] for frame in agent.frames] == [10000, 10000]
+    assert plan.sent_price == 10000
+
+
+class IndexedPriceProvider(FixedPriceProvider):
+    def __init__(self) -> None:
+        self.indexes = {"Crypto.BTC/USD": 0}
+        self.prices = [Price(100.0, 1.0, 1700000000), Price(200.0, 1.0, 1700000000)]
+
+    def price_index(self, symbol: PythSymbol) -> Optional[int]:
+        return self.indexes.get(symbol)
+
+    def latest_price_at(self, index: int) -> Optional[Price]:
+        return self.prices[index]
+
+
+@pytest.mark.asyncio
+async def test_plans_follow_the_provider_remapping_its_prices():
+    publisher = Publisher(publisher_config(Pythd("ws://127.0.0.1:0")))
+    provider = publisher.provider = IndexedPriceProvider()
+    publisher._price_update_batcher = MagicMock()
+    publisher.products = [Product("Crypto.BTC/USD", "product", "price", -2, 1)]
+    publisher.pythd.subscribe_price_scheds = AsyncMock(return_value={})
+    await publisher._subscribe_new_products()
+
+    await publisher.on_notify_price_sched(1)
+    provider.indexes["Crypto.BTC/USD"] = 1
+    provider.price_indexes_version += 1
+    await publisher.on_notify_price_sched(1)
+
+    sent = publisher._price_update_batcher.submit.call_args_list
+    assert [call.args[0].price for call in sent] == [10000, 20000]
@@ -0,0 +1,77 @@
+import pytest
+from pythclient.pythaccounts import PythPriceStatus
+from pythclient.solana import SolanaPublicKey
+
+from pyth_publisher.providers.pyth_account_catalog import PythAccountCatalog
+from pyth_publisher.tests.pyth_accounts import (
+    FakeSolana,
+    encode_mapping_account,
+    encode_price_account,
+    encode_product_account,
+)
+
+MAPPING, BTC, ETH, SOL, BTC_PRICE, ETH_PRICE, SOL_PRICE, NEW_ETH_PRICE = (
+    bytes([i] * 32) for i in range(1, 9)
+)
+PRICE = encode_price_account(
+    exponent=-2, aggregate=(100, 1, PythPriceStatus.TRADING, 1), components=[]
+)
+
+
+def _key(key: bytes) -> str:
+    return str(SolanaPublicKey(key))
+
+
+@pytest.mark.asyncio
+async def test_refresh_fetches_only_what_changed():
+    solana = FakeSolana(
+        {
+            MAPPING: encode_mapping_account([BTC, ETH]),
+            BTC: encode_product_account("Crypto.BTC/USD", BTC_PRICE),
+            ETH: encode_product_account("Crypto.ETH/USD", ETH_PRICE),
+            SOL: encode_product_account("Crypto.SOL/USD", SOL_PRICE),
+            BTC_PRICE: PRICE,
+            ETH_PRICE: PRICE,
+            SOL_PRICE: PRICE,
+            NEW_ETH_PRICE: PRICE,
+        }
+    )
+    catalog = PythAccountCatalog(solana, _key(MAPPING))
+
+    assert await catalog.refresh()
+    assert solana.requests == [
+        [_key(MAPPING)],
+        [_key(BTC), _key(ETH)],
+        [_key(BTC_PRICE), _key(ETH_PRICE)],
+    ]
+    assert [str(account.key) for account in catalog.accounts()] == [
+        _key(key) for key in (MAPPING, BTC, BTC_PRICE, ETH, ETH_PRICE)
+    ]
+
+    # Nothing changed: only the mapping account is fetched
+    solana.requests = []
+    assert not await catalog.refresh()
+    assert solana.requests == [[_key(MAPPING)]]
+
+    solana.requests = []
+    solana.data[MAPPING] = encode_mapping_account([ETH, SOL])
+    changes = await catalog.refresh()
+    assert (changes.added_products, changes.removed_products) == (1, 1)
+    assert solana.requests == [[_key(MAPPING)], [_key(SOL)], [_key(SOL_PRICE)]]
+    assert [product.symbol for product in catalog.products] == [
+        "Crypto.ETH/USD",
+        "Crypto.SOL/USD",
+    ]
+
+    # A product only changes for the catalog when it is fetched again
+    solana.requests = []
+    solana.data[ETH] = encode_product_account("Crypto.ETH/USD", NEW_ETH_PRICE)
+    eth = catalog.products[0]
+    changes = await catalog.refresh([eth])
+    assert changes.repriced_products == 1
+    assert solana.requests == [
+        [_key(MAPPING)],
+        [_key(ETH), _key(ETH_PRICE)],
+        [_key(NEW_ETH_PRICE)],
+    ]
+    assert [str(price.key) for price in eth.prices.values()] == [_key(NEW_ETH_PRICE)]
@@ -0,0 +1,62 @@
+import pytest
+from pythclient.pythaccounts import PythPriceAccount, PythPriceStatus
+from pythclient.solana import SolanaClient, SolanaPublicKey
+
+from pyth_publisher.providers.pyth_price_decoder import LazyPythPriceAccount
+from pyth_publisher.tests.pyth_accounts import encode_price_account
+
+KEY = SolanaPublicKey("FsJ3A3u2vn5cTVofAjvy6y5kwABJAqYWpe4975bi2epH")
+
+
+def _decode_both(slot, value):
+    solana = SolanaClient(endpoint="http://localhost", ws_endpoint="ws://localhost")
+    full = PythPriceAccount(KEY, solana)
+    lazy = LazyPythPriceAccount(KEY, solana)
+    full.update_with_rpc_response(slot, value)
+    lazy.update_with_rpc_response(slot, value)
+    return full, lazy
+
+
+@pytest.mark.parametrize(
+    "slot, aggregate_status",
+    [
+        (1000, PythPriceStatus.TRADING),
+        # The aggregate is too old, so it is not trading anymore
+        (2000, PythPriceStatus.TRADING),
+        (1000, PythPriceStatus.UNKNOWN),
+    ],
+)
+def test_lazy_decoder_matches_pythclient(slot, aggregate_status):
+    value = encode_price_account(
+        exponent=-8,
+        aggregate=(6543210987654, 123456789, aggregate_status, 990),
+        components=[
+            (6543210000000, 100000000, PythPriceStatus.TRADING, 995),
+            (6543220000000, 200000000, PythPriceStatus.UNKNOWN, 900),
+        ],
+        min_publishers=10,
+        valid_slot=990,
+    )
+    full, lazy = _decode_both(slot, value)
+
+    assert lazy.slot == full.slot
+    assert lazy.exponent == full.exponent
+    assert lazy.timestamp == full.timestamp
+    assert lazy.min_publishers == full.min_publishers
+    assert lazy.max_latency == full.max_latency
+    assert lazy.aggregate_price_status == full.aggregate_price_status
+    assert lazy.aggregate_price == full.aggregate_price
+    assert (
+        lazy.aggregate_price_confidence_interval
+        == full.aggregate_price_confidence_interval
+    )
+    assert lazy.aggregate_price_info == full.aggregate_price_info
+    assert lazy.price_components == full.price_components
+    if full.aggregate_price is None:
+        assert lazy.aggregate_raw_price is None
+    else:
+        assert lazy.aggregate_raw_price == full.aggregate_price_info.raw_price
+        assert (
+            lazy.aggregate_raw_confidence_interval
+            == full.aggregate_price_info.raw_confidence_interval
+        )
@@ -0,0 +1,56 @@
+from typing import List
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from pythclient.pythaccounts import PythPriceAccount
+from pythclient.solana import SolanaPublicKey
+
+from pyth_publisher.tests.configs import make_replicator
+
+
+BTC_PRICE = str(SolanaPublicKey(bytes([1] * 32)))
+ETH_PRICE = str(SolanaPublicKey(bytes([2] * 32)))
+SOL_PRICE = str(SolanaPublicKey(bytes([3] * 32)))
+
+
+def _product(symbol: str, price_keys: List[str]) -> MagicMock:
+    product = MagicMock()
+    product.symbol = symbol
+    product.get_prices = AsyncMock(
+        return_value={
+            i: PythPriceAccount(SolanaPublicKey(key), MagicMock(), product=product)
+            for i, key in enumerate(price_keys)
+        }
+    )
+    return product
+
+
+@pytest.mark.asyncio
+async def test_sync_price_subscriptions_follows_product_symbols():
+    replicator = make_replicator(filtered_subscription=True)
+    replicator._catalog = MagicMock()
+    replicator._catalog.products = [
+        _product("Crypto.BTC/USD", [BTC_PRICE]),
+        _product("Crypto.ETH/USD", [ETH_PRICE]),
+        _product("Crypto.SOL/USD", [SOL_PRICE]),
+    ]
+    replicator._ws = MagicMock()
+    replicator._ws.subscribe = AsyncMock()
+    replicator._ws.unsubscribe = AsyncMock()
+
+    replicator.upd_products(["Crypto.BTC/USD", "Crypto.ETH/USD"])
+    await replicator._maybe_sync_price_subscriptions()
+    assert set(replicator._subscribed_accounts) == {BTC_PRICE, ETH_PRICE}
+    assert replicator._ws.subscribe.await_count == 2
+
+    # Nothing changed, so nothing is re-synced
+    replicator.upd_products(["Crypto.ETH/USD", "Crypto.BTC/USD"])
+    await replicator._maybe_sync_price_subscriptions()
+    assert replicator._ws.subscribe.await_count == 2
+
+    replicator.upd_products(["Crypto.ETH/USD", "Crypto.SOL/USD"])
+    await replicator._maybe_sync_price_subscriptions()
+    assert set(replicator._subscribed_accounts) == {ETH_PRICE, SOL_PRICE}
+    assert replicator._ws.subscribe.await_count == 3
+    assert replicator._ws.unsubscribe.await_count == 1
+    assert str(replicator._ws.unsubscribe.await_args.args[0].key) == BTC_PRICE
@@ -0,0 +1,152 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from prometheus_client import REGISTRY
+from pythclient.pythaccounts import PythPriceAccount, PythPriceStatus
+from pythclient.solana import SolanaPublicKey
+
+from pyth_publisher.providers.pyth_account_catalog import CatalogChanges
+from pyth_publisher.providers.pyth_price_decoder import LazyPythPriceAccount
+from pyth_publisher.providers.pyth_replicator import EndpointStats, PythReplicator
+from pyth_publisher.tests.configs import make_replicator
+from pyth_publisher.tests.pyth_accounts import encode_price_account
+
+BTC_PRICE = SolanaPublicKey(bytes([1] * 32))
+
+
+def _replicator(**kwargs) -> PythReplicator:
+    return make_replicator(
+        ws_endpoint="ws://primary.example/api-key",
+        hedge_ws_endpoints=["ws://hedge.example/api-key"],
+        **kwargs,
+    )
+
+
+def _arrivals(endpoint: str, arrival: str) -> float:
+    return (
+        REGISTRY.get_sample_value(
+            "pyth_publisher_replicator_endpoint_updates_total",
+            {"endpoint": endpoint, "arrival": arrival},
+        )
+        or 0
+    )
+
+
+def _receive(account: LazyPythPriceAccount, slot: int, price: int) -> None:
+    account.update_with_rpc_response(
+        slot,
+        encode_price_account(
+            exponent=-2,
+            aggregate=(price, 1, PythPriceStatus.TRADING, slot),
+            components=[],
+        ),
+    )
+
+
+@pytest.mark.asyncio
+async def test_first_arrival_of_each_slot_wins():
+    replicator = _replicator()
+    hedge = EndpointStats("ws://hedge.example/api-key")
+    primary = replicator._primary_endpoint
+    before = {
+        (endpoint, arrival): _arrivals(endpoint, arrival)
+        for endpoint in ("primary.example", "hedge.example")
+        for arrival in ("first", "duplicate", "older")
+    }
+    stale = REGISTRY.get_sample_value(
+        "pyth_publisher_replicator_updates_dropped_total", {"reason": "stale"}
+    )
+    account = LazyPythPriceAccount(BTC_PRICE, MagicMock(), product=MagicMock())
+
+    _receive(account, 10, 100)
+    replicator._on_ws_update(account, hedge)
+    _receive(account, 10, 100)
+    replicator._on_ws_update(account, primary)
+    assert await replicator._updates.drain() == [account]
+
+    _receive(account, 11, 101)
+    replicator._on_ws_update(account, primary)
+    _receive(account, 12, 102)
+    replicator._on_ws_update(account, primary)
+    # The hedge endpoint is behind: slot 11 is older than the newest slot
+    _receive(account, 11, 101)
+    replicator._on_ws_update(account, hedge)
+
+    assert account.slot == 12
+    assert account.aggregate_price == 1.02
+    assert await replicator._updates.drain() == [account]
+    # The older slot never reached the coalescer
+    assert (
+        REGISTRY.get_sample_value(
+            "pyth_publisher_replicator_updates_dropped_total", {"reason": "stale"}
+        )
+        == stale
+    )
+
+    arrivals = {key: _arrivals(*key) - value for key, value in before.items()}
+    assert arrivals == {
+        ("primary.example", "first"): 2,
+        ("primary.example", "duplicate"): 1,
+        ("primary.example", "older"): 0,
+        ("hedge.example", "first"): 1,
+        ("hedge.example", "duplicate"): 0,
+        ("hedge.example", "older"): 1,
+    }
+
+
+@pytest.mark.asyncio
+async def test_hedge_ws_mirrors_the_price_subscriptions():
+    replicator = _replicator(filtered_subscription=True)
+    product = MagicMock()
+    product.symbol = "Crypto.BTC/USD"
+    product.get_prices = AsyncMock(
+        return_value={0: PythPriceAccount(BTC_PRICE, MagicMock(), product=product)}
+    )
+    replicator._catalog = MagicMock()
+    replicator._catalog.products = [product]
+    replicator._ws = MagicMock()
+    replicator._ws.subscribe = AsyncMock()
+    replicator._ws.unsubscribe = AsyncMock()
+    hedge_ws = MagicMock()
+    hedge_ws.subscribe = AsyncMock()
+    hedge_ws.unsubscribe = AsyncMock()
+
+    replicator.upd_products(["Crypto.BTC/USD"])
+    await replicator._maybe_sync_price_subscriptions()
+    subscribed = {}
+    await replicator._mirror_price_subscriptions(hedge_ws, subscribed)
+
+    primary_account = replicator._ws.subscribe.await_args.args[0]
+    assert hedge_ws.subscribe.await_args.args[0] is primary_account
+    assert subscribed == {str(BTC_PRICE): primary_account}
+
+    replicator.upd_products([])
+    await replicator._maybe_sync_price_subscriptions()
+    await replicator._mirror_price_subscriptions(hedge_ws, subscribed)
+    assert subscribed == {}
+    assert hedge_ws.unsubscribe.await_args.args[0] is primary_account
+
+
+@pytest.mark.asyncio
+async def test_new_accounts_reach_sessions_once_they_are_subscribed():
+    replicator = _replicator()
+    replicator._catalog = MagicMock()
+    replicator._catalog.refresh = AsyncMock(
+        side_effect=[CatalogChanges(added_products=1), CatalogChanges()]
+    )
+    replicator._catalog.accounts.return_value = []
+    replicator._ws = MagicMock()
+    # The hedge WS is connected, but not subscribed to the program yet
+    hedge = MagicMock()
+    hedge.update_program_accounts.side_effect = [ValueError("not subscribed"), None]
+    replicator._hedge_sessions = {"ws://hedge.example/api-key": hedge}
+
+    await replicator._update_accounts()
+    replicator._ws.update_program_accounts.assert_called_once()
+    assert hedge.update_program_accounts.call_count == 1
+
+    # Nothing changed since, but the hedge WS still gets the new accounts
+    await replicator._update_accounts()
+    replicator._ws.update_program_accounts.assert_called_once()
+    assert hedge.update_program_accounts.call_count == 2
+    assert not replicator._outdated_sessions
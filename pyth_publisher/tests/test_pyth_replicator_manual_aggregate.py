@@ -1,6 +1,14 @@
 import random
 from typing import List
+
+import numpy as np
+from pythclient.pythaccounts import PythPriceStatus
+from pythclient.solana import SolanaClient, SolanaPublicKey
+
+from pyth_publisher.providers.pyth_price_decoder import LazyPythPriceAccount
 from pyth_publisher.providers.pyth_replicator import manual_aggregate
+from pyth_publisher.tests.configs import make_replicator
+from pyth_publisher.tests.pyth_accounts import encode_price_account
 
 
 def test_manual_aggregate_works():
@@ -10,3 +18,84 @@ def test_manual_aggregate_works():
     agg_price, agg_confidence_interval = manual_aggregate(prices)
     assert agg_price == 6
     assert agg_confidence_interval == 4
+
+
+def _sorted_manual_aggregate(prices: List[float]):
+    # The list based implementation manual_aggregate replaced
+    prices = sorted(prices)
+    num_prices = len(prices)
+    agg_price = prices[num_prices // 2]
+    return agg_price, max(
+        agg_price - prices[num_prices // 4], prices[num_prices * 3 // 4] - agg_price
+    )
+
+
+def test_manual_aggregate_matches_sorting():
+    rng = random.Random(42)
+    for num_prices in [1, 2, 3, 4, 5, 30, 96, 192]:
+        prices = [rng.uniform(0, 100000) for _ in range(num_prices)]
+        assert manual_aggregate(prices) == _sorted_manual_aggregate(prices)
+        assert manual_aggregate(np.array(prices)) == _sorted_manual_aggregate(prices)
+
+
+def _price_account(num_components: int) -> LazyPythPriceAccount:
+    rng = random.Random(num_components)
+    statuses = [
+        PythPriceStatus.TRADING,
+        PythPriceStatus.TRADING,
+        PythPriceStatus.UNKNOWN,
+    ]
+    account = LazyPythPriceAccount(
+        SolanaPublicKey("FsJ3A3u2vn5cTVofAjvy6y5kwABJAqYWpe4975bi2epH"),
+        SolanaClient(endpoint="http://localhost", ws_endpoint="ws://localhost"),
+    )
+    account.update_with_rpc_response(
+        1000,
+        encode_price_account(
+            exponent=-5,
+            aggregate=(0, 0, PythPriceStatus.UNKNOWN, 0),
+            components=[
+                (
+                    rng.randint(6000000000, 7000000000),
+                    rng.randint(0, 10000000),
+                    rng.choice(statuses),
+                    rng.randint(950, 1000),
+                )
+                for _ in range(num_components)
+            ],
+        ),
+    )
+    return account
+
+
+def _list_manual_agg_prices(account: LazyPythPriceAccount) -> List[float]:
+    # The per component loop the vectorized gathering replaced
+    prices: List[float] = []
+    for price_component in account.price_components:
+        price = price_component.latest_price_info
+        if (
+            price.price_status == PythPriceStatus.TRADING
+            and account.slot - price.pub_slot <= 25
+        ):
+            prices.extend(
+                [
+                    price.price - price.confidence_interval,
+                    price.price,
+                    price.price + price.confidence_interval,
+                ]
+            )
+    return prices
+
+
+def test_manual_agg_prices_match_price_components():
+    replicator = make_replicator(manual_agg_max_slot_diff=25)
+    for num_components in [0, 1, 7, 32, 100]:
+        account = _price_account(num_components)
+        prices = _list_manual_agg_prices(account)
+        vectorized_prices = replicator._manual_agg_prices(account)
+
+        assert sorted(vectorized_prices.tolist()) == sorted(prices)
+        if prices:
+            assert manual_aggregate(vectorized_prices) == _sorted_manual_aggregate(
+                prices
+            )
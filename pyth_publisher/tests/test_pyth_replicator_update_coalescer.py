@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+
+import pytest
+from prometheus_client import REGISTRY
+
+from pyth_publisher.providers.pyth_replicator import UpdateCoalescer
+
+
+def _dropped(reason: str) -> float:
+    return (
+        REGISTRY.get_sample_value(
+            "pyth_publisher_replicator_updates_dropped_total", {"reason": reason}
+        )
+        or 0
+    )
+
+
+@pytest.mark.asyncio
+async def test_coalescer_keeps_newest_update_per_account():
+    btc = SimpleNamespace(key="btc", slot=10)
+    eth = SimpleNamespace(key="eth", slot=10)
+    coalescer = UpdateCoalescer()
+    superseded, stale = _dropped("superseded"), _dropped("stale")
+
+    coalescer.put(btc)
+    coalescer.put(eth)
+    btc.slot = 11
+    coalescer.put(btc)
+    # Same slot again, e.g. a duplicate notification
+    coalescer.put(btc)
+
+    assert await coalescer.drain() == [btc, eth]
+    assert (_dropped("superseded") - superseded, _dropped("stale") - stale) == (1, 1)
+
+    btc.slot = 12
+    coalescer.put(btc)
+    assert await coalescer.drain() == [btc]
+    assert coalescer._pending == {}
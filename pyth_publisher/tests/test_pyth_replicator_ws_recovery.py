@@ -0,0 +1,130 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from pyth_publisher.providers import pyth_replicator
+from pyth_publisher.tests.configs import make_replicator
+
+
+class FakeWatchSession:
+    """Fails on the first update of the first session, then waits forever."""
+
+    sessions = []
+
+    def __init__(self, solana) -> None:
+        self.reconnects = 0
+        self.program_subscribe = AsyncMock()
+        self.disconnect = AsyncMock()
+        FakeWatchSession.sessions.append(self)
+
+    async def connect(self) -> None:
+        pass
+
+    async def next_update(self):
+        if len(FakeWatchSession.sessions) == 1:
+            raise ConnectionError("websocket closed")
+        await asyncio.Event().wait()
+
+
+@pytest.mark.asyncio
+async def test_ws_is_reconnected_without_fetching_all_accounts(monkeypatch):
+    monkeypatch.setattr(
+        pyth_replicator, "ReconnectCountingWatchSession", FakeWatchSession
+    )
+    monkeypatch.setattr(pyth_replicator.random, "uniform", lambda a, b: 0)
+    monkeypatch.setattr(pyth_replicator, "GAP_RECOVERY_DELAY_SECS", 0)
+    replicator = make_replicator()
+    replicator._client = MagicMock()
+    replicator._catalog = MagicMock()
+    replicator._catalog.refresh = AsyncMock()
+    replicator._catalog.accounts.return_value = []
+    replicator._client.solana.get_slot = AsyncMock(return_value=100)
+    replicator._client.solana.update_accounts = AsyncMock()
+    replicator._update_accounts_loop = AsyncMock()
+
+    task = asyncio.create_task(replicator._update_loop())
+    await asyncio.sleep(0.1)
+    task.cancel()
+
+    first, second = FakeWatchSession.sessions
+    first.disconnect.assert_awaited_once()
+    assert first.program_subscribe.await_count == 1
+    assert second.program_subscribe.await_count == 1
+    replicator._catalog.refresh.assert_awaited_once()
+    replicator._client.solana.update_accounts.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_gap_recovery_refetches_only_accounts_older_than_reconnect(
+    monkeypatch,
+):
+    monkeypatch.setattr(pyth_replicator, "GAP_RECOVERY_DELAY_SECS", 0)
+    replicator = make_replicator()
+    accounts = {
+        key: SimpleNamespace(key=key, slot=slot, product=MagicMock())
+        for key, slot in [("btc", 90), ("eth", 101), ("sol", None)]
+    }
+    replicator._watched_price_accounts = accounts
+
+    async def update_accounts(accounts):
+        for account in accounts:
+            account.slot = 102
+
+    replicator._client = MagicMock()
+    replicator._client.solana.get_slot = AsyncMock(return_value=100)
+    replicator._client.solana.update_accounts = AsyncMock(side_effect=update_accounts)
+
+    await replicator._recover_gap()
+
+    refetched = replicator._client.solana.update_accounts.await_args.args[0]
+    assert [account.key for account in refetched] == ["btc", "sol"]
+    assert [account.key for account in await replicator._updates.drain()] == [
+        "btc",
+        "sol",
+    ]
+
+
+class FailingSubscribeWatchSession(FakeWatchSession):
+    """Fails to subscribe on the first session, then waits forever."""
+
+    sessions = []
+
+    def __init__(self, solana) -> None:
+        self.reconnects = 0
+        self.program_subscribe = AsyncMock()
+        self.disconnect = AsyncMock()
+        FailingSubscribeWatchSession.sessions.append(self)
+        if len(FailingSubscribeWatchSession.sessions) == 1:
+            self.program_subscribe.side_effect = ConnectionError("gave up")
+
+    async def next_update(self):
+        await asyncio.Event().wait()
+
+
+@pytest.mark.asyncio
+async def test_accounts_are_updated_when_the_first_watch_fails(monkeypatch):
+    monkeypatch.setattr(
+        pyth_replicator, "ReconnectCountingWatchSession", FailingSubscribeWatchSession
+    )
+    monkeypatch.setattr(pyth_replicator.random, "uniform", lambda a, b: 0)
+    monkeypatch.setattr(pyth_replicator, "GAP_RECOVERY_DELAY_SECS", 0)
+    replicator = make_replicator()
+    replicator._client = MagicMock()
+    replicator._catalog = MagicMock()
+    replicator._catalog.refresh = AsyncMock()
+    replicator._catalog.accounts.return_value = []
+    replicator._client.solana.get_slot = AsyncMock(return_value=100)
+    replicator._client.solana.update_accounts = AsyncMock()
+    replicator._restore_snapshot = MagicMock(return_value=True)
+    replicator._update_accounts_loop = AsyncMock()
+
+    task = asyncio.create_task(replicator._update_loop())
+    await asyncio.sleep(0.1)
+    task.cancel()
+
+    assert len(FailingSubscribeWatchSession.sessions) == 2
+    replicator._restore_snapshot.assert_called_once()
+    # The restored snapshot is still reconciled after the retry
+    replicator._update_accounts_loop.assert_called_once_with(reconcile=True)
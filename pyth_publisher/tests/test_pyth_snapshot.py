@@ -0,0 +1,129 @@
+import pytest
+from pythclient.pythaccounts import PythPriceStatus
+from pythclient.solana import SolanaPublicKey
+
+from pyth_publisher.provider import Price
+from pyth_publisher.providers.pyth_account_catalog import PythAccountCatalog
+from pyth_publisher.providers.pyth_snapshot import (
+    encode_snapshot,
+    read_snapshot,
+    write_snapshot,
+)
+from pyth_publisher.tests.configs import make_replicator
+from pyth_publisher.tests.pyth_accounts import (
+    FakeSolana,
+    encode_mapping_account,
+    encode_price_account,
+    encode_product_account,
+)
+
+MAPPING, BTC, ETH, BTC_PRICE = (bytes([i] * 32) for i in range(1, 5))
+BTC_LATEST = Price(6500050000000, 1225000000, 1700000000, 250000000, -8)
+ETH_LATEST = Price(3400.25, 1.5, 1700000000)
+
+
+def _key(key: bytes) -> str:
+    return str(SolanaPublicKey(key))
+
+
+def _solana() -> FakeSolana:
+    return FakeSolana(
+        {
+            MAPPING: encode_mapping_account([BTC, ETH]),
+            BTC: encode_product_account("Crypto.BTC/USD", BTC_PRICE),
+            # A product without any price account
+            ETH: encode_product_account("Crypto.ETH/USD"),
+            BTC_PRICE: encode_price_account(
+                exponent=-2,
+                aggregate=(100, 1, PythPriceStatus.TRADING, 1),
+                components=[],
+            ),
+        }
+    )
+
+
+async def _write_snapshot(path: str) -> PythAccountCatalog:
+    catalog = PythAccountCatalog(_solana(), _key(MAPPING))
+    await catalog.refresh()
+    write_snapshot(
+        path,
+        encode_snapshot(
+            catalog.mappings,
+            catalog.products,
+            {"Crypto.BTC/USD": BTC_LATEST, "Crypto.ETH/USD": ETH_LATEST},
+        ),
+    )
+    return catalog
+
+
+@pytest.mark.asyncio
+async def test_snapshot_restores_the_catalog_and_prices(tmp_path):
+    path = str(tmp_path / "snapshot")
+    catalog = await _write_snapshot(path)
+
+    solana = _solana()
+    snapshot = read_snapshot(path, solana)
+    restored = PythAccountCatalog(solana, _key(MAPPING))
+    restored.restore(snapshot.mappings, snapshot.products)
+
+    assert [str(account.key) for account in restored.accounts()] == [
+        str(account.key) for account in catalog.accounts()
+    ]
+    assert [product.symbol for product in restored.products] == [
+        "Crypto.BTC/USD",
+        "Crypto.ETH/USD",
+    ]
+    assert snapshot.prices == {
+        "Crypto.BTC/USD": BTC_LATEST,
+        "Crypto.ETH/USD": ETH_LATEST,
+    }
+
+    # Reconciling fetches the products again, but not their unchanged prices
+    assert not await restored.refresh()
+    assert solana.requests == [[_key(MAPPING)], [_key(BTC), _key(ETH)]]
+
+
+@pytest.mark.asyncio
+async def test_snapshot_leaves_out_unloaded_products_and_long_symbols(tmp_path):
+    path = str(tmp_path / "snapshot")
+    solana = _solana()
+    catalog = PythAccountCatalog(solana, _key(MAPPING))
+    await catalog.refresh()
+    btc, eth = catalog.products
+    # e.g. the price accounts of ETH could not be fetched
+    eth._prices = None
+    long_symbol = "Crypto." + "X" * 200 + "/USD"
+
+    write_snapshot(
+        path,
+        encode_snapshot(
+            catalog.mappings,
+            catalog.products,
+            {"Crypto.BTC/USD": BTC_LATEST, long_symbol: ETH_LATEST},
+        ),
+    )
+    snapshot = read_snapshot(path, solana)
+
+    assert [product.symbol for product in snapshot.products] == ["Crypto.BTC/USD"]
+    assert snapshot.prices == {"Crypto.BTC/USD": BTC_LATEST}
+
+
+def test_read_snapshot_without_a_valid_file(tmp_path):
+    assert read_snapshot(str(tmp_path / "missing"), FakeSolana({})) is None
+
+    path = tmp_path / "invalid"
+    path.write_bytes(b"not a snapshot at all")
+    with pytest.raises(ValueError):
+        read_snapshot(str(path), FakeSolana({}))
+
+
+@pytest.mark.asyncio
+async def test_replicator_starts_from_the_snapshot(tmp_path):
+    path = str(tmp_path / "snapshot")
+    await _write_snapshot(path)
+    replicator = make_replicator(first_mapping=_key(MAPPING), snapshot_path=path)
+
+    assert await replicator._load_accounts()
+    assert len(replicator._accounts) == 4
+    assert replicator._prices.get("Crypto.BTC/USD") == BTC_LATEST
+    assert replicator._prices.get("Crypto.ETH/USD") == ETH_LATEST
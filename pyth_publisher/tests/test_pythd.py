@@ -0,0 +1,262 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Set
+from unittest.mock import patch
+
+import pytest
+from aiohttp import WSMsgType, web
+from jsonrpc_base import ProtocolError, TransportError
+
+from pyth_publisher.pythd import (
+    TRADING,
+    BatchServer,
+    PriceUpdate,
+    PriceUpdateBatcher,
+    Pythd,
+)
+
+
+class FakePythAgent:
+    """A minimal pyth-agent websocket JSON-RPC server, supporting batch requests."""
+
+    def __init__(self) -> None:
+        self.frames: List[Any] = []
+        self.failing_accounts: Set[str] = set()
+        self.updates: Dict[str, Dict[str, Any]] = {}
+        self.subscriptions: Dict[int, str] = {}
+        self.next_subscription = 1
+        self.products: List[Dict[str, Any]] = []
+        self.connections: List[web.WebSocketResponse] = []
+        # Requests of these methods are never answered
+        self.unanswered_methods: Set[str] = set()
+
+    async def restart(self) -> None:
+        """Drop all the connections and forget the subscriptions, like a restart
+        of pyth-agent."""
+        for ws in list(self.connections):
+            await ws.close()
+        self.subscriptions = {}
+
+    async def notify_price_sched(self, subscription: int) -> None:
+        for ws in self.connections:
+            await ws.send_str(
+                json.dumps(
+                    {
+                        "jsonrpc": "2.0",
+                        "method": "notify_price_sched",
+                        "params": {"subscription": subscription},
+                    }
+                )
+            )
+
+    def _handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        params = request.get("params", {})
+        response: Dict[str, Any] = {"jsonrpc": "2.0", "id": request["id"]}
+        if request["method"] == "update_price":
+            if params["account"] in self.failing_accounts:
+                response["error"] = {"code": -32000, "message": "unknown account"}
+                return response
+            self.updates[params["account"]] = params
+            response["result"] = 0
+        elif request["method"] == "subscribe_price_sched":
+            if params["account"] in self.failing_accounts:
+                response["error"] = {"code": -32000, "message": "unknown account"}
+                return response
+            subscription = self.next_subscription
+            self.next_subscription += 1
+            self.subscriptions[subscription] = params["account"]
+            response["result"] = {"subscription": subscription}
+        elif request["method"] == "get_product_list":
+            response["result"] = self.products
+        else:
+            response["error"] = {"code": -32601, "message": "Method not found"}
+        return response
+
+    async def handler(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections.append(ws)
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            data = json.loads(msg.data)
+            self.frames.append(data)
+            if isinstance(data, dict) and data["method"] in self.unanswered_methods:
+                continue
+            if isinstance(data, list):
+                responses = [
+                    self._handle(d)
+                    for d in data
+                    if d["method"] not in self.unanswered_methods
+                ]
+                if responses:
+                    await ws.send_str(json.dumps(responses))
+            else:
+                await ws.send_str(json.dumps(self._handle(data)))
+        self.connections.remove(ws)
+        return ws
+
+
+@asynccontextmanager
+async def run_fake_pyth_agent(agent: FakePythAgent):
+    app = web.Application()
+    app.router.add_get("/", agent.handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        yield f"ws://127.0.0.1:{port}/"
+    finally:
+        await runner.cleanup()
+
+
+async def _noop_notify(subscription: int) -> None:
+    pass
+
+
+@pytest.mark.asyncio
+async def test_update_prices_sends_one_batch_with_per_item_errors():
+    agent = FakePythAgent()
+    agent.failing_accounts = {"account-1"}
+    async with run_fake_pyth_agent(agent) as url:
+        pythd = Pythd(url, _noop_notify)
+        await pythd.connect()
+
+        updates = [PriceUpdate(f"account-{i}", 100 + i, i) for i in range(3)]
+        errors = await pythd.update_prices(updates)
+        await pythd.close()
+
+    assert len(agent.frames) == 1
+    assert [request["params"]["account"] for request in agent.frames[0]] == [
+        "account-0",
+        "account-1",
+        "account-2",
+    ]
+    assert errors[0] is None
+    assert isinstance(errors[1], ProtocolError)
+    assert errors[2] is None
+    assert set(agent.updates) == {"account-0", "account-2"}
+
+
+@pytest.mark.asyncio
+async def test_update_prices_fail_when_the_batch_response_is_lost():
+    agent = FakePythAgent()
+    agent.unanswered_methods = {"update_price"}
+    async with run_fake_pyth_agent(agent) as url:
+        pythd = Pythd(url, _noop_notify, request_timeout_secs=0.1)
+        await pythd.connect()
+
+        updates = [PriceUpdate(f"account-{i}", 100 + i, i) for i in range(3)]
+        errors = await asyncio.wait_for(pythd.update_prices(updates), 1)
+        pending_messages = dict(pythd.server._pending_messages)
+        await pythd.close()
+
+    assert all(isinstance(error, TransportError) for error in errors)
+    assert pending_messages == {}
+
+
+@pytest.mark.asyncio
+async def test_batcher_flushes_on_window_and_max_size():
+    agent = FakePythAgent()
+    async with run_fake_pyth_agent(agent) as url:
+        pythd = Pythd(url, _noop_notify)
+        await pythd.connect()
+
+        batcher = PriceUpdateBatcher(pythd, window_secs=0.05, max_size=4)
+        for i in range(6):
+            batcher.submit(PriceUpdate(f"account-{i}", i, 1))
+        # The first 4 updates are sent right away, the rest once the window elapses
+        await asyncio.sleep(0.01)
+        assert [len(frame) for frame in agent.frames] == [4]
+        await asyncio.sleep(0.1)
+        assert [len(frame) for frame in agent.frames] == [4, 2]
+        await pythd.close()
+
+    assert set(agent.updates) == {f"account-{i}" for i in range(6)}
+
+
+@pytest.mark.asyncio
+async def test_subscribe_price_scheds_in_batches_of_max_size():
+    agent = FakePythAgent()
+    agent.failing_accounts = {"account-2"}
+    async with run_fake_pyth_agent(agent) as url:
+        pythd = Pythd(url, _noop_notify, batch_max_size=200)
+        await pythd.connect()
+
+        accounts = [f"account-{i}" for i in range(500)]
+        subscriptions = await pythd.subscribe_price_scheds(accounts)
+        await pythd.close()
+
+    assert [len(frame) for frame in agent.frames] == [200, 200, 100]
+    assert len(subscriptions) == 499
+    assert "account-2" not in subscriptions
+    assert {agent.subscriptions[s]: s for s in agent.subscriptions} == subscriptions
+
+
+@pytest.mark.asyncio
+async def test_notifications_are_dispatched_in_order_by_one_worker():
+    received = []
+    handler_tasks = set()
+
+    async def on_notify_price_sched(subscription: int) -> None:
+        handler_tasks.add(asyncio.current_task())
+        received.append(subscription)
+
+    agent = FakePythAgent()
+    async with run_fake_pyth_agent(agent) as url:
+        pythd = Pythd(url, on_notify_price_sched)
+        await pythd.connect()
+
+        # The notifications never reach the jsonrpc_websocket read loop, which
+        # would create a task to receive each of them
+        with patch.object(
+            BatchServer, "_receive_request", side_effect=AssertionError
+        ) as receive_request:
+            for subscription in range(100):
+                await agent.notify_price_sched(subscription)
+            for _ in range(100):
+                if len(received) == 100:
+                    break
+                await asyncio.sleep(0.01)
+        await pythd.close()
+
+    assert received == list(range(100))
+    assert len(handler_tasks) == 1
+    receive_request.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_reconnects_and_fails_pending_calls_when_connection_drops():
+    reconnected = asyncio.Event()
+
+    async def on_reconnect() -> None:
+        reconnected.set()
+
+    agent = FakePythAgent()
+    agent.unanswered_methods = {"update_price"}
+    async with run_fake_pyth_agent(agent) as url:
+        pythd = Pythd(
+            url,
+            _noop_notify,
+            on_reconnect=on_reconnect,
+            reconnect_initial_backoff_secs=0.01,
+        )
+        await pythd.connect()
+        pending_call = asyncio.create_task(
+            pythd.update_price("account-0", 1, 1, TRADING)
+        )
+        await asyncio.sleep(0.05)
+
+        await agent.restart()
+        with pytest.raises(ProtocolError):
+            await asyncio.wait_for(pending_call, 1)
+        await asyncio.wait_for(reconnected.wait(), 1)
+
+        subscriptions = await pythd.subscribe_price_scheds(["account-0"])
+        await pythd.close()
+
+    assert len(agent.connections) == 0
+    assert subscriptions == {"account-0": 1}